@@ -25,6 +25,11 @@ export async function migrate(args: string[]) {
       'ArticleScrapingStatsAccum',
       'ArticleScrapingStatsDyn',
       'ArticleSketch',
+      'ArticleSketchBand',
+      'ArticleSketchCompact',
+      'ArticleShingleSignature',
+      'ArticleSyndication',
+      'DupeDetectorLease',
       // Search
       'ArticleSearchScheme',
     ],
@@ -0,0 +1,41 @@
+import { Entity, model, property } from '@loopback/repository';
+
+
+// Hashed shingles of the original articles (persisted by the dupe detector),
+// used to verify dupe candidates without reading their full text.
+@model({
+  settings: {
+    postgresql: { schema: 'scraper', table: 'article_shingle_signature' },
+  },
+})
+export class ArticleShingleSignature extends Entity {
+  @property({
+    type: 'number',
+    required: true,
+    id: true,
+    postgresql: {
+      columnName: 'article_id',
+      // 64 bits
+      dataType: 'BIGINT',
+      nullable: 'NO',
+    },
+  })
+  articleId: number;
+
+  @property({
+    type: 'array',
+    itemType: 'number',
+    postgresql: {
+      columnName: 'shingle_hashes',
+      // Sorted 32 bit hashes
+      dataType: 'INTEGER[]',
+      nullable: 'NO',
+    }
+  })
+  shingleHashes: number[];
+}
+
+export interface ArticleShingleSignatureRelations {
+}
+
+export type ArticleShingleSignatureWithRelations = ArticleShingleSignature & ArticleShingleSignatureRelations;
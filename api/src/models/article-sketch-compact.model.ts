@@ -0,0 +1,65 @@
+import { Entity, model, property } from '@loopback/repository';
+
+
+// Compact alternative to article_sketch (see SKETCH_STORAGE in the dupe
+// detector): a single row per article holding all its sketch hashes.
+// The hashes are looked up with a GIN index (see
+// database/scripts/dupe-detector-sketch-compact-index.sql).
+@model({
+  settings: {
+    postgresql: { schema: 'scraper', table: 'article_sketch_compact' },
+  },
+})
+export class ArticleSketchCompact extends Entity {
+  @property({
+    type: 'number',
+    required: true,
+    id: true,
+    postgresql: {
+      columnName: 'article_id',
+      // 64 bits
+      dataType: 'BIGINT',
+      nullable: 'NO',
+    },
+  })
+  articleId: number;
+
+  @property({
+    type: 'date',
+    postgresql: {
+      columnName: 'date',
+      // 32 bits
+      dataType: 'DATE',
+      nullable: 'NO',
+    }
+  })
+  date: string;
+
+  @property({
+    type: 'number',
+    postgresql: {
+      columnName: 'article_source_id_hash',
+      // 16 bits
+      dataType: 'SMALLINT',
+      nullable: 'NO',
+    }
+  })
+  articleSourceId: number;
+
+  @property({
+    type: 'array',
+    itemType: 'number',
+    postgresql: {
+      columnName: 'hashes',
+      // 32 bit sketch hashes
+      dataType: 'INTEGER[]',
+      nullable: 'NO',
+    }
+  })
+  hashes: number[];
+}
+
+export interface ArticleSketchCompactRelations {
+}
+
+export type ArticleSketchCompactWithRelations = ArticleSketchCompact & ArticleSketchCompactRelations;
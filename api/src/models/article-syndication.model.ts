@@ -0,0 +1,42 @@
+import { Entity, model, property } from '@loopback/repository';
+
+
+// Cross-source syndication clusters (persisted by the dupe detector): original
+// articles of different sources with near identical texts share a cluster id,
+// which is the id of the first article of the cluster.
+@model({
+  settings: {
+    postgresql: { schema: 'scraper', table: 'article_syndication' },
+  },
+})
+export class ArticleSyndication extends Entity {
+  @property({
+    type: 'number',
+    required: true,
+    id: true,
+    postgresql: {
+      columnName: 'article_id',
+      // 64 bits
+      dataType: 'BIGINT',
+      nullable: 'NO',
+    },
+  })
+  articleId: number;
+
+  @property({
+    type: 'number',
+    index: true,
+    postgresql: {
+      columnName: 'cluster_id',
+      // 64 bits
+      dataType: 'BIGINT',
+      nullable: 'NO',
+    }
+  })
+  clusterId: number;
+}
+
+export interface ArticleSyndicationRelations {
+}
+
+export type ArticleSyndicationWithRelations = ArticleSyndication & ArticleSyndicationRelations;
@@ -0,0 +1,91 @@
+import { Entity, model, property } from '@loopback/repository';
+
+
+// Dupe detector work partitions (one per article source id hash),
+// claimed by the dupe detector workers for a limited time.
+@model({
+  settings: {
+    postgresql: { schema: 'scraper', table: 'dupe_detector_lease' },
+  },
+})
+export class DupeDetectorLease extends Entity {
+  @property({
+    type: 'number',
+    required: true,
+    id: true,
+    postgresql: {
+      columnName: 'article_source_id_hash',
+      // 16 bits
+      dataType: 'SMALLINT',
+      nullable: 'NO',
+    },
+  })
+  articleSourceIdHash: number;
+
+  @property({
+    type: 'string',
+    postgresql: {
+      columnName: 'worker_id',
+      dataType: 'VARCHAR',
+      dataLength: 128,
+      nullable: 'YES',
+    }
+  })
+  workerId?: string;
+
+  @property({
+    type: 'date',
+    postgresql: {
+      columnName: 'expires_at',
+      dataType: 'TIMESTAMP WITH TIME ZONE',
+      nullable: 'YES',
+    }
+  })
+  expiresAt?: string;
+
+  // Last claim time: the least recently claimed partitions are claimed first
+  @property({
+    type: 'date',
+    postgresql: {
+      columnName: 'claimed_at',
+      dataType: 'TIMESTAMP WITH TIME ZONE',
+      nullable: 'YES',
+    }
+  })
+  claimedAt?: string;
+
+  @property({
+    type: 'number',
+    postgresql: {
+      columnName: 'processed_count',
+      dataType: 'BIGINT',
+      nullable: 'NO',
+    }
+  })
+  processedCount: number;
+
+  @property({
+    type: 'date',
+    postgresql: {
+      columnName: 'last_article_date',
+      dataType: 'DATE',
+      nullable: 'YES',
+    }
+  })
+  lastArticleDate?: string;
+
+  @property({
+    type: 'date',
+    postgresql: {
+      columnName: 'updated_at',
+      dataType: 'TIMESTAMP WITH TIME ZONE',
+      nullable: 'YES',
+    }
+  })
+  updatedAt?: string;
+}
+
+export interface DupeDetectorLeaseRelations {
+}
+
+export type DupeDetectorLeaseWithRelations = DupeDetectorLease & DupeDetectorLeaseRelations;
@@ -13,6 +13,11 @@ export * from './search-date-span.model';
 export * from './article-boolean-query.model';
 export * from './article-search-scheme.model';
 export * from './article-sketch.model';
+export * from './article-sketch-band.model';
+export * from './article-sketch-compact.model';
+export * from './article-syndication.model';
+export * from './article-shingle-signature.model';
+export * from './dupe-detector-lease.model';
 export * from './user.model';
 export * from './user-summary.model';
 export * from './role.model';
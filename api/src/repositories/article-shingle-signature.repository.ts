@@ -0,0 +1,16 @@
+import {DefaultCrudRepository} from '@loopback/repository';
+import {ArticleShingleSignature, ArticleShingleSignatureRelations} from '../models';
+import {DbDataSource} from '../datasources';
+import {inject} from '@loopback/core';
+
+export class ArticleShingleSignatureRepository extends DefaultCrudRepository<
+  ArticleShingleSignature,
+  typeof ArticleShingleSignature.prototype.articleId,
+  ArticleShingleSignatureRelations
+> {
+  constructor(
+    @inject('datasources.db') dataSource: DbDataSource,
+  ) {
+    super(ArticleShingleSignature, dataSource);
+  }
+}
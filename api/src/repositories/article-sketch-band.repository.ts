@@ -0,0 +1,16 @@
+import {DefaultCrudRepository} from '@loopback/repository';
+import {ArticleSketchBand, ArticleSketchBandRelations} from '../models';
+import {DbDataSource} from '../datasources';
+import {inject} from '@loopback/core';
+
+export class ArticleSketchBandRepository extends DefaultCrudRepository<
+  ArticleSketchBand,
+  typeof ArticleSketchBand.prototype.id,
+  ArticleSketchBandRelations
+> {
+  constructor(
+    @inject('datasources.db') dataSource: DbDataSource,
+  ) {
+    super(ArticleSketchBand, dataSource);
+  }
+}
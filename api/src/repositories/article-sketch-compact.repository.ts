@@ -0,0 +1,16 @@
+import {DefaultCrudRepository} from '@loopback/repository';
+import {ArticleSketchCompact, ArticleSketchCompactRelations} from '../models';
+import {DbDataSource} from '../datasources';
+import {inject} from '@loopback/core';
+
+export class ArticleSketchCompactRepository extends DefaultCrudRepository<
+  ArticleSketchCompact,
+  typeof ArticleSketchCompact.prototype.articleId,
+  ArticleSketchCompactRelations
+> {
+  constructor(
+    @inject('datasources.db') dataSource: DbDataSource,
+  ) {
+    super(ArticleSketchCompact, dataSource);
+  }
+}
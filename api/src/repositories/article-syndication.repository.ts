@@ -0,0 +1,16 @@
+import {DefaultCrudRepository} from '@loopback/repository';
+import {ArticleSyndication, ArticleSyndicationRelations} from '../models';
+import {DbDataSource} from '../datasources';
+import {inject} from '@loopback/core';
+
+export class ArticleSyndicationRepository extends DefaultCrudRepository<
+  ArticleSyndication,
+  typeof ArticleSyndication.prototype.articleId,
+  ArticleSyndicationRelations
+> {
+  constructor(
+    @inject('datasources.db') dataSource: DbDataSource,
+  ) {
+    super(ArticleSyndication, dataSource);
+  }
+}
@@ -0,0 +1,16 @@
+import {DefaultCrudRepository} from '@loopback/repository';
+import {DupeDetectorLease, DupeDetectorLeaseRelations} from '../models';
+import {DbDataSource} from '../datasources';
+import {inject} from '@loopback/core';
+
+export class DupeDetectorLeaseRepository extends DefaultCrudRepository<
+  DupeDetectorLease,
+  typeof DupeDetectorLease.prototype.articleSourceIdHash,
+  DupeDetectorLeaseRelations
+> {
+  constructor(
+    @inject('datasources.db') dataSource: DbDataSource,
+  ) {
+    super(DupeDetectorLease, dataSource);
+  }
+}
@@ -8,6 +8,11 @@ export * from './article-search.repository';
 export * from './article-search-scheme.repository';
 export * from './article-summary.repository';
 export * from './article-sketch.repository';
+export * from './article-sketch-band.repository';
+export * from './article-sketch-compact.repository';
+export * from './article-syndication.repository';
+export * from './article-shingle-signature.repository';
+export * from './dupe-detector-lease.repository';
 export * from './user.repository';
 export * from './refresh-token.repository';
 export * from './user-summary.repository';
@@ -0,0 +1,22 @@
+-- Notifies the dupe detector (event-driven mode, NOTIFY_ENABLED=True) of every
+-- new article pending dupe detection, so that it is processed within seconds
+-- instead of waiting for the next polling cycle. The payload is the article id.
+--
+-- The channel name must match ARTICLE_NOTIFY_CHANNEL in the dupe detector.
+CREATE OR REPLACE FUNCTION scraper.notify_article_pending() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('article_pending', NEW.id::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS article_pending_notify_trg ON scraper.article;
+
+CREATE TRIGGER article_pending_notify_trg
+AFTER
+INSERT
+    ON scraper.article FOR EACH ROW
+    WHEN (
+        NEW.is_duplicate IS NULL
+        AND NEW.result = 'success'
+    ) EXECUTE PROCEDURE scraper.notify_article_pending();
@@ -0,0 +1,11 @@
+-- Partial index used by the dupe detector to stream the pending
+-- articles ordered by (date, id) with a keyset condition, i.e.:
+--
+--   WHERE is_duplicate IS NULL AND result = 'success' AND (date, id) > (?, ?)
+--   ORDER BY date, id
+--
+-- Only not yet processed articles are indexed, so it stays small.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS article_pending_dupe_detection_idx ON scraper.article (date, id)
+WHERE
+    is_duplicate IS NULL
+    AND result = 'success';
@@ -0,0 +1,11 @@
+-- Indexes of the compact sketch storage (scraper.article_sketch_compact, one row
+-- per article), used by the dupe detector candidates query when
+-- SKETCH_STORAGE = 'compact', i.e.:
+--
+--   WHERE article_source_id_hash = ? AND date IN (...) AND hashes && ARRAY[...]
+--
+-- The GIN index resolves the hashes overlap (&&), the btree one the
+-- source / dates window. Postgres combines them with a bitmap AND.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS article_sketch_compact_hashes_idx ON scraper.article_sketch_compact USING GIN (hashes);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS article_sketch_compact_source_date_idx ON scraper.article_sketch_compact (article_source_id_hash, date);
@@ -0,0 +1,8 @@
+-- Index of the already persisted checks of the scraper (ArticleDbHandler:
+-- get_already_persisted_articles, is_article_already_persisted, persist_many),
+-- i.e.:
+--
+--   WHERE article_source_id = ? AND url = ANY(ARRAY[...]) AND result = 'success'
+--
+-- Partial: only the successful articles are looked up.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS article_source_url_success_idx ON scraper.article (article_source_id, url) WHERE result = 'success';
@@ -0,0 +1 @@
+python -u -m src.test.benchmark
\ No newline at end of file
@@ -0,0 +1 @@
+python -u -m src.test.profiler_copy_test
\ No newline at end of file
@@ -0,0 +1 @@
+python -u -m etc.dupe-detector.src.rededup_articles
@@ -0,0 +1 @@
+python -u -m src.test.rededup_test
\ No newline at end of file
@@ -0,0 +1 @@
+python -u -m etc.dupe-detector.src.sketch_compact_backfill
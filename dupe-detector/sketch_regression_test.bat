@@ -0,0 +1 @@
+python -u -m src.test.sketch_regression_test
\ No newline at end of file
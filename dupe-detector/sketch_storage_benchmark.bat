@@ -0,0 +1 @@
+python -u -m src.test.sketch_storage_benchmark
\ No newline at end of file
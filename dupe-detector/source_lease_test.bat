@@ -0,0 +1 @@
+python -u -m src.test.source_lease_test
\ No newline at end of file
@@ -0,0 +1,98 @@
+from typing import Any, Callable
+
+import logging
+import select
+import time
+
+import psycopg2  # type: ignore
+
+
+class ArticleNotificationListener(object):
+    """
+    Event-driven wake up of the dupe detector: LISTENs on the channel notified
+    by the article insert trigger (see dupe-detector-article-notify-trigger.sql).
+
+    wait() blocks until an article is notified or timeout_sec elapses, so the
+    polling interval is kept as a safety net for lost notifications (e.g. while
+    the listener connection is down). After the first notification it keeps
+    collecting them for debounce_sec, so that the articles are processed in
+    micro-batches instead of one cycle per article.
+
+    Attributes:
+        get_connection (Callable): opens a new db connection.
+        channel (str): notification channel.
+        debounce_sec (float): time the notifications are collected for.
+    """
+
+    cnxn: Any
+
+    def __init__(
+        self, get_connection: Callable[[], Any], channel: str, debounce_sec: float,
+    ):
+        self.get_connection = get_connection
+        self.channel = channel
+        self.debounce_sec = debounce_sec
+        self.cnxn = None
+
+    def connect(self):
+        self.cnxn = self.get_connection()
+        # LISTEN takes effect (and notifications are delivered)
+        # outside of transactions only
+        self.cnxn.autocommit = True
+        cursor = self.cnxn.cursor()
+        cursor.execute(f"LISTEN {self.channel}")
+        cursor.close()
+
+    # Discards the received notifications (the articles are about to be
+    # read anyway). Returns the number of notifications discarded.
+    def drain(self) -> int:
+        if self.cnxn is None:
+            return 0
+        try:
+            self.cnxn.poll()
+        except psycopg2.Error:
+            self.close()
+            return 0
+        count = len(self.cnxn.notifies)
+        self.cnxn.notifies.clear()
+        return count
+
+    # Returns the number of notified articles (0 on timeout)
+    def wait(self, timeout_sec: float) -> int:
+        try:
+            if self.cnxn is None:
+                self.connect()
+
+            if len(self.cnxn.notifies) == 0:
+                self.receive(timeout_sec)
+                if len(self.cnxn.notifies) == 0:
+                    return 0
+
+            # Collect the notifications of the micro-batch
+            deadline = time.time() + self.debounce_sec
+            while time.time() < deadline:
+                self.receive(deadline - time.time())
+
+            return self.drain()
+
+        except psycopg2.Error as e:
+            # Fall back to polling, reconnect on the next wait
+            logging.warning(f">> Notification listener error: {e}")
+            self.close()
+            time.sleep(timeout_sec)
+            return 0
+
+    # Waits up to timeout_sec for data on the connection,
+    # and moves the received notifications into cnxn.notifies
+    def receive(self, timeout_sec: float):
+        readable, _, _ = select.select([self.cnxn], [], [], max(0, timeout_sec))
+        if len(readable) > 0:
+            self.cnxn.poll()
+
+    def close(self):
+        if self.cnxn is not None:
+            try:
+                self.cnxn.close()
+            except psycopg2.Error:
+                pass
+            self.cnxn = None
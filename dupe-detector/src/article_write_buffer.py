@@ -0,0 +1,319 @@
+from typing import AbstractSet, Callable, Dict, List, Tuple, Any, Union
+
+import io
+import time
+from itertools import groupby
+from datetime import date as Date
+
+import psycopg2.extras  # type: ignore
+
+
+class PendingSketch(object):
+    def __init__(self, article_id: int, date: Date, hashes: List[int]):
+        self.article_id = article_id
+        self.date = date
+        self.hashes = hashes
+
+
+class ArticleWriteBuffer(object):
+    """
+    Write-behind stage of the dupe detector. Collects the sketch rows and the
+    is_duplicate / original_article_id results of the processed articles, and
+    persists them in bulk (COPY for the sketches, a single UPDATE ... FROM (VALUES ...)
+    for the results), in one transaction per flush.
+
+    Articles set as originals are not visible to the candidate query until they
+    are flushed, so the buffer keeps their sketches and find_pending_candidates
+    performs the same collision count in memory.
+
+    The shingle signatures (sorted shingle hashes) of the originals are also
+    persisted if signature_table is set.
+
+    With compact_sketches, the sketch of every article is persisted as a single
+    row holding all its hashes (sketch_hash_column is an array column).
+
+    The syndication clusters (see SyndicationIndex) are persisted to
+    syndication_table if set: the (article id, cluster id) rows are upserted,
+    then the cluster merges are applied in order.
+
+    If fence is set, it is called first in every flush transaction with its
+    cursor, and returns the partitions (article_source_id_hash) that are no
+    longer owned by this worker (see SourceLeaseManager.renew): the buffered
+    results of those partitions are dropped instead of persisted. The clusters
+    of the SyndicationIndex may refer to the dropped articles, so it must be
+    reset once partitions are lost.
+
+    Attributes:
+        flush_size (int): number of buffered results that triggers a flush.
+        flush_interval_sec (float): max time the results stay buffered.
+        sketch_table (str): table the sketches are persisted to.
+        sketch_hash_column (str): column of the sketch table holding the hashes.
+        signature_table (str): table the shingle signatures are persisted to.
+        compact_sketches (bool): one sketch row per article instead of per hash.
+        syndication_table (str): table the syndication clusters are persisted to.
+        fence: returns the lost partitions, in the flush transaction.
+    """
+
+    cnxn: Any
+    sketch_rows: List[Tuple[int, int, Date, int]]
+    signature_rows: List[Tuple[int, List[int]]]
+    results: List[Tuple[int, bool, int]]
+    syndication_rows: Dict[int, int]
+    cluster_merges: List[Tuple[int, int]]
+    pending_originals: Dict[int, List[PendingSketch]]
+    article_source_id_hashes: Dict[int, int]
+
+    def __init__(
+        self,
+        cnxn: Any,
+        flush_size: int,
+        flush_interval_sec: float,
+        sketch_table: str = "scraper.article_sketch",
+        sketch_hash_column: str = "hash",
+        signature_table: Union[str, None] = None,
+        compact_sketches: bool = False,
+        syndication_table: Union[str, None] = None,
+        fence: Union[Callable[[Any], AbstractSet[int]], None] = None,
+    ):
+        self.cnxn = cnxn
+        self.flush_size = flush_size
+        self.flush_interval_sec = flush_interval_sec
+        self.sketch_table = sketch_table
+        self.sketch_hash_column = sketch_hash_column
+        self.signature_table = signature_table
+        self.compact_sketches = compact_sketches
+        self.syndication_table = syndication_table
+        self.fence = fence
+        self.sketch_rows = []
+        self.signature_rows = []
+        self.results = []
+        self.syndication_rows = {}
+        self.cluster_merges = []
+        self.pending_originals = {}
+        self.article_source_id_hashes = {}
+        self.last_flush_time = time.time()
+
+    def add_article(
+        self,
+        article_id: int,
+        date: Date,
+        article_source_id_hash: int,
+        hashes: List[int],
+        is_duplicate: bool,
+        original_article_id: int,
+        shingle_hashes: Union[AbstractSet[int], None] = None,
+    ):
+        for h in hashes:
+            self.sketch_rows.append((article_id, h, date, article_source_id_hash))
+
+        self.results.append((article_id, is_duplicate, original_article_id))
+        self.article_source_id_hashes[article_id] = article_source_id_hash
+
+        if not is_duplicate and len(hashes) > 0:
+            self.pending_originals.setdefault(article_source_id_hash, []).append(
+                PendingSketch(article_id, date, hashes)
+            )
+
+        # Only originals can be candidates --> only their signatures are needed
+        if (
+            self.signature_table is not None
+            and not is_duplicate
+            and shingle_hashes is not None
+        ):
+            self.signature_rows.append((article_id, sorted(shingle_hashes)))
+
+        if self.should_flush():
+            self.flush()
+
+    # (article id --> cluster id) rows and (old cluster id, new cluster id)
+    # merges of a SyndicationIndex.add. Flushed along with the results.
+    def add_syndication(
+        self, syndication_rows: Dict[int, int], cluster_merges: List[Tuple[int, int]]
+    ):
+        # An article may be in several adds: the last cluster id is the current one
+        self.syndication_rows.update(syndication_rows)
+        self.cluster_merges.extend(cluster_merges)
+
+    # In-memory equivalent of the candidates query, restricted to the buffered
+    # (not yet persisted) originals. Returns the (article id, collision count)
+    # pairs of the matching articles.
+    def find_pending_candidates(
+        self,
+        hashes: List[int],
+        dates: List[Date],
+        article_source_id_hash: int,
+        count_thresh: float,
+    ) -> List[Tuple[int, int]]:
+
+        hashes_set = set(hashes)
+        dates_set = set(dates)
+        candidates: List[Tuple[int, int]] = []
+
+        for pending in self.pending_originals.get(article_source_id_hash, []):
+            if pending.date not in dates_set:
+                continue
+            count = sum(1 for h in pending.hashes if h in hashes_set)
+            if count > count_thresh:
+                candidates.append((pending.article_id, count))
+
+        return candidates
+
+    def should_flush(self) -> bool:
+        return (
+            len(self.results) >= self.flush_size
+            or time.time() - self.last_flush_time >= self.flush_interval_sec
+        )
+
+    def flush(self):
+        self.last_flush_time = time.time()
+
+        if (
+            len(self.sketch_rows) == 0
+            and len(self.results) == 0
+            and len(self.signature_rows) == 0
+            and len(self.syndication_rows) == 0
+        ):
+            return
+
+        cursor = self.cnxn.cursor()
+
+        if self.fence is not None:
+            lost_hashes = self.fence(cursor)
+            if len(lost_hashes) > 0:
+                self.drop_partitions(lost_hashes)
+
+        if len(self.sketch_rows) > 0:
+            if self.compact_sketches:
+                # The rows of an article are contiguous --> one array per article
+                lines = (
+                    f"{article_id}\t{{{','.join(str(row[1]) for row in rows)}}}\t{date}\t{article_source_id_hash}\n"
+                    for (article_id, date, article_source_id_hash), rows in groupby(
+                        self.sketch_rows, key=lambda row: (row[0], row[2], row[3])
+                    )
+                )
+            else:
+                lines = (
+                    f"{article_id}\t{h}\t{date}\t{article_source_id_hash}\n"
+                    for article_id, h, date, article_source_id_hash in self.sketch_rows
+                )
+            cursor.copy_expert(
+                f"""
+                COPY
+                        {self.sketch_table}(
+                            article_id,
+                            {self.sketch_hash_column},
+                            date,
+                            article_source_id_hash
+                        )
+                FROM STDIN
+                """,
+                io.StringIO("".join(lines)),
+            )
+
+        if len(self.signature_rows) > 0:
+            data = io.StringIO(
+                "".join(
+                    f"{article_id}\t{{{','.join(map(str, shingle_hashes))}}}\n"
+                    for article_id, shingle_hashes in self.signature_rows
+                )
+            )
+            cursor.copy_expert(
+                f"""
+                COPY
+                        {self.signature_table}(
+                            article_id,
+                            shingle_hashes
+                        )
+                FROM STDIN
+                """,
+                data,
+            )
+
+        if len(self.results) > 0:
+            psycopg2.extras.execute_values(
+                cursor,
+                """
+                UPDATE
+                        scraper.article AS article
+                SET
+                        is_duplicate = data.is_duplicate,
+                        original_article_id = data.original_article_id
+                FROM
+                        (VALUES %s) AS data(id, is_duplicate, original_article_id)
+                WHERE
+                        article.id = data.id
+                """,
+                self.results,
+                page_size=len(self.results),
+            )
+
+        if len(self.syndication_rows) > 0:
+            psycopg2.extras.execute_values(
+                cursor,
+                f"""
+                INSERT INTO
+                        {self.syndication_table}(article_id, cluster_id)
+                VALUES %s
+                ON CONFLICT (article_id) DO UPDATE
+                SET
+                        cluster_id = EXCLUDED.cluster_id
+                """,
+                list(self.syndication_rows.items()),
+                page_size=len(self.syndication_rows),
+            )
+
+        if len(self.cluster_merges) > 0:
+            # In order: a cluster may be merged into one that is merged later
+            psycopg2.extras.execute_batch(
+                cursor,
+                f"""
+                UPDATE
+                        {self.syndication_table}
+                SET
+                        cluster_id = %s
+                WHERE
+                        cluster_id = %s
+                """,
+                [(new_id, old_id) for old_id, new_id in self.cluster_merges],
+            )
+
+        self.cnxn.commit()
+        cursor.close()
+        self.clear()
+
+    def clear(self):
+        self.sketch_rows = []
+        self.signature_rows = []
+        self.results = []
+        self.syndication_rows = {}
+        self.cluster_merges = []
+        self.pending_originals = {}
+        self.article_source_id_hashes = {}
+
+    # Drops the buffered results of the articles of the given partitions, and
+    # the syndication rows and merges that refer to them (as article or cluster)
+    def drop_partitions(self, article_source_id_hashes: AbstractSet[int]):
+        dropped_ids = set(
+            article_id
+            for article_id, h in self.article_source_id_hashes.items()
+            if h in article_source_id_hashes
+        )
+        self.sketch_rows = [
+            row for row in self.sketch_rows if row[3] not in article_source_id_hashes
+        ]
+        self.signature_rows = [
+            row for row in self.signature_rows if row[0] not in dropped_ids
+        ]
+        self.results = [row for row in self.results if row[0] not in dropped_ids]
+        self.syndication_rows = {
+            article_id: cluster_id
+            for article_id, cluster_id in self.syndication_rows.items()
+            if article_id not in dropped_ids and cluster_id not in dropped_ids
+        }
+        self.cluster_merges = [
+            (old_id, new_id)
+            for old_id, new_id in self.cluster_merges
+            if old_id not in dropped_ids and new_id not in dropped_ids
+        ]
+        for h in article_source_id_hashes:
+            self.pending_originals.pop(h, None)
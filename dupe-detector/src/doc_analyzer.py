@@ -0,0 +1,100 @@
+from typing import Any, FrozenSet, Iterator, List, Tuple
+
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from .doc_sketch import DocSketchGenerator
+from .doc_comparator import get_shingle_hashes
+
+# (sketch, shingle hashes)
+DocAnalysis = Tuple[List[int], FrozenSet[int]]
+
+# Per worker process sketch generator (see init_worker)
+worker_sketch_generator: DocSketchGenerator
+
+
+def init_worker(sketch_generator: DocSketchGenerator):
+    global worker_sketch_generator
+    worker_sketch_generator = sketch_generator
+
+
+def analyze_docs(docs: List[str]) -> List[DocAnalysis]:
+    return analyze_docs_with(worker_sketch_generator, docs)
+
+
+def analyze_docs_with(
+    sketch_generator: DocSketchGenerator, docs: List[str]
+) -> List[DocAnalysis]:
+    # The shingles are extracted once, and used both for the sketch and
+    # (hashed) for the comparison against the candidates
+    shingle_lists = [sketch_generator.extract_shingle_list(doc) for doc in docs]
+    sketches = sketch_generator.generate_sketches_from_shingles(shingle_lists)
+    return [
+        (sketch, get_shingle_hashes(shingles))
+        for sketch, shingles in zip(sketches, shingle_lists)
+    ]
+
+
+class DocAnalyzer(object):
+    """
+    Runs the CPU bound stages of the dupe detector (tokenization, shingling and
+    sketching) on a pool of worker processes. Each submitted chunk of docs is
+    split among the workers, and the results keep the order of the docs.
+
+    With num_processes = 0 everything runs in the calling process.
+    """
+
+    def __init__(self, sketch_generator: DocSketchGenerator, num_processes: int):
+        self.sketch_generator = sketch_generator
+        self.num_processes = num_processes
+        self.executor = (
+            ProcessPoolExecutor(
+                num_processes, initializer=init_worker, initargs=(sketch_generator,)
+            )
+            if num_processes > 0
+            else None
+        )
+
+    def submit(self, docs: List[str]) -> List["Future[List[DocAnalysis]]"]:
+        if self.executor is None:
+            future: "Future[List[DocAnalysis]]" = Future()
+            future.set_result(analyze_docs_with(self.sketch_generator, docs))
+            return [future]
+
+        part_size = max(1, -(-len(docs) // self.num_processes))
+        return [
+            self.executor.submit(analyze_docs, docs[i : i + part_size])
+            for i in range(0, len(docs), part_size)
+        ]
+
+    # Pipelines the chunks of rows: the next chunk is analyzed by the workers
+    # while the rows of the current one are yielded (in order), together with
+    # their analysis. get_doc maps a row into its doc.
+    def analyze_chunks(
+        self, chunks: Iterator[List[Any]], get_doc
+    ) -> Iterator[Tuple[Any, List[int], FrozenSet[int]]]:
+
+        pending = None
+
+        for rows in chunks:
+            futures = self.submit([get_doc(row) for row in rows])
+
+            if pending is not None:
+                yield from self.get_results(*pending)
+
+            pending = (rows, futures)
+
+        if pending is not None:
+            yield from self.get_results(*pending)
+
+    def get_results(
+        self, rows: List[Any], futures: List["Future[List[DocAnalysis]]"]
+    ) -> Iterator[Tuple[Any, List[int], FrozenSet[int]]]:
+
+        analysis = [a for future in futures for a in future.result()]
+
+        for row, (sketch, shingle_hashes) in zip(rows, analysis):
+            yield row, sketch, shingle_hashes
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown()
@@ -3,17 +3,52 @@
 
 import string
 import sys
-import gensim
-from typing import List
+import hashlib
+import heapq
+from typing import AbstractSet, FrozenSet, Iterable, List
+
+from .tokenizer import simple_preprocess
+
+
+def shingle_hash(shingle: str) -> int:
+    # Deterministic (unlike hash()), so that hashes computed by different
+    # processes (or persisted, see article_shingle_signature) can be compared.
+    # Signed 32 bits: collisions are negligible for the size of the shingle sets.
+    return int.from_bytes(
+        hashlib.blake2b(shingle.encode("utf-8"), digest_size=4).digest(),
+        "little",
+        signed=True,
+    )
+
+
+def get_shingle_hashes(shingles: Iterable[str]) -> FrozenSet[int]:
+    return frozenset(shingle_hash(sh) for sh in shingles)
+
+
+def sample_shingles(shingles: List[str], max_num_shingles: int) -> List[str]:
+    """
+    Deterministic bottom-k sampling: keeps the max_num_shingles shingles with the
+    lowest hashes (see shingle_hash). Shingles are either kept in every doc or in
+    none, so the shingles in common of two docs tend to survive the sampling.
+    The input list must be sorted (ties are kept in input order).
+    """
+    if len(shingles) <= max_num_shingles:
+        return shingles
+    return sorted(heapq.nsmallest(max_num_shingles, shingles, key=shingle_hash))
 
 
 class DocComparator(object):
     def __init__(
-        self, shingle_length: int, max_num_shingles: int, overlap_threshold: float,
+        self,
+        shingle_length: int,
+        max_num_shingles: int,
+        overlap_threshold: float,
+        bottom_k_sampling: bool = False,
     ):
         self.shingle_length = shingle_length
         self.max_num_shingles = max_num_shingles
         self.overlap_threshold = overlap_threshold
+        self.bottom_k_sampling = bottom_k_sampling
 
     def compare_docs(self, doc1: str, doc2: str) -> bool:
         shingles1 = self.extract_shingle_list(doc1)
@@ -21,6 +56,15 @@ class DocComparator(object):
         overlap = self.jaccard(shingles1, shingles2)
         return overlap > self.overlap_threshold
 
+    def compare_shingles(self, shingles1: List[str], shingles2: List[str]) -> bool:
+        return self.jaccard(shingles1, shingles2) > self.overlap_threshold
+
+    # Same as compare_shingles, over hashed shingle sets (see get_shingle_hashes)
+    def compare_shingle_hashes(
+        self, hashes1: AbstractSet[int], hashes2: AbstractSet[int]
+    ) -> bool:
+        return self.jaccard_sets(hashes1, hashes2) > self.overlap_threshold
+
     def docs_similarity(self, doc1: str, doc2: str) -> float:
         shingles1 = self.extract_shingle_list(doc1)
         shingles2 = self.extract_shingle_list(doc2)
@@ -29,14 +73,25 @@ class DocComparator(object):
     def extract_shingle_list(self, doc: str) -> List[str]:
         shingles_set = set()
 
-        tokens = gensim.utils.simple_preprocess(doc)
+        tokens = simple_preprocess(doc)
         for i in range(0, len(tokens) - self.shingle_length + 1):
             shingles_set.add(" ".join(tokens[i : i + self.shingle_length]))
 
+        if self.bottom_k_sampling:
+            return sample_shingles(sorted(shingles_set), self.max_num_shingles)
+
         return sorted(shingles_set)
 
+    def extract_shingle_hashes(self, doc: str) -> FrozenSet[int]:
+        return get_shingle_hashes(self.extract_shingle_list(doc))
+
     # Jaccard Similarity function
     def jaccard(self, list1, list2):
         intersection = len(list(set(list1).intersection(list2)))
         union = (len(list1) + len(list2)) - intersection
         return float(intersection) / union
+
+    def jaccard_sets(self, set1: AbstractSet[int], set2: AbstractSet[int]) -> float:
+        intersection = len(set1 & set2)
+        union = (len(set1) + len(set2)) - intersection
+        return float(intersection) / union
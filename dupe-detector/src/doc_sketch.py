@@ -3,13 +3,36 @@
 
 import string
 import sys
-import gensim
-from typing import List
+import numpy as np
+from typing import List, Union
+
+from .tokenizer import simple_preprocess
+from .doc_comparator import sample_shingles
 
 
 guid = lambda x: ord(x)
 
 
+def get_sketch_decision(
+    hash_collisions: int,
+    num_hashes: int,
+    accept_thresh: float,
+    reject_thresh: float,
+) -> Union[bool, None]:
+    """
+    Early duplicate decision from the sketches alone: the fraction of min hashes
+    two docs have in common estimates the Jaccard similarity of their shingle
+    sets. Returns True (duplicate) if the estimate is >= accept_thresh, False if
+    it is < reject_thresh, and None if it is ambiguous (exact comparison needed).
+    """
+    similarity = hash_collisions / num_hashes
+    if similarity >= accept_thresh:
+        return True
+    if similarity < reject_thresh:
+        return False
+    return None
+
+
 class DocSketchGenerator(object):
     """
     Based on: 
@@ -22,6 +45,8 @@ class DocSketchGenerator(object):
     Attributes:
         base (Optional[int]): base required for computing the rolling hash function. Defaults to 101.
         modulo (Optional[int]): hash values cannot exceed this value. Defaults to sys.maxint.
+        bottom_k_sampling (bool): keep at most max_num_shingles shingles per doc
+            (see doc_comparator.sample_shingles). Must match the DocComparator's.
     """
 
     def __init__(
@@ -31,37 +56,86 @@ class DocSketchGenerator(object):
         permutations: List[int],
         shingle_length: int,
         max_num_shingles: int,
+        bottom_k_sampling: bool = False,
     ):
         self.base = base
         self.modulo = modulo
         self.permutations = permutations
         self.shingle_length = shingle_length
         self.max_num_shingles = max_num_shingles
+        self.bottom_k_sampling = bottom_k_sampling
 
     def generate_sketch(self, doc: str) -> List[int]:
-        shingles = self.extract_shingle_list(doc)
-        if len(shingles) == 0:
-            return []
-
-        fingerprints = [self.get_fingerprint(sh) for sh in shingles]
-        min_hashes = [self.get_min_hash(fingerprints, p) for p in self.permutations]
-
-        return min_hashes
+        return self.generate_sketches([doc])[0]
+
+    def generate_sketches(self, docs: List[str]) -> List[List[int]]:
+        """
+        Batch version of generate_sketch. The fingerprints of all the docs are
+        packed into a single array, so that the XOR-min of every permutation
+        is computed with one vectorized pass over the whole batch.
+        Empty docs (no shingles) get an empty sketch, same as generate_sketch.
+        """
+        return self.generate_sketches_from_shingles(
+            [self.extract_shingle_list(doc) for doc in docs]
+        )
+
+    def generate_sketches_from_shingles(
+        self, shingle_lists: List[List[str]]
+    ) -> List[List[int]]:
+        return self.generate_sketches_from_fingerprints(
+            [
+                [self.get_fingerprint(sh) for sh in shingles]
+                for shingles in shingle_lists
+            ]
+        )
+
+    def generate_sketches_from_fingerprints(
+        self, fingerprints_per_doc: List[List[int]]
+    ) -> List[List[int]]:
+        sketches: List[List[int]] = [[] for _ in fingerprints_per_doc]
+
+        non_empty = [i for i, fps in enumerate(fingerprints_per_doc) if len(fps) > 0]
+        if len(non_empty) == 0 or len(self.permutations) == 0:
+            return sketches
+
+        dtype = np.uint32 if self.modulo <= 2 ** 32 else np.uint64
+
+        fingerprints = np.fromiter(
+            (f for i in non_empty for f in fingerprints_per_doc[i]), dtype=dtype,
+        )
+        lengths = np.array([len(fingerprints_per_doc[i]) for i in non_empty])
+        offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+
+        # min_hashes[j, k]: min hash of the j-th non empty doc for the k-th permutation
+        min_hashes = np.empty((len(non_empty), len(self.permutations)), dtype=dtype)
+        for k, permutation in enumerate(self.permutations):
+            # Bitwise XOR
+            xored = np.bitwise_xor(fingerprints, dtype(permutation))
+            min_hashes[:, k] = np.minimum.reduceat(xored, offsets)
+
+        for j, i in enumerate(non_empty):
+            sketches[i] = [int(h) for h in min_hashes[j]]
+
+        return sketches
 
     def extract_shingle_list(self, doc: str) -> List[str]:
         shingles_set = set()
 
-        tokens = gensim.utils.simple_preprocess(doc)
+        tokens = simple_preprocess(doc)
         for i in range(0, len(tokens) - self.shingle_length + 1):
             shingles_set.add(" ".join(tokens[i : i + self.shingle_length]))
 
+        if self.bottom_k_sampling:
+            return sample_shingles(sorted(shingles_set), self.max_num_shingles)
+
         return sorted(shingles_set)
 
     def get_fingerprint(self, doc: str) -> int:
+        # Horner's rule: same value as sum(guid(c) * base ** (len(doc) - 1 - i)) % modulo,
+        # but the running value is kept reduced, so it never grows into a big int
         hash = 0
-        for i, c in enumerate(doc):
-            hash += guid(c) * self.base ** (len(doc) - 1 - i)
-        hash = hash % self.modulo
+        for c in doc:
+            hash = (hash * self.base + guid(c)) % self.modulo
         return hash
 
     def get_min_hash(self, fingerprints: List[int], permutation: int):
@@ -0,0 +1,42 @@
+from typing import List
+
+import hashlib
+import random
+import struct
+
+
+def generate_permutations(num_permutations: int, hash_bits: int, seed: int) -> List[int]:
+    """
+    Deterministic list of XOR permutations: the same seed always yields the
+    same list, so that band keys persisted by different runs stay comparable.
+    """
+    rnd = random.Random(seed)
+    return [rnd.getrandbits(hash_bits) for i in range(num_permutations)]
+
+
+def get_band_keys(sketch: List[int], bands: int, rows: int) -> List[int]:
+    """
+    Banded LSH: the sketch (bands * rows min hashes) is split into 'bands' bands
+    of 'rows' consecutive min hashes, and each band is hashed into a signed 32 bit
+    key. The band index is part of the key, so that equal keys always belong to
+    the same band. Two docs become candidates if they share at least one key.
+
+    Returns an empty list for empty sketches.
+    """
+    if len(sketch) == 0:
+        return []
+
+    if len(sketch) != bands * rows:
+        raise Exception(
+            f"Sketch length ({len(sketch)}) does not match bands ({bands}) x rows ({rows})"
+        )
+
+    keys: List[int] = []
+
+    for b in range(bands):
+        band = sketch[b * rows : (b + 1) * rows]
+        data = struct.pack(f"<I{rows}Q", b, *band)
+        digest = hashlib.blake2b(data, digest_size=4).digest()
+        keys.append(int.from_bytes(digest, "little", signed=True))
+
+    return keys
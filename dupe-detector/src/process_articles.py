@@ -1,9 +1,13 @@
-from typing import List, Optional, Tuple, Iterator, Union, Callable, Any, cast
+from typing import (
+    List, Optional, Tuple, Iterator, Union, Callable, Any, FrozenSet, Dict, cast,
+)
 
 import os
+import socket
 import sys
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, date as Date
 import time
+from functools import lru_cache
 from urllib.parse import urlparse, ParseResult
 
 import psycopg2  # type: ignore
@@ -12,7 +16,15 @@ import psycopg2.extras  # type: ignore
 import logging
 
 from .doc_comparator import DocComparator
-from .doc_sketch import DocSketchGenerator
+from .doc_sketch import DocSketchGenerator, get_sketch_decision
+from .article_write_buffer import ArticleWriteBuffer
+from .doc_analyzer import DocAnalyzer
+from .shingle_set_cache import ShingleSetCache
+from .sketch_index import SketchIndex, SketchRow
+from .syndication_index import SyndicationIndex
+from .source_lease_manager import SourceLeaseManager
+from .article_notification_listener import ArticleNotificationListener
+from .lsh import generate_permutations, get_band_keys
 from .profiler import Profiler
 
 dir_path = os.path.dirname(os.path.realpath(__file__))
@@ -36,21 +48,160 @@ MAX_NUM_SHINGLES = 1600
 HASH_COLLISION_THRESH = 0.4
 DOC_COMPARATOR_OVERLAP_THRESH = 0.75
 
+# Caps the shingles per doc to MAX_NUM_SHINGLES (bottom-k sampling), so that
+# very long articles do not take unbounded time. It also changes the MinHash
+# sketches (and shingle signatures) of the docs over the cap, so after toggling it
+# the persisted sketches of those docs no longer match the new ones: re-sketch
+# them with rededup_articles.py (like after changing the sketch params).
+SHINGLE_SAMPLING_ENABLED = os.environ.get("SHINGLE_SAMPLING_ENABLED") == "True"
+
 ARTICLE_SOURCE_ID_HASH_BASE = 15
 ARTICLE_SOURCE_ID_HASH_BITS = 16
 ARTICLE_SOURCE_ID_HASH_OFFSET = 2 ** (ARTICLE_SOURCE_ID_HASH_BITS - 1)
 
 ARTICLES_BATCH_SIZE = 20000
+FETCH_CHUNK_SIZE = 500
 ARTICLES_COUNT_LOG = 50
 POLING_INTERVAL_MIN = 10
 
+# Event-driven mode: the detector is woken up by the notifications of the article
+# insert trigger (database/scripts/dupe-detector-article-notify-trigger.sql), and
+# processes the notified articles in micro-batches (notifications are collected for
+# NOTIFY_DEBOUNCE_SEC). Polling every POLING_INTERVAL_MIN is kept as a safety net.
+NOTIFY_ENABLED = os.environ.get("NOTIFY_ENABLED") == "True"
+NOTIFY_DEBOUNCE_SEC = float(os.environ.get("NOTIFY_DEBOUNCE_SEC") or 2)
+ARTICLE_NOTIFY_CHANNEL = "article_pending"
+
+# Banded LSH candidates (disabled if LSH_BANDS = 0). Sketches are made of
+# LSH_BANDS x LSH_ROWS min hashes, and are persisted as one key per band in
+# scraper.article_sketch_band. Articles sharing at least one key are candidates.
+LSH_BANDS = int(os.environ.get("LSH_BANDS") or 0)
+LSH_ROWS = int(os.environ.get("LSH_ROWS") or 0)
+LSH_PERMUTATIONS_SEED = 2021
+LSH_PERMUTATIONS = generate_permutations(
+    LSH_BANDS * LSH_ROWS, ARTICLE_HASH_BITS, LSH_PERMUTATIONS_SEED
+)
+
+SKETCH_PERMUTATIONS = LSH_PERMUTATIONS if LSH_BANDS > 0 else PERMUTATIONS
+
+# Cross-source syndication clusters (e.g. wire service stories republished by many
+# sources): originals are linked to the originals of other sources in the dates
+# window through an in-memory banded LSH index (SYNDICATION_BANDS x SYNDICATION_ROWS
+# extra min hashes) if at least SYNDICATION_SIMILARITY_THRESH of their min hashes
+# agree, and the clusters are persisted to scraper.article_syndication.
+# With WORK_CLAIM_ENABLED, only the sources claimed by each worker are linked.
+SYNDICATION_ENABLED = os.environ.get("SYNDICATION_ENABLED") == "True"
+SYNDICATION_BANDS = int(os.environ.get("SYNDICATION_BANDS") or 20)
+SYNDICATION_ROWS = int(os.environ.get("SYNDICATION_ROWS") or 4)
+SYNDICATION_SIMILARITY_THRESH = float(
+    os.environ.get("SYNDICATION_SIMILARITY_THRESH") or 0.5
+)
+SYNDICATION_PERMUTATIONS_SEED = 2022
+SYNDICATION_PERMUTATIONS = generate_permutations(
+    SYNDICATION_BANDS * SYNDICATION_ROWS if SYNDICATION_ENABLED else 0,
+    ARTICLE_HASH_BITS,
+    SYNDICATION_PERMUTATIONS_SEED,
+)
+SYNDICATION_TABLE = "scraper.article_syndication"
+
+# Both sketches are computed in a single pass over the shingle fingerprints
+ANALYSIS_PERMUTATIONS = SKETCH_PERMUTATIONS + SYNDICATION_PERMUTATIONS
+
+# Sketch storage (min hashes only, band keys are always stored as rows):
+#   rows:    one row per hash (scraper.article_sketch)
+#   compact: one row per article holding all its hashes, looked up through a GIN
+#            index (scraper.article_sketch_compact, filled from the rows table by
+#            sketch_compact_backfill)
+SKETCH_STORAGE = os.environ.get("SKETCH_STORAGE") or "rows"
+if LSH_BANDS > 0:
+    SKETCH_STORAGE = "rows"
+
+if LSH_BANDS > 0:
+    SKETCH_TABLE = "scraper.article_sketch_band"
+    SKETCH_HASH_COLUMN = "band_key"
+elif SKETCH_STORAGE == "compact":
+    SKETCH_TABLE = "scraper.article_sketch_compact"
+    SKETCH_HASH_COLUMN = "hashes"
+else:
+    SKETCH_TABLE = "scraper.article_sketch"
+    SKETCH_HASH_COLUMN = "hash"
+
+# Number of processes for the tokenization, shingling and sketching
+# stages (0: everything runs in the main process)
+WORKER_PROCESSES = int(os.environ.get("WORKER_PROCESSES") or 0)
+
+# Write-behind: sketches and results are persisted in bulk every
+# WRITE_FLUSH_SIZE articles or WRITE_FLUSH_INTERVAL_SEC seconds
+WRITE_FLUSH_SIZE = int(os.environ.get("WRITE_FLUSH_SIZE") or 500)
+WRITE_FLUSH_INTERVAL_SEC = int(os.environ.get("WRITE_FLUSH_INTERVAL_SEC") or 10)
+
+# Candidates lookup:
+#   off:    candidates query over the sketch table
+#   on:     in-memory sketch index
+#   verify: both, logging any mismatch (the query results are used)
+SKETCH_INDEX_MODE = os.environ.get("SKETCH_INDEX_MODE") or "off"
+
+# Multi-worker mode: the work is partitioned by article_source_id_hash, and each
+# worker only processes the partitions it has claimed (scraper.dupe_detector_lease)
+WORK_CLAIM_ENABLED = os.environ.get("WORK_CLAIM_ENABLED") == "True"
+WORK_CLAIM_MAX_PARTITIONS = int(os.environ.get("WORK_CLAIM_MAX_PARTITIONS") or 50)
+WORK_CLAIM_LEASE_SEC = int(os.environ.get("WORK_CLAIM_LEASE_SEC") or 300)
+WORKER_ID = os.environ.get("WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}"
+
+# Stage latencies and counters are exported to PROFILER_EXPORT_PATH (if set) every
+# PROFILER_EXPORT_INTERVAL_SEC, in Prometheus text format (*.prom) or JSON
+PROFILER_EXPORT_PATH = os.environ.get("PROFILER_EXPORT_PATH") or None
+PROFILER_EXPORT_INTERVAL_SEC = int(os.environ.get("PROFILER_EXPORT_INTERVAL_SEC") or 60)
+
+# Early decision from the sketch agreement (fraction of the PERMUTATIONS min hashes
+# in common, an estimate of the Jaccard similarity): candidates >= SKETCH_ACCEPT_THRESH
+# are duplicates and candidates < SKETCH_REJECT_THRESH are not, without the exact
+# shingles comparison. Not available with banded LSH (band keys are not min hashes).
+SKETCH_DECISION_ENABLED = (
+    os.environ.get("SKETCH_DECISION_ENABLED") == "True" and LSH_BANDS == 0
+)
+SKETCH_ACCEPT_THRESH = float(os.environ.get("SKETCH_ACCEPT_THRESH") or 1.0)
+SKETCH_REJECT_THRESH = float(os.environ.get("SKETCH_REJECT_THRESH") or 0.5)
+
+# Max number of candidate shingle sets kept in memory (LRU)
+SHINGLE_CACHE_SIZE = int(os.environ.get("SHINGLE_CACHE_SIZE") or 5000)
+
+# Persist the shingle signatures of the originals (scraper.article_shingle_signature),
+# so that candidates are verified without reading their text. Candidates without
+# a signature (processed before it was enabled) fall back to their text.
+SHINGLE_SIGNATURES_ENABLED = os.environ.get("SHINGLE_SIGNATURES_ENABLED") == "True"
+SHINGLE_SIGNATURE_TABLE = "scraper.article_shingle_signature"
+
+article_source_id_hash_generator = DocSketchGenerator(
+    ARTICLE_SOURCE_ID_HASH_BASE, 2 ** ARTICLE_SOURCE_ID_HASH_BITS, [], 0, 0
+)
+
+doc_comparator = DocComparator(
+    SHINGLE_LENGTH,
+    MAX_NUM_SHINGLES,
+    DOC_COMPARATOR_OVERLAP_THRESH,
+    SHINGLE_SAMPLING_ENABLED,
+)
+candidate_shingles_cache = ShingleSetCache(SHINGLE_CACHE_SIZE)
+
 
 class ArticleInfo(object):
-    def __init__(self, id: int, title: str, text: str, is_original: bool):
+    def __init__(
+        self,
+        id: int,
+        title: Union[str, None],
+        text: Union[str, None],
+        is_original: bool,
+        shingle_hashes: FrozenSet[int] = frozenset(),
+        sketch_decision: Union[bool, None] = None,
+    ):
         self.id = id
         self.title = title
         self.text = text
         self.is_original = is_original
+        self.shingle_hashes = shingle_hashes
+        # Early decision from the sketch agreement (None: exact comparison)
+        self.sketch_decision = sketch_decision
 
     def __str__(self):
         return f"""
@@ -103,111 +254,136 @@ def process_articles():
         f"   ╚══════════════════════════════════════════════════════════════════════════════════════════════════════════╝"
     )
 
+    if LSH_BANDS > 0:
+        logging.info(f">> Banded LSH candidates: {LSH_BANDS} bands x {LSH_ROWS} rows")
+
+    if SHINGLE_SAMPLING_ENABLED:
+        logging.info(f">> Bottom-k shingle sampling: {MAX_NUM_SHINGLES} shingles")
+
+    if SHINGLE_SIGNATURES_ENABLED:
+        logging.info(f">> Shingle signatures: {SHINGLE_SIGNATURE_TABLE}")
+
     doc_sketch_generator = DocSketchGenerator(
         ARTICLE_HASH_BASE,
         2 ** ARTICLE_HASH_BITS,
-        PERMUTATIONS,
+        ANALYSIS_PERMUTATIONS,
         SHINGLE_LENGTH,
         MAX_NUM_SHINGLES,
+        SHINGLE_SAMPLING_ENABLED,
     )
-    article_source_id_hash_generator = DocSketchGenerator(
-        ARTICLE_SOURCE_ID_HASH_BASE, 2 ** ARTICLE_SOURCE_ID_HASH_BITS, [], 0, 0
+    profiler = Profiler(
+        "dupe_detector", PROFILER_EXPORT_PATH, PROFILER_EXPORT_INTERVAL_SEC
     )
-    profiler = Profiler()
 
+    # Start the workers before opening the db connections
+    if WORKER_PROCESSES > 0:
+        logging.info(f">> Worker processes: {WORKER_PROCESSES}")
+    doc_analyzer = DocAnalyzer(doc_sketch_generator, WORKER_PROCESSES)
+
+    lease_manager: Union[SourceLeaseManager, None] = None
+    if WORK_CLAIM_ENABLED:
+        logging.info(f">> Work claim mode, worker: {WORKER_ID}")
+        lease_manager = SourceLeaseManager(
+            get_db_connection(),
+            WORKER_ID,
+            WORK_CLAIM_LEASE_SEC,
+            WORK_CLAIM_MAX_PARTITIONS,
+            get_article_source_id_hash,
+        )
+
+    # cnxn1 streams the pending articles, cnxn2 is used for everything else
     cnxn1 = get_db_connection()
     cnxn2 = get_db_connection()
-    cursor1 = cnxn1.cursor()
     cursor2 = cnxn2.cursor()
+    write_buffer = ArticleWriteBuffer(
+        cnxn2,
+        WRITE_FLUSH_SIZE,
+        WRITE_FLUSH_INTERVAL_SEC,
+        SKETCH_TABLE,
+        SKETCH_HASH_COLUMN,
+        SHINGLE_SIGNATURE_TABLE if SHINGLE_SIGNATURES_ENABLED else None,
+        SKETCH_STORAGE == "compact",
+        SYNDICATION_TABLE,
+        # The leases are renewed in every flush transaction (fencing)
+        lease_manager.renew if lease_manager is not None else None,
+    )
+
+    sketch_index: Union[SketchIndex, None] = None
+    if SKETCH_INDEX_MODE != "off":
+        logging.info(f">> Sketch index mode: {SKETCH_INDEX_MODE}")
+        sketch_index = SketchIndex(lambda dates: load_original_sketches(cnxn2, dates))
+
+    syndication_index: Union[SyndicationIndex, None] = None
+    if SYNDICATION_ENABLED:
+        logging.info(
+            f">> Syndication index: {SYNDICATION_BANDS} bands x {SYNDICATION_ROWS} rows"
+        )
+        syndication_index = SyndicationIndex(
+            SYNDICATION_BANDS, SYNDICATION_ROWS, SYNDICATION_SIMILARITY_THRESH
+        )
+
+    notification_listener: Union[ArticleNotificationListener, None] = None
+    if NOTIFY_ENABLED:
+        logging.info(f">> Event-driven mode, channel: {ARTICLE_NOTIFY_CHANNEL}")
+        notification_listener = ArticleNotificationListener(
+            get_db_connection, ARTICLE_NOTIFY_CHANNEL, NOTIFY_DEBOUNCE_SEC
+        )
+        # Listen before the first cycle, so that no article is missed
+        notification_listener.connect()
 
     while True:
         time1 = time.time()
 
-        # Profiler ###############
-        profiler.reg_time("t1")
+        # The articles notified so far are about to be read
+        if notification_listener is not None:
+            notification_listener.drain()
 
-        # Get total number of articles to be processed
-        sql = f"""
-            SELECT 
-                    COUNT(id)
-            FROM 
-                    scraper.article
-            WHERE 
-                    is_duplicate IS NULL
-                    AND result = 'success'
-            """
+        cycle_start_time = time.perf_counter()
 
-        cursor1.execute(sql)
-        total_articles = cursor1.fetchone()[0]
         processed_articles_count = 0
-        complete_percent_str = "{:.2f}".format(0)
         articles_per_sec_str = "{:.2f}".format(0)
         timespan_processed_articles_count = 0
 
-        if total_articles == 0:
-            # There are no articles to be processed --> wait and check again
-            time.sleep(60 * POLING_INTERVAL_MIN)
-            continue
-
-        logging.info("")
-        logging.info(f">> Found {total_articles} articles to be processed")
-        logging.info("")
-
-        # Profiler ###############
-        profiler.reg_time("t2")
-
-        while True:
-            # Profiler ###############
-            profiler.reg_time("t3")
-
-            sql = f"""
-                    SELECT
-                            id
-                    FROM
-                            scraper.article article
-                    WHERE
-                            is_duplicate IS NULL
-                            AND result = 'success'
-                    ORDER BY
-                            date,
-                            id
-                    LIMIT 
-                            {ARTICLES_BATCH_SIZE}
-                    """
-
-            cursor1.execute(sql)
-
-            # All done --> finish
-            if cursor1.rowcount == 0:
-                break
-
-            article_id_list = list(map(lambda r: r[0], cursor1.fetchall()))
-
-            # Iterate the article id list
-            for article_id in article_id_list:
-                # Profiler ###############
-                profiler.reg_time("t4")
-
-                sql = f"""
-                    SELECT
-                            date,
-                            title,
-                            text,
-                            article_source_id
-                    FROM
-                            scraper.article article
-                    WHERE
-                            id = '{article_id}'
-                    """
+        # Keyset of the last processed article: (date, id)
+        last_article_key: Union[Tuple[Any, int], None] = None
+
+        # Each cycle starts again from the oldest pending article
+        if sketch_index is not None:
+            sketch_index.reset()
+
+        # Only the articles of the claimed partitions are processed
+        article_source_ids: Union[List[str], None] = None
+        if lease_manager is not None:
+            article_source_ids = lease_manager.claim()
+            if len(article_source_ids) == 0:
+                # Every partition is claimed by other workers --> wait and check again
+                time.sleep(60 * POLING_INTERVAL_MIN)
+                continue
+
+        lease_lost = False
+
+        while not lease_lost:
+            batch_articles_count = 0
+            wait_start_time = time.perf_counter()
+
+            # The sketches and shingles of every chunk of rows are
+            # generated by the workers while the previous one is processed
+            for row, sketch, shingle_hashes in doc_analyzer.analyze_chunks(
+                fetch_pending_articles(cnxn1, last_article_key, article_source_ids),
+                get_row_doc,
+            ):
+                # Time spent waiting for the next row and its sketch
+                profiler.observe(
+                    "fetch_and_analyze", time.perf_counter() - wait_start_time
+                )
 
-                cursor1.execute(sql)
-                row = cursor1.fetchone()
+                article_id = row[0]
+                date = row[1]
+                last_article_key = (date, article_id)
+                batch_articles_count += 1
 
                 # Calculate stats
                 processed_articles_count += 1
-                complete_percent_str = "{:.2f}".format(
-                    100 * processed_articles_count / total_articles
-                )
 
                 if processed_articles_count % ARTICLES_COUNT_LOG == 0:
                     delta_time_sec = time.time() - time1
@@ -221,205 +397,603 @@ def process_articles():
                         timespan_processed_articles_count = 0
 
                         profiler.log_stats()
+                        logging.debug(
+                            f">> Shingle cache: hits={candidate_shingles_cache.hits}, misses={candidate_shingles_cache.misses}"
+                        )
 
-                    date_str = row[0]
                     logging.info(
-                        f">> [{complete_percent_str}% complete] Article date: {date_str}, processed articles: {processed_articles_count}/{total_articles} at {articles_per_sec_str} [articles/sec]"
+                        f">> Article date: {date}, processed articles: {processed_articles_count} at {articles_per_sec_str} [articles/sec]"
                     )
 
-                # concatenate title and text
-                date = row[0]
-                title = row[1]
-                text = row[2]
-                article_source_id = row[3]
-                article_source_id_hash = (
-                    article_source_id_hash_generator.get_fingerprint(article_source_id)
-                    - ARTICLE_SOURCE_ID_HASH_OFFSET
-                )
+                if sketch_index is not None:
+                    sketch_index.advance(date)
 
-                # Generate sketch
-                doc = title + " " + text
-                sketch = doc_sketch_generator.generate_sketch(doc)
-                hashes = [str(h - ARTICLE_HASH_OFFSET) for h in sketch]
+                process_article(
+                    cursor2,
+                    write_buffer,
+                    sketch_index,
+                    row,
+                    sketch,
+                    shingle_hashes,
+                    profiler,
+                    syndication_index,
+                )
 
-                # Profiler ###############
-                profiler.reg_time("t5")
+                profiler.count("articles")
+                profiler.maybe_export()
 
-                if len(hashes) == 0:
-                    logging.info(
-                        f">> [{complete_percent_str}% complete] Article sketch is empty ({article_id}): doc='{doc}', setting it as original."
+                if lease_manager is not None:
+                    lease_manager.register_processed(
+                        get_article_source_id_hash(row[4]), date
                     )
-                    # Update article
-                    update_article(cursor2, cnxn2, article_id, "false", article_id)
-                    continue
-
-                hashes_str = ", ".join(hashes)
-                values_str = ", ".join(
-                    map(
-                        lambda h: f"('{article_id}', {h}, '{date}', {article_source_id_hash})",
-                        hashes,
+
+                    if lease_manager.should_renew():
+                        # The leases are renewed by the flush (nothing to flush
+                        # --> renewed here)
+                        write_buffer.flush()
+                        if lease_manager.should_renew():
+                            lease_manager.renew()
+
+                    if len(lease_manager.lost_hashes) > 0:
+                        # Partitions lost --> claim again in a new cycle
+                        lease_lost = True
+                        break
+
+                wait_start_time = time.perf_counter()
+
+            # All done --> finish
+            if batch_articles_count < ARTICLES_BATCH_SIZE:
+                break
+
+        # Persist the remaining buffered results before
+        # the next cycle reads the pending articles again
+        write_buffer.flush()
+
+        if lease_manager is not None:
+            lease_manager.renew()
+            if syndication_index is not None and len(lease_manager.lost_hashes) > 0:
+                # The clusters may refer to the dropped articles
+                syndication_index.reset()
+            # Pending articles processed --> let the partitions rotate
+            lease_manager.release(processed_articles_count > 0)
+
+        profiler.maybe_export()
+
+        if processed_articles_count == 0:
+            if lease_manager is not None and not lease_manager.idle:
+                # Other partitions may have pending articles --> claim them now
+                continue
+
+            # There are no articles to be processed --> wait and check again
+            if notification_listener is not None:
+                notified_count = notification_listener.wait(60 * POLING_INTERVAL_MIN)
+                if notified_count > 0:
+                    logging.info(f">> Notified articles: {notified_count}")
+            else:
+                time.sleep(60 * POLING_INTERVAL_MIN)
+            continue
+
+        logging.info("")
+        logging.info(f">> Processed {processed_articles_count} articles")
+        logging.info("")
+
+        profiler.observe("cycle", time.perf_counter() - cycle_start_time)
+
+
+# Streams the pending articles (id, date, title, text, article_source_id)
+# ordered by (date, id), starting after the given keyset. At most
+# ARTICLES_BATCH_SIZE rows are read, in chunks of FETCH_CHUNK_SIZE rows,
+# through a server side cursor, so that memory usage stays flat.
+# If article_source_ids is given, only the articles of those sources are read.
+def fetch_pending_articles(
+    cnxn,
+    after_key: Union[Tuple[Any, int], None],
+    article_source_ids: Union[List[str], None] = None,
+) -> Iterator[List[Tuple]]:
+
+    keyset_condition = (
+        f"AND (date, id) > ('{after_key[0]}', '{after_key[1]}')"
+        if after_key is not None
+        else ""
+    )
+
+    sources_condition = (
+        "AND article_source_id IN ("
+        + ", ".join([f"'{id}'" for id in article_source_ids])
+        + ")"
+        if article_source_ids is not None
+        else ""
+    )
+
+    sql = f"""
+            SELECT
+                    id,
+                    date,
+                    title,
+                    text,
+                    article_source_id
+            FROM
+                    scraper.article article
+            WHERE
+                    is_duplicate IS NULL
+                    AND result = 'success'
+                    {keyset_condition}
+                    {sources_condition}
+            ORDER BY
+                    date,
+                    id
+            LIMIT
+                    {ARTICLES_BATCH_SIZE}
+            """
+
+    cursor = cnxn.cursor(name="pending_articles")
+    cursor.itersize = FETCH_CHUNK_SIZE
+    cursor.execute(sql)
+
+    try:
+        while True:
+            rows = cursor.fetchmany(FETCH_CHUNK_SIZE)
+            if len(rows) == 0:
+                break
+            yield rows
+    finally:
+        cursor.close()
+        # Close the read transaction, so that it does not hold the snapshot
+        cnxn.commit()
+
+
+def process_article(
+    cursor,
+    write_buffer: ArticleWriteBuffer,
+    sketch_index: Union[SketchIndex, None],
+    row: Tuple,
+    sketch: List[int],
+    shingle_hashes: FrozenSet[int],
+    profiler: Profiler,
+    syndication_index: Union[SyndicationIndex, None] = None,
+):
+    article_id = row[0]
+    date = row[1]
+    title = row[2]
+    text = row[3]
+    article_source_id = row[4]
+    article_source_id_hash = get_article_source_id_hash(article_source_id)
+
+    doc = title + " " + text
+    hashes = get_sketch_hashes(sketch)
+
+    if len(hashes) == 0:
+        logging.info(
+            f">> Article sketch is empty ({article_id}): doc='{doc}', setting it as original."
+        )
+        # Update article
+        write_buffer.add_article(
+            article_id, date, article_source_id_hash, [], False, article_id
+        )
+        return
+
+    # Find dupe candidates
+
+    date_from = date - timedelta(days=2)
+    dates = [date_from + timedelta(days=i) for i in range(5)]
+
+    count_thresh = get_candidates_count_thresh()
+
+    with profiler.span("candidates_lookup"):
+        if sketch_index is None or SKETCH_INDEX_MODE == "verify":
+            candidates_rows = find_candidates_sql(
+                cursor,
+                write_buffer,
+                hashes,
+                dates,
+                article_source_id_hash,
+                count_thresh,
+            )
+
+        if sketch_index is not None:
+            candidate_collisions = sketch_index.find_candidate_collisions(
+                hashes, date, article_source_id_hash, count_thresh
+            )
+            candidate_ids = [id for id, c in candidate_collisions]
+
+            if SKETCH_INDEX_MODE == "verify":
+                sql_candidate_ids = set(r[0] for r in candidates_rows)
+                if sql_candidate_ids != set(candidate_ids):
+                    logging.warning(
+                        f">> Sketch index mismatch for article ({article_id}): sql={sorted(sql_candidate_ids)}, index={sorted(candidate_ids)}"
                     )
+            else:
+                # The index only holds originals (some may still be in the write buffer)
+                candidates_rows = [(id, False, c) for id, c in candidate_collisions]
+
+    # Analyze candidates
+
+    is_duplicate = False
+    original_article_id = article_id
+
+    if len(candidates_rows) > 0:
+        profiler.count("candidates", len(candidates_rows))
+
+        # Candidates found --> check duplicates.
+        article = ArticleInfo(article_id, title, text, False, shingle_hashes)
+        candidates: List[ArticleInfo] = []
+
+        # Populate candidates list
+        for candidate_row in candidates_rows:
+            # The candidate is considered as an original only if is_duplicate = false
+            # NULL values are interpreted as not originals by default
+            is_original = candidate_row[1] == False
+            candidates.append(
+                ArticleInfo(
+                    candidate_row[0],
+                    None,
+                    None,
+                    is_original,
+                    sketch_decision=get_candidate_sketch_decision(candidate_row[2]),
                 )
+            )
+
+        # Only the originals that need an exact comparison are compared
+        # --> only their shingles are needed
+        compared_candidates = get_compared_candidates(candidates)
+        candidates_shingle_hashes = get_candidates_shingle_hashes(
+            cursor, [c.id for c in compared_candidates]
+        )
+        for candidate in compared_candidates:
+            candidate.shingle_hashes = candidates_shingle_hashes.get(
+                candidate.id, frozenset()
+            )
+
+        logging.info(
+            f">> Duplicate candidates found for article ({article_id}): {str(len(candidates))}"
+        )
+
+        profiler.count("compared_candidates", len(compared_candidates))
+
+        with profiler.span("compare"):
+            original = find_original(article, candidates)
+
+        if original is not None:
+            # Original found
+            logging.info(
+                f"   ╔══════════════════════════════════════════════════════════════════════════════════════════════════════════╗"
+            )
+            logging.info(
+                f">> ║ Original found for article ({article_id}): {original.id}  ║"
+            )
+            logging.info(
+                f"   ╚══════════════════════════════════════════════════════════════════════════════════════════════════════════╝"
+            )
+            is_duplicate = True
+            original_article_id = original.id
+
+    if is_duplicate:
+        profiler.count("duplicates")
+
+    # Buffered before the article, so that they are dropped along with it if
+    # its partition is found lost by the flush of add_article
+    if not is_duplicate and syndication_index is not None:
+        with profiler.span("syndication"):
+            syndication_rows, cluster_merges = syndication_index.add(
+                article_id,
+                date,
+                article_source_id_hash,
+                get_syndication_sketch(sketch),
+            )
+            write_buffer.add_syndication(syndication_rows, cluster_merges)
+
+    # Persist sketch and update article (buffered)
+    with profiler.span("persist"):
+        write_buffer.add_article(
+            article_id,
+            date,
+            article_source_id_hash,
+            hashes,
+            is_duplicate,
+            original_article_id,
+            shingle_hashes,
+        )
+
+    if not is_duplicate:
+        # Recent originals are likely candidates of the next articles
+        candidate_shingles_cache.put(article_id, shingle_hashes)
+
+        if sketch_index is not None:
+            sketch_index.add(article_id, date, article_source_id_hash, hashes)
+
+
+# Candidates query over the sketch table. Returns the
+# (id, is_duplicate, collision count) rows of the candidates.
+def find_candidates_sql(
+    cursor,
+    write_buffer: ArticleWriteBuffer,
+    hashes: List[int],
+    dates: List[Date],
+    article_source_id_hash: int,
+    count_thresh: float,
+) -> List[Tuple]:
+
+    dates_str = ", ".join([f"'{str(d)}'" for d in dates])
+    hashes_str = ", ".join(map(str, hashes))
+
+    # The current article's sketch is not persisted yet,
+    # so it is not part of the results.
+    if SKETCH_STORAGE == "compact":
+        sql = get_compact_candidates_sql(
+            SKETCH_TABLE, dates_str, hashes_str, article_source_id_hash, count_thresh
+        )
+    else:
+        sql = get_rows_candidates_sql(
+            SKETCH_TABLE,
+            SKETCH_HASH_COLUMN,
+            dates_str,
+            hashes_str,
+            article_source_id_hash,
+            count_thresh,
+        )
 
-                # Persist sketch
-                sql = f"""
-                        INSERT INTO 
-                                scraper.article_sketch(
-                                    article_id,
-                                    hash,
-                                    date,
-                                    article_source_id_hash
-                                )
-                                VALUES {values_str};
-                        """
-
-                cursor2.execute(sql)
-                cnxn2.commit()
-
-                # Profiler ###############
-                profiler.reg_time("t6")
-
-                # Find dupe candidates
-
-                date_from = date - timedelta(days=2)
-                dates_str = ", ".join(
-                    [f"'{str(date_from + timedelta(days=i))}'" for i in range(5)]
-                )
+    cursor.execute(sql)
+    candidates_rows = cursor.fetchall()
 
-                count_thresh = len(PERMUTATIONS) * HASH_COLLISION_THRESH
+    # Originals that are still in the write buffer
+    # (their is_duplicate value is still NULL in the db)
+    pending_candidates = write_buffer.find_pending_candidates(
+        hashes, dates, article_source_id_hash, count_thresh
+    )
 
-                sql = f"""
-                        WITH data as (
-                            SELECT
-                                    article_id,
-                                    COUNT(id) c
+    for id, c in pending_candidates:
+        candidates_rows.append((id, False, c))
+
+    return candidates_rows
+
+
+# Candidates query over the rows sketch storage (one row per hash)
+def get_rows_candidates_sql(
+    sketch_table: str,
+    hash_column: str,
+    dates_str: str,
+    hashes_str: str,
+    article_source_id_hash: int,
+    count_thresh: float,
+) -> str:
+    return f"""
+            WITH data as (
+                SELECT
+                        article_id,
+                        COUNT(id) c
+
+                FROM
+                        {sketch_table}
+                WHERE
+                        date IN ({dates_str})
+                        AND article_source_id_hash = '{article_source_id_hash}'
+                        AND {hash_column} IN ({hashes_str})
+                GROUP BY
+                        article_id
+                ORDER BY
+                        c DESC
+            )
+            SELECT
+                    article.id,
+                    article.is_duplicate,
+                    data.c
+            FROM
+                    data
+                    INNER JOIN scraper.article article
+                        ON data.article_id = article.id
+            WHERE
+                    c > {count_thresh}
+                    AND article.is_duplicate = false
+            """
 
+
+# Candidates query over the compact sketch storage (one row per article).
+# The overlap (&&) condition is resolved by the GIN index, and the hashes in
+# common are only counted for the matching rows.
+def get_compact_candidates_sql(
+    sketch_table: str,
+    dates_str: str,
+    hashes_str: str,
+    article_source_id_hash: int,
+    count_thresh: float,
+) -> str:
+    return f"""
+            WITH data as (
+                SELECT
+                        article_id,
+                        (
+                            SELECT
+                                    COUNT(*)
                             FROM
-                                    scraper.article_sketch
+                                    unnest(sketch.hashes) h
                             WHERE
-                                    date IN ({dates_str})
-                                    AND article_source_id_hash = '{article_source_id_hash}'
-                                    AND hash IN ({hashes_str})
-                            GROUP BY
-                                    article_id
-                            ORDER BY
-                                    c DESC
-                        )
-                        SELECT
-                                article.id,
-                                article.title,
-                                article.text,
-                                article.is_duplicate
-                        FROM
-                                data
-                                INNER JOIN scraper.article article
-                                    ON data.article_id = article.id
-                        WHERE
-                                c > {count_thresh}
-                                AND (
-                                    article.is_duplicate = false
-                                    OR article.id = '{article_id}'
-                                )
-                        """
-
-                cursor2.execute(sql)
-                candidates_rows = cursor2.fetchall()
-
-                # Profiler ###############
-                profiler.reg_time("t7")
-
-                # Analyze candidates
-
-                is_duplicate_str = "false"
-                original_article_id = article_id
-
-                # The threshold is 1 because current article's
-                # hashes has already been persisted.
-                if len(candidates_rows) > 1:
-
-                    # Candidates found --> check duplicates.
-                    article = None
-                    candidates: List[ArticleInfo] = []
-
-                    # Populate candidates list
-                    for i, row in enumerate(candidates_rows):
-                        id = row[0]
-                        title = row[1]
-                        text = row[2]
-                        # The candidate is considered as an original only if is_duplicate = false
-                        # NULL values are interpreted as not originals by default
-                        is_original = row[3] == False
-
-                        if id == article_id:
-                            article = ArticleInfo(id, title, text, is_original)
-                        else:
-                            candidates.append(ArticleInfo(id, title, text, is_original))
-
-                    if article is None:
-                        logging.error(
-                            ">> ERROR: Considered article not found. id:" + article_id
-                        )
-                    else:
+                                    h IN ({hashes_str})
+                        ) c
+                FROM
+                        {sketch_table} sketch
+                WHERE
+                        date IN ({dates_str})
+                        AND article_source_id_hash = '{article_source_id_hash}'
+                        AND hashes && ARRAY[{hashes_str}]::INTEGER[]
+            )
+            SELECT
+                    article.id,
+                    article.is_duplicate,
+                    data.c
+            FROM
+                    data
+                    INNER JOIN scraper.article article
+                        ON data.article_id = article.id
+            WHERE
+                    c > {count_thresh}
+                    AND article.is_duplicate = false
+            ORDER BY
+                    c DESC
+            """
 
-                        logging.info(
-                            f">> Duplicate candidates found for article ({article_id}): {str(len(candidates_rows)-1)}"
-                        )
 
-                        original = find_original(article, candidates)
-
-                        if original is not None:
-                            # Original found
-                            logging.info(
-                                f"   ╔══════════════════════════════════════════════════════════════════════════════════════════════════════════╗"
-                            )
-                            logging.info(
-                                f">> ║ Original found for article ({article_id}): {original.id}  ║"
-                            )
-                            logging.info(
-                                f"   ╚══════════════════════════════════════════════════════════════════════════════════════════════════════════╝"
-                            )
-                            is_duplicate_str = "true"
-                            original_article_id = original.id
-                        else:
-                            # Original not found --> set article as original
-                            is_duplicate_str = "false"
-                            original_article_id = article_id
-
-                else:
-                    # Candidates not found --> set article as original
-                    is_duplicate_str = "false"
-                    original_article_id = article_id
-
-                # Profiler ###############
-                profiler.reg_time("t8")
-
-                # Update article
-                update_article(
-                    cursor2,
-                    cnxn2,
+# Returns the shingle hashes of the given articles: from the cache, the persisted
+# shingle signatures or, as a last resort, the article texts
+def get_candidates_shingle_hashes(
+    cursor, article_ids: List[int]
+) -> Dict[int, FrozenSet[int]]:
+
+    shingle_hashes_by_id: Dict[int, FrozenSet[int]] = {}
+    missing_ids: List[int] = []
+
+    for id in article_ids:
+        shingle_hashes = candidate_shingles_cache.lookup(id)
+        if shingle_hashes is None:
+            missing_ids.append(id)
+        else:
+            shingle_hashes_by_id[id] = shingle_hashes
+
+    if SHINGLE_SIGNATURES_ENABLED and len(missing_ids) > 0:
+        for id, shingle_hashes in fetch_shingle_signatures(cursor, missing_ids):
+            shingle_hashes_by_id[id] = shingle_hashes
+        missing_ids = [id for id in missing_ids if id not in shingle_hashes_by_id]
+
+    for row in fetch_articles(cursor, missing_ids):
+        shingle_hashes_by_id[row[0]] = doc_comparator.extract_shingle_hashes(
+            row[1] + " " + row[2]
+        )
+
+    for id in article_ids:
+        if id in shingle_hashes_by_id:
+            candidate_shingles_cache.put(id, shingle_hashes_by_id[id])
+
+    return shingle_hashes_by_id
+
+
+# Returns the (article_id, shingle hashes) of the given articles that have a
+# persisted shingle signature
+def fetch_shingle_signatures(
+    cursor, article_ids: List[int]
+) -> List[Tuple[int, FrozenSet[int]]]:
+
+    sql = f"""
+            SELECT
                     article_id,
-                    is_duplicate_str,
-                    original_article_id,
-                )
+                    shingle_hashes
+            FROM
+                    {SHINGLE_SIGNATURE_TABLE}
+            WHERE
+                    article_id IN ({", ".join(map(str, article_ids))})
+            """
+
+    cursor.execute(sql)
 
-                # Profiler ###############
-                profiler.reg_time("t9")
+    return [(row[0], frozenset(row[1])) for row in cursor.fetchall()]
 
 
-def update_article(
-    cursor, cnxn, article_id: int, is_duplicate_str: str, original_article_id: int
-):
+# Returns the (id, title, text, is_duplicate) rows of
+# the given articles, in the same order as the ids
+def fetch_articles(cursor, article_ids: List[int]) -> List[Tuple]:
+    if len(article_ids) == 0:
+        return []
+
     sql = f"""
-            UPDATE 
-                    scraper.article
-            SET 
-                    is_duplicate={is_duplicate_str}, 
-                    original_article_id='{original_article_id}'
+            SELECT
+                    article.id,
+                    article.title,
+                    article.text,
+                    article.is_duplicate
+            FROM
+                    scraper.article article
             WHERE
-                    id='{article_id}'
+                    article.id IN ({", ".join(map(str, article_ids))})
             """
+
     cursor.execute(sql)
-    cnxn.commit()
+    rows_by_id = {row[0]: row for row in cursor.fetchall()}
+
+    return [rows_by_id[id] for id in article_ids if id in rows_by_id]
+
+
+# Sketch rows of the originals persisted for the given dates (sketch index warm up)
+def load_original_sketches(cnxn, dates: List[Date]) -> List[SketchRow]:
+    dates_str = ", ".join([f"'{str(d)}'" for d in dates])
+
+    # Compact storage: one row per hash as well
+    hash_column = f"sketch.{SKETCH_HASH_COLUMN}"
+    if SKETCH_STORAGE == "compact":
+        hash_column = f"unnest({hash_column})"
+
+    sql = f"""
+            SELECT
+                    sketch.article_id,
+                    sketch.date,
+                    sketch.article_source_id_hash,
+                    {hash_column}
+            FROM
+                    {SKETCH_TABLE} sketch
+                    INNER JOIN scraper.article article
+                        ON sketch.article_id = article.id
+            WHERE
+                    sketch.date IN ({dates_str})
+                    AND article.is_duplicate = false
+            """
+
+    cursor = cnxn.cursor()
+    cursor.execute(sql)
+    rows = cursor.fetchall()
+    cursor.close()
+
+    return rows
+
+
+# Sketch --> persisted (signed) hashes, or band keys with banded LSH
+def get_sketch_hashes(sketch: List[int]) -> List[int]:
+    sketch = sketch[: len(SKETCH_PERMUTATIONS)]
+    if LSH_BANDS > 0:
+        return get_band_keys(sketch, LSH_BANDS, LSH_ROWS)
+    return [h - ARTICLE_HASH_OFFSET for h in sketch]
+
+
+# Min hashes of the syndication permutations (see ANALYSIS_PERMUTATIONS)
+def get_syndication_sketch(sketch: List[int]) -> List[int]:
+    return sketch[len(SKETCH_PERMUTATIONS) :]
+
+
+# Min number of sketch hashes in common (exclusive) of a dupe candidate
+def get_candidates_count_thresh() -> float:
+    # Banded LSH: a single band key in common is enough
+    return 0 if LSH_BANDS > 0 else len(PERMUTATIONS) * HASH_COLLISION_THRESH
+
+
+# Early decision from the candidate collision count (see SKETCH_DECISION_ENABLED)
+def get_candidate_sketch_decision(hash_collisions: int) -> Union[bool, None]:
+    if not SKETCH_DECISION_ENABLED:
+        return None
+    return get_sketch_decision(
+        hash_collisions, len(PERMUTATIONS), SKETCH_ACCEPT_THRESH, SKETCH_REJECT_THRESH
+    )
+
+
+def get_row_doc(row: Tuple) -> str:
+    # concatenate title and text
+    return f"{row[2]} {row[3]}"
+
+
+# There are only a few hundred sources --> memoize their hashes
+@lru_cache(maxsize=None)
+def get_article_source_id_hash(article_source_id: str) -> int:
+    return (
+        article_source_id_hash_generator.get_fingerprint(article_source_id)
+        - ARTICLE_SOURCE_ID_HASH_OFFSET
+    )
+
+
+# Returns the original candidates find_original compares exactly: all of them
+# unless a candidate is accepted from the sketch agreement (then none), without
+# the ones rejected from the sketch agreement
+def get_compared_candidates(candidates: List[ArticleInfo]) -> List[ArticleInfo]:
+    originals = [c for c in candidates if c.is_original]
+
+    if any(c.sketch_decision is True for c in originals):
+        return []
+
+    return [c for c in originals if c.sketch_decision is None]
 
 
 # Returns original article info if exists, None if not
@@ -427,19 +1001,22 @@ def find_original(
     article: ArticleInfo, candidates: List[ArticleInfo]
 ) -> Union[ArticleInfo, None]:
 
-    dc = DocComparator(SHINGLE_LENGTH, MAX_NUM_SHINGLES, DOC_COMPARATOR_OVERLAP_THRESH)
-
-    doc1 = article.title + " " + article.text
+    # Accepted from the sketch agreement: no exact comparison needed
+    for candidate in candidates:
+        if candidate.is_original and candidate.sketch_decision is True:
+            return candidate
 
     for candidate in candidates:
-        # Ignore non-originals
-        if candidate.is_original == False:
+        # Ignore non-originals and candidates rejected from the sketch agreement
+        if candidate.is_original == False or candidate.sketch_decision is False:
             continue
-        doc2 = candidate.title + " " + candidate.text
-        if dc.compare_docs(doc1, doc2):
+        if doc_comparator.compare_shingle_hashes(
+            article.shingle_hashes, candidate.shingle_hashes
+        ):
             return candidate
 
     return None
 
 
-process_articles()
+if __name__ == "__main__":
+    process_articles()
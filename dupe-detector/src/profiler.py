@@ -1,45 +1,245 @@
+import os
+import bisect
 import time
+import json
 import logging
-from typing import Dict, List
+import functools
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Union
+
+# Canonical copy of the profiler. The scraper keeps its own copy
+# (scrapyd/horse_scraper/horse_scraper/services/utils/profiler.py), since the
+# components are built and deployed separately: fixes made here are ported there,
+# while component specific additions stay in their own copy.
+# test/profiler_copy_test.py fails if the parts shared by both copies diverge.
+
+
+class Histogram(object):
+    """
+    Fixed size latency histogram: logarithmic buckets from min_value to max_value
+    seconds (bucket_growth apart), so memory stays constant no matter how many
+    values are recorded. Percentiles are approximated by the bucket upper bounds
+    (relative error < bucket_growth - 1), while count, sum and max are exact.
+    """
+
+    bounds: List[float]
+    counts: List[int]
+
+    def __init__(
+        self,
+        min_value: float = 1e-6,
+        max_value: float = 1e3,
+        bucket_growth: float = 1.1,
+    ):
+        self.bounds = []
+        bound = min_value
+        while bound < max_value:
+            self.bounds.append(bound)
+            bound *= bucket_growth
+        self.bounds.append(float("inf"))
+        self.reset()
+
+    def reset(self):
+        self.counts = [0] * len(self.bounds)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def add(self, value: float):
+        # First bucket with bound >= value
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, q: float) -> float:
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        accum = 0
+        for bound, count in zip(self.bounds, self.counts):
+            accum += count
+            if accum >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def get_stats(self) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "avg": self.sum / self.count if self.count > 0 else 0.0,
+            "p50": self.percentile(0.50),
+            "p95": self.percentile(0.95),
+            "p99": self.percentile(0.99),
+            "max": self.max,
+        }
 
 
 class Profiler(object):
+    """
+    Stage latencies (named spans) and throughput counters, with bounded memory.
+
+    Usage:
+        with profiler.span("compare"):
+            ...
+
+        @profiler.timed("persist")
+        def persist(...):
+            ...
+
+        profiler.count("articles")
+
+    reg_time(label) is still supported: it records the time elapsed since the
+    previous call as the span "<previous label>-<label>".
+
+    If export_path is set, maybe_export() writes the stats every
+    export_interval_sec seconds, in Prometheus text format (*.prom files) or
+    JSON (any other extension), so that they can be scraped by the monitoring.
+
+    Attributes:
+        name (str): metrics prefix.
+        export_path (str): stats file.
+        export_interval_sec (float): min time between exports.
+    """
+
     last_time: float
     last_label: str
-    stats_data: Dict[str, List[float]]
+    histograms: Dict[str, Histogram]
+    counters: Dict[str, int]
 
-    def __init__(self):
+    def __init__(
+        self,
+        name: str = "profiler",
+        export_path: Union[str, None] = None,
+        export_interval_sec: float = 60,
+    ):
+        self.name = name
+        self.export_path = export_path
+        self.export_interval_sec = export_interval_sec
         self.last_time = 0
         self.last_label = "*"
-        self.stats_data = {}
+        self.histograms = {}
+        self.counters = {}
+        self.start_time = time.time()
+        self.last_export_time = self.start_time
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start_time)
+
+    def timed(self, name: str):
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return fn(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def observe(self, name: str, seconds: float):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            histogram = self.histograms[name] = Histogram()
+        histogram.add(seconds)
+
+    def count(self, name: str, value: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + value
 
     def reg_time(self, label: str):
         current_time = time.time()
 
         delta_time_sec = current_time - (self.last_time or current_time)
-        interval_name = f"{self.last_label}-{label}"
-
-        if interval_name in self.stats_data:
-            self.stats_data[interval_name].append(delta_time_sec)
-        else:
-            self.stats_data[interval_name] = [delta_time_sec]
+        self.observe(f"{self.last_label}-{label}", delta_time_sec)
 
         self.last_time = current_time
         self.last_label = label
 
+    def get_stats(self) -> Dict:
+        elapsed_time = time.time() - self.start_time
+        return {
+            "name": self.name,
+            "uptime_sec": elapsed_time,
+            "spans": {
+                name: histogram.get_stats()
+                for name, histogram in sorted(self.histograms.items())
+            },
+            "counters": dict(sorted(self.counters.items())),
+            "rates_per_sec": {
+                name: value / elapsed_time if elapsed_time > 0 else 0.0
+                for name, value in sorted(self.counters.items())
+            },
+        }
+
     def log_stats(self):
         logging.debug(
             "---------------------------------------------------------------------------------------------------------------"
         )
         logging.debug(">> [Profiler stats]")
-        for interval_name in sorted(self.stats_data):
-            values = self.stats_data[interval_name]
-            total = "{:.2f}".format(sum(values))
-            avg = "{:.2f}".format(sum(values) / len(values))
-            logging.debug(f">> {interval_name.rjust(20)}: avg={avg}s, sum={total}s")
+        stats = self.get_stats()
+        for name, s in stats["spans"].items():
+            logging.debug(
+                f">> {name.rjust(20)}: n={s['count']}, avg={'{:.4f}'.format(s['avg'])}s, p50={'{:.4f}'.format(s['p50'])}s, p95={'{:.4f}'.format(s['p95'])}s, p99={'{:.4f}'.format(s['p99'])}s, max={'{:.4f}'.format(s['max'])}s, sum={'{:.2f}'.format(s['sum'])}s"
+            )
+        for name, value in stats["counters"].items():
+            rate = "{:.2f}".format(stats["rates_per_sec"][name])
+            logging.debug(f">> {name.rjust(20)}: {value} ({rate}/s)")
 
         logging.debug(
             "---------------------------------------------------------------------------------------------------------------"
         )
-        # Reset stats data
-        self.stats_data = {}
+
+    def maybe_export(self):
+        if self.export_path is None:
+            return
+        if time.time() - self.last_export_time < self.export_interval_sec:
+            return
+        self.export()
+
+    def export(self):
+        self.last_export_time = time.time()
+        stats = self.get_stats()
+
+        if self.export_path.endswith(".prom"):
+            content = self.format_prometheus(stats)
+        else:
+            content = json.dumps(stats, indent=4)
+
+        # Replace the file atomically, so that scrapers never read half a file
+        tmp_path = self.export_path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as output_file:
+                output_file.write(content)
+            os.replace(tmp_path, self.export_path)
+        except OSError as e:
+            logging.warning(f">> Profiler export failed: {e}")
+
+    def format_prometheus(self, stats: Dict) -> str:
+        name = self.name
+        lines = [f"# TYPE {name}_span_seconds summary"]
+        for span, s in stats["spans"].items():
+            for q, quantile in [("p50", "0.5"), ("p95", "0.95"), ("p99", "0.99")]:
+                lines.append(
+                    f'{name}_span_seconds{{span="{span}",quantile="{quantile}"}} {s[q]}'
+                )
+            lines.append(f'{name}_span_seconds_sum{{span="{span}"}} {s["sum"]}')
+            lines.append(f'{name}_span_seconds_count{{span="{span}"}} {s["count"]}')
+
+        lines.append(f"# TYPE {name}_span_max_seconds gauge")
+        for span, s in stats["spans"].items():
+            lines.append(f'{name}_span_max_seconds{{span="{span}"}} {s["max"]}')
+
+        lines.append(f"# TYPE {name}_events_total counter")
+        for counter, value in stats["counters"].items():
+            lines.append(f'{name}_events_total{{counter="{counter}"}} {value}')
+
+        lines.append(f"# TYPE {name}_uptime_seconds gauge")
+        lines.append(f"{name}_uptime_seconds {stats['uptime_sec']}")
+
+        return "\n".join(lines) + "\n"
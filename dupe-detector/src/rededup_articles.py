@@ -0,0 +1,361 @@
+from typing import Dict, FrozenSet, Iterator, List, Tuple, Union
+
+import logging
+import os
+import sys
+import time
+from datetime import date as Date, timedelta
+
+from . import process_articles as pa
+from .article_write_buffer import ArticleWriteBuffer
+from .doc_analyzer import DocAnalyzer
+from .doc_sketch import DocSketchGenerator
+from .sketch_index import SketchIndex
+
+# Offline re-detection of the duplicates of a date range, e.g. after changing the
+# sketch params (PERMUTATIONS, LSH_*, SHINGLE_LENGTH, SHINGLE_SAMPLING_ENABLED) or
+# the thresholds.
+#
+# The articles of [REDEDUP_DATE_FROM, REDEDUP_DATE_TO] are streamed in (date, id)
+# order and sketched (on WORKER_PROCESSES workers), the originals are indexed in
+# memory (sketch index + shingle hashes of the dates window), and the sketches
+# and decisions are written back in bulk (COPY / UPDATE ... FROM VALUES), in one
+# transaction per set of whole dates of at least REDEDUP_FLUSH_SIZE articles. No
+# per article query is run.
+#
+# The originals of the days before the range are candidates too: they are
+# re-sketched with the current params, but their decisions are kept.
+#
+# The previous sketches (and shingle signatures) of every date are deleted in the
+# transaction that writes the new ones, so an interrupted run leaves every date
+# either done or untouched, and can be run again.
+# The online detector must be stopped while this runs. Articles after the range
+# are not re-evaluated, so they may still point to originals of the range that
+# are now duplicates: extend REDEDUP_DATE_TO if that matters.
+# The syndication clusters (scraper.article_syndication) are not rebuilt: the
+# rows of the articles that are now duplicates are left as they were.
+#
+# The decisions are the ones of an online run that processed every article in
+# date order, which may not match the persisted ones: an article processed online
+# after newer ones (e.g. scraped late) could match an original dated up to
+# WINDOW_DAYS after it, while here the older article is the original (see
+# test/rededup_test.py).
+
+REDEDUP_DATE_FROM = os.environ.get("REDEDUP_DATE_FROM")
+REDEDUP_DATE_TO = os.environ.get("REDEDUP_DATE_TO")
+REDEDUP_FLUSH_SIZE = int(os.environ.get("REDEDUP_FLUSH_SIZE") or 5000)
+REDEDUP_LOG_INTERVAL_SEC = 10
+
+# Same dates window as the candidates lookup
+WINDOW_DAYS = 2
+
+
+class OriginalsWindow(object):
+    """
+    In-memory originals of the dates window (sketch index + shingle hashes), only
+    filled with the articles streamed so far: articles must be detected in date
+    order, and the originals found along the way are indexed.
+
+    Attributes:
+        count_thresh (float): min number of sketch hashes in common (exclusive)
+            of a dupe candidate.
+    """
+
+    shingle_hashes_by_id: Dict[int, FrozenSet[int]]
+    ids_by_date: Dict[Date, List[int]]
+
+    def __init__(self, count_thresh: float):
+        self.count_thresh = count_thresh
+        # Everything lives in memory: the index is only filled through add()
+        self.sketch_index = SketchIndex(lambda dates: [], WINDOW_DAYS)
+        # Shingle hashes of the indexed originals (evicted with the index dates)
+        self.shingle_hashes_by_id = {}
+        self.ids_by_date = {}
+
+    def advance(self, date: Date):
+        self.sketch_index.advance(date)
+        for d in list(self.ids_by_date.keys()):
+            if d not in self.sketch_index.loaded_dates:
+                for id in self.ids_by_date.pop(d):
+                    del self.shingle_hashes_by_id[id]
+
+    def add(
+        self,
+        article_id: int,
+        date: Date,
+        article_source_id_hash: int,
+        hashes: List[int],
+        shingle_hashes: FrozenSet[int],
+    ):
+        if len(hashes) == 0:
+            return
+        self.sketch_index.add(article_id, date, article_source_id_hash, hashes)
+        self.shingle_hashes_by_id[article_id] = shingle_hashes
+        self.ids_by_date.setdefault(date, []).append(article_id)
+
+    # Returns the id of the original of the article (None if it is an original,
+    # which is then indexed)
+    def detect(
+        self,
+        article_id: int,
+        date: Date,
+        article_source_id_hash: int,
+        hashes: List[int],
+        shingle_hashes: FrozenSet[int],
+    ) -> Union[int, None]:
+        self.advance(date)
+
+        original = None
+        if len(hashes) > 0:
+            original = find_original(
+                self.sketch_index,
+                self.shingle_hashes_by_id,
+                hashes,
+                date,
+                article_source_id_hash,
+                shingle_hashes,
+                self.count_thresh,
+            )
+
+        if original is None:
+            self.add(article_id, date, article_source_id_hash, hashes, shingle_hashes)
+
+        return original
+
+
+# Streams the articles (id, date, title, text, article_source_id, is_duplicate)
+# of the dates range, ordered by (date, id), through a server side cursor
+def fetch_range_articles(
+    cnxn, date_from: Date, date_to: Date
+) -> Iterator[List[Tuple]]:
+
+    sql = f"""
+            SELECT
+                    id,
+                    date,
+                    title,
+                    text,
+                    article_source_id,
+                    is_duplicate
+            FROM
+                    scraper.article article
+            WHERE
+                    result = 'success'
+                    AND date >= '{date_from}'
+                    AND date <= '{date_to}'
+            ORDER BY
+                    date,
+                    id
+            """
+
+    cursor = cnxn.cursor(name="range_articles")
+    cursor.itersize = pa.FETCH_CHUNK_SIZE
+    cursor.execute(sql)
+
+    try:
+        while True:
+            rows = cursor.fetchmany(pa.FETCH_CHUNK_SIZE)
+            if len(rows) == 0:
+                break
+            yield rows
+    finally:
+        cursor.close()
+        cnxn.commit()
+
+
+# Deletes the sketches and shingle signatures of the articles of the range
+# (not committed: committed by the flush that writes the new ones)
+def delete_range_sketches(cnxn, date_from: Date, date_to: Date):
+    cursor = cnxn.cursor()
+
+    cursor.execute(
+        f"""
+        DELETE FROM
+                {pa.SKETCH_TABLE}
+        WHERE
+                date >= %s
+                AND date <= %s
+        """,
+        (date_from, date_to),
+    )
+    logging.info(
+        f">> Deleted sketches from {date_from} to {date_to}: {cursor.rowcount} rows"
+    )
+
+    if pa.SHINGLE_SIGNATURES_ENABLED:
+        cursor.execute(
+            f"""
+            DELETE FROM
+                    {pa.SHINGLE_SIGNATURE_TABLE}
+            WHERE
+                    article_id IN (
+                        SELECT
+                                id
+                        FROM
+                                scraper.article
+                        WHERE
+                                date >= %s
+                                AND date <= %s
+                    )
+            """,
+            (date_from, date_to),
+        )
+        logging.info(f">> Deleted shingle signatures: {cursor.rowcount} rows")
+
+    cursor.close()
+
+
+def rededup_articles():
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(levelname)s %(message)s",
+        handlers=[logging.StreamHandler(sys.stdout)],
+    )
+
+    if REDEDUP_DATE_FROM is None or REDEDUP_DATE_TO is None:
+        raise Exception("REDEDUP_DATE_FROM and REDEDUP_DATE_TO must be set")
+
+    date_from = Date.fromisoformat(REDEDUP_DATE_FROM)
+    date_to = Date.fromisoformat(REDEDUP_DATE_TO)
+    context_date_from = date_from - timedelta(days=WINDOW_DAYS)
+
+    logging.info(f">> Re-detecting the duplicates from {date_from} to {date_to}")
+
+    sketch_generator = DocSketchGenerator(
+        pa.ARTICLE_HASH_BASE,
+        2 ** pa.ARTICLE_HASH_BITS,
+        pa.SKETCH_PERMUTATIONS,
+        pa.SHINGLE_LENGTH,
+        pa.MAX_NUM_SHINGLES,
+        pa.SHINGLE_SAMPLING_ENABLED,
+    )
+    doc_analyzer = DocAnalyzer(sketch_generator, pa.WORKER_PROCESSES)
+
+    # cnxn1 streams the articles, cnxn2 is used for the writes
+    cnxn1 = pa.get_db_connection()
+    cnxn2 = pa.get_db_connection()
+
+    # Flushed at the start of a date only (see below)
+    write_buffer = ArticleWriteBuffer(
+        cnxn2,
+        float("inf"),
+        float("inf"),
+        pa.SKETCH_TABLE,
+        pa.SKETCH_HASH_COLUMN,
+        pa.SHINGLE_SIGNATURE_TABLE if pa.SHINGLE_SIGNATURES_ENABLED else None,
+        pa.SKETCH_STORAGE == "compact",
+    )
+
+    originals_window = OriginalsWindow(pa.get_candidates_count_thresh())
+
+    start_time = time.time()
+    last_log_time = start_time
+    processed_count = 0
+    duplicates_count = 0
+    # Last date of the range whose sketches are deleted
+    deleted_date_to = date_from - timedelta(days=1)
+
+    for row, sketch, shingle_hashes in doc_analyzer.analyze_chunks(
+        fetch_range_articles(cnxn1, context_date_from, date_to), pa.get_row_doc
+    ):
+        article_id, date, title, text, article_source_id, was_duplicate = row
+        article_source_id_hash = pa.get_article_source_id_hash(article_source_id)
+        hashes = pa.get_sketch_hashes(sketch)
+
+        if date < date_from:
+            # Context: only its originals are candidates, decisions are kept
+            originals_window.advance(date)
+            if was_duplicate == False:
+                originals_window.add(
+                    article_id, date, article_source_id_hash, hashes, shingle_hashes
+                )
+        else:
+            if date > deleted_date_to:
+                # The dates before are done --> commit them along with their
+                # deletes, then delete the sketches of this one
+                if len(write_buffer.results) >= REDEDUP_FLUSH_SIZE:
+                    write_buffer.flush()
+                delete_range_sketches(cnxn2, deleted_date_to + timedelta(days=1), date)
+                deleted_date_to = date
+
+            original = originals_window.detect(
+                article_id, date, article_source_id_hash, hashes, shingle_hashes
+            )
+
+            is_duplicate = original is not None
+            original_article_id = original if original is not None else article_id
+
+            write_buffer.add_article(
+                article_id,
+                date,
+                article_source_id_hash,
+                hashes,
+                is_duplicate,
+                original_article_id,
+                shingle_hashes,
+            )
+
+            processed_count += 1
+            if is_duplicate:
+                duplicates_count += 1
+
+        if time.time() - last_log_time >= REDEDUP_LOG_INTERVAL_SEC:
+            last_log_time = time.time()
+            articles_per_sec = processed_count / (last_log_time - start_time)
+            logging.info(
+                f">> Article date: {date}, processed articles: {processed_count} (duplicates: {duplicates_count}) at {'{:.1f}'.format(articles_per_sec)} [articles/sec]"
+            )
+
+    if deleted_date_to < date_to:
+        delete_range_sketches(cnxn2, deleted_date_to + timedelta(days=1), date_to)
+    write_buffer.flush()
+    cnxn2.commit()
+    doc_analyzer.shutdown()
+    cnxn1.close()
+    cnxn2.close()
+
+    elapsed_time = time.time() - start_time
+    logging.info(
+        f">> Done: {processed_count} articles (duplicates: {duplicates_count}) in {'{:.1f}'.format(elapsed_time)}s"
+    )
+
+
+# Returns the id of the original of the article, None if it is an original.
+# Same decision as process_articles.process_article (first matching candidate,
+# by collision count), over the in-memory index.
+def find_original(
+    sketch_index: SketchIndex,
+    shingle_hashes_by_id: Dict[int, FrozenSet[int]],
+    hashes: List[int],
+    date: Date,
+    article_source_id_hash: int,
+    shingle_hashes: FrozenSet[int],
+    count_thresh: float,
+) -> Union[int, None]:
+
+    candidate_collisions = sketch_index.find_candidate_collisions(
+        hashes, date, article_source_id_hash, count_thresh
+    )
+    if len(candidate_collisions) == 0:
+        return None
+
+    article = pa.ArticleInfo(0, None, None, False, shingle_hashes)
+    candidates = [
+        pa.ArticleInfo(
+            id,
+            None,
+            None,
+            True,
+            shingle_hashes_by_id[id],
+            pa.get_candidate_sketch_decision(c),
+        )
+        for id, c in candidate_collisions
+    ]
+
+    original = pa.find_original(article, candidates)
+
+    return original.id if original is not None else None
+
+
+if __name__ == "__main__":
+    rededup_articles()
@@ -0,0 +1,55 @@
+from typing import Callable, FrozenSet, Union
+
+from collections import OrderedDict
+
+
+class ShingleSetCache(object):
+    """
+    Bounded LRU cache of the hashed shingle sets of the candidate articles,
+    keyed by article id. The recent originals come up as candidates over and
+    over, so their texts are tokenized and shingled only once.
+
+    Article texts do not change once scraped, so the entries never go stale.
+
+    Attributes:
+        max_size (int): max number of cached sets (0 disables the cache).
+    """
+
+    entries: "OrderedDict[int, FrozenSet[int]]"
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(
+        self, article_id: int, extract: Callable[[], FrozenSet[int]]
+    ) -> FrozenSet[int]:
+        shingle_hashes = self.lookup(article_id)
+
+        if shingle_hashes is None:
+            shingle_hashes = extract()
+            self.put(article_id, shingle_hashes)
+
+        return shingle_hashes
+
+    def lookup(self, article_id: int) -> Union[FrozenSet[int], None]:
+        shingle_hashes = self.entries.get(article_id)
+
+        if shingle_hashes is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.entries.move_to_end(article_id)
+        return shingle_hashes
+
+    def put(self, article_id: int, shingle_hashes: FrozenSet[int]):
+        if self.max_size == 0:
+            return
+
+        self.entries[article_id] = shingle_hashes
+        self.entries.move_to_end(article_id)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
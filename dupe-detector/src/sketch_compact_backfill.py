@@ -0,0 +1,107 @@
+from typing import Any, Tuple, Union
+
+import logging
+import os
+import sys
+import time
+from datetime import date as Date, timedelta
+
+from .process_articles import get_db_connection
+
+# Converts the sketches of scraper.article_sketch (one row per hash) into
+# scraper.article_sketch_compact (one row per article), so that the dupe detector
+# can be switched to SKETCH_STORAGE = 'compact'.
+#
+# The conversion runs in batches of BACKFILL_BATCH_DAYS days (date is indexed in
+# both tables), one transaction per batch, and can run while the detector keeps
+# writing: articles already in the compact table are skipped. It can be resumed
+# from BACKFILL_DATE_FROM (YYYY-MM-DD). Run the detector in compact mode only
+# after the backfill, otherwise the candidates of the older articles are missed.
+
+BACKFILL_BATCH_DAYS = int(os.environ.get("BACKFILL_BATCH_DAYS") or 1)
+BACKFILL_DATE_FROM = os.environ.get("BACKFILL_DATE_FROM")
+
+ROWS_SKETCH_TABLE = "scraper.article_sketch"
+COMPACT_SKETCH_TABLE = "scraper.article_sketch_compact"
+
+
+def get_sketch_dates_range(cursor) -> Tuple[Union[Date, None], Union[Date, None]]:
+    cursor.execute(f"SELECT MIN(date), MAX(date) FROM {ROWS_SKETCH_TABLE}")
+    return cursor.fetchone()
+
+
+# Returns the number of articles converted
+def backfill_dates(cnxn: Any, date_from: Date, date_to: Date) -> int:
+    cursor = cnxn.cursor()
+    cursor.execute(
+        f"""
+        INSERT INTO
+                {COMPACT_SKETCH_TABLE}(
+                    article_id, date, article_source_id_hash, hashes
+                )
+        SELECT
+                article_id,
+                MIN(date),
+                MIN(article_source_id_hash),
+                ARRAY_AGG(hash ORDER BY id)
+        FROM
+                {ROWS_SKETCH_TABLE}
+        WHERE
+                date >= %s
+                AND date <= %s
+        GROUP BY
+                article_id
+        ON CONFLICT DO NOTHING
+        """,
+        (date_from, date_to),
+    )
+    count = cursor.rowcount
+    cnxn.commit()
+    cursor.close()
+    return count
+
+
+def backfill_compact_sketches():
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s %(levelname)s %(message)s",
+        handlers=[logging.StreamHandler(sys.stdout)],
+    )
+
+    cnxn = get_db_connection()
+    cursor = cnxn.cursor()
+    min_date, max_date = get_sketch_dates_range(cursor)
+    cursor.close()
+
+    if min_date is None:
+        logging.info(">> No sketches to convert")
+        return
+
+    if BACKFILL_DATE_FROM is not None:
+        min_date = max(min_date, Date.fromisoformat(BACKFILL_DATE_FROM))
+
+    logging.info(f">> Converting sketches from {min_date} to {max_date}")
+
+    start_time = time.time()
+    total_count = 0
+    date_from = min_date
+
+    while date_from <= max_date:
+        date_to = min(date_from + timedelta(days=BACKFILL_BATCH_DAYS - 1), max_date)
+        count = backfill_dates(cnxn, date_from, date_to)
+        total_count += count
+
+        articles_per_sec = total_count / max(time.time() - start_time, 1e-6)
+        logging.info(
+            f">> {date_from} - {date_to}: {count} articles converted (total: {total_count} at {'{:.1f}'.format(articles_per_sec)} [articles/sec])"
+        )
+
+        date_from = date_to + timedelta(days=1)
+
+    cnxn.close()
+
+    logging.info(f">> Done: {total_count} articles converted")
+
+
+if __name__ == "__main__":
+    backfill_compact_sketches()
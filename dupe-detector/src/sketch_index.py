@@ -0,0 +1,121 @@
+from typing import Callable, Dict, Iterable, List, Set, Tuple
+
+from collections import defaultdict
+from datetime import date as Date, timedelta
+
+# (article_id, date, article_source_id_hash, hash)
+SketchRow = Tuple[int, Date, int, int]
+
+
+class SketchIndex(object):
+    """
+    In-process index of the sketches of the original articles, keyed by
+    (article_source_id_hash, date, hash). It only holds the dates window around
+    the article being processed (+/- window_days), which is the same window used
+    by the candidates query, so that it can replace it.
+
+    The articles must be processed in date order: advance() evicts the dates
+    that fall behind the window and loads the new ones through load_sketches,
+    while add() registers the originals found along the way.
+
+    Attributes:
+        load_sketches (Callable): returns the sketch rows of the originals
+            persisted for the given dates.
+        window_days (int): days before and after the article date.
+    """
+
+    index: Dict[Date, Dict[int, Dict[int, List[int]]]]
+    loaded_dates: Set[Date]
+
+    def __init__(
+        self,
+        load_sketches: Callable[[List[Date]], Iterable[SketchRow]],
+        window_days: int = 2,
+    ):
+        self.load_sketches = load_sketches
+        self.window_days = window_days
+        self.reset()
+
+    def reset(self):
+        self.index = {}
+        self.loaded_dates = set()
+
+    def get_window_dates(self, date: Date) -> List[Date]:
+        date_from = date - timedelta(days=self.window_days)
+        return [date_from + timedelta(days=i) for i in range(2 * self.window_days + 1)]
+
+    def advance(self, date: Date):
+        window_dates = self.get_window_dates(date)
+
+        # Evict the dates outside the window
+        for d in list(self.loaded_dates):
+            if d not in window_dates:
+                del self.index[d]
+                self.loaded_dates.remove(d)
+
+        # Warm up the new ones
+        missing_dates = [d for d in window_dates if d not in self.loaded_dates]
+        if len(missing_dates) == 0:
+            return
+
+        for d in missing_dates:
+            self.index[d] = defaultdict(lambda: defaultdict(list))
+            self.loaded_dates.add(d)
+
+        for article_id, d, article_source_id_hash, h in self.load_sketches(
+            missing_dates
+        ):
+            self.index[d][article_source_id_hash][h].append(article_id)
+
+    def add(
+        self, article_id: int, date: Date, article_source_id_hash: int, hashes: List[int]
+    ):
+        if date not in self.loaded_dates:
+            return
+        hashes_index = self.index[date][article_source_id_hash]
+        for h in hashes:
+            hashes_index[h].append(article_id)
+
+    # Returns the ids of the articles with more than count_thresh
+    # sketch hashes in common, sorted by collision count (desc)
+    def find_candidates(
+        self,
+        hashes: List[int],
+        date: Date,
+        article_source_id_hash: int,
+        count_thresh: float,
+    ) -> List[int]:
+        return [
+            id
+            for id, c in self.find_candidate_collisions(
+                hashes, date, article_source_id_hash, count_thresh
+            )
+        ]
+
+    # Same as find_candidates, returning the (id, collision count) pairs
+    def find_candidate_collisions(
+        self,
+        hashes: List[int],
+        date: Date,
+        article_source_id_hash: int,
+        count_thresh: float,
+    ) -> List[Tuple[int, int]]:
+
+        counts: Dict[int, int] = defaultdict(int)
+        # Same semantics as 'hash IN (...)': repeated hashes are counted once
+        hashes_set = set(hashes)
+
+        for d in self.get_window_dates(date):
+            if d not in self.loaded_dates:
+                continue
+            hashes_index = self.index[d].get(article_source_id_hash)
+            if hashes_index is None:
+                continue
+            for h in hashes_set:
+                for article_id in hashes_index.get(h, []):
+                    counts[article_id] += 1
+
+        candidates = [(c, id) for id, c in counts.items() if c > count_thresh]
+        candidates.sort(key=lambda x: (-x[0], x[1]))
+
+        return [(id, c) for c, id in candidates]
@@ -0,0 +1,256 @@
+from typing import Any, Callable, Dict, List, Set
+
+import logging
+import time
+from collections import Counter
+from datetime import date as Date
+
+
+class SourceLeaseManager(object):
+    """
+    Claim based work distribution for running several dupe detector workers.
+    The work is partitioned by article_source_id_hash (dupe candidates never
+    cross sources), and each partition is a row of scraper.dupe_detector_lease.
+
+    A worker claims up to max_partitions partitions that are free, expired or
+    already its own, least recently claimed first, using SELECT ... FOR UPDATE
+    SKIP LOCKED so that concurrent workers never claim the same one. Leases last
+    lease_duration_sec and must be renewed before that, otherwise other workers
+    may take them over (this is how the partitions of crashed workers are
+    recovered). Renewals also persist the worker progress (processed articles and
+    last article date per partition).
+
+    Once the pending articles of its partitions are processed, the worker
+    releases them (release()), so that the partitions rotate among the workers
+    even if there are more than workers x max_partitions.
+
+    Fencing: renew(cursor) extends the leases in the transaction of the caller
+    (the write buffer flush), so the lease rows stay locked until the results
+    are committed, and the results of the lost partitions can be dropped.
+
+    Attributes:
+        cnxn: db connection, used only by this class.
+        worker_id (str): unique id of this worker.
+        lease_duration_sec (int): lease expiry.
+        max_partitions (int): max number of partitions claimed at once.
+        lease_table (str): lease rows table.
+    """
+
+    claimed_hashes: Set[int]
+    lost_hashes: Set[int]
+    idle_hashes: Set[int]
+    processed_counts: Dict[int, int]
+    last_article_dates: Dict[int, Date]
+
+    def __init__(
+        self,
+        cnxn: Any,
+        worker_id: str,
+        lease_duration_sec: int,
+        max_partitions: int,
+        get_article_source_id_hash: Callable[[str], int],
+        lease_table: str = "scraper.dupe_detector_lease",
+    ):
+        self.cnxn = cnxn
+        self.worker_id = worker_id
+        self.lease_duration_sec = lease_duration_sec
+        self.max_partitions = max_partitions
+        self.get_article_source_id_hash = get_article_source_id_hash
+        self.lease_table = lease_table
+        self.claimed_hashes = set()
+        # Partitions lost since the last claim
+        self.lost_hashes = set()
+        # Partitions released without pending articles since the last ones with
+        # pending articles
+        self.idle_hashes = set()
+        self.idle = False
+        self.processed_counts = Counter()
+        self.last_article_dates = {}
+        self.last_renewal_time = 0.0
+
+    # Returns the ids of the article sources of the claimed partitions
+    def claim(self) -> List[str]:
+        cursor = self.cnxn.cursor()
+
+        source_ids = self.get_article_source_ids(cursor)
+
+        # Make sure every partition has its lease row
+        hashes = sorted(set(self.get_article_source_id_hash(id) for id in source_ids))
+        values_str = ", ".join([f"({h}, 0)" for h in hashes])
+
+        if len(hashes) > 0:
+            sql = f"""
+                    INSERT INTO
+                            {self.lease_table}(
+                                article_source_id_hash,
+                                processed_count
+                            )
+                            VALUES {values_str}
+                    ON CONFLICT DO NOTHING
+                    """
+            cursor.execute(sql)
+            self.cnxn.commit()
+
+        # Claim (or renew) the free, expired and own partitions, least recently
+        # claimed first (so that every partition is eventually processed)
+        sql = f"""
+                UPDATE
+                        {self.lease_table}
+                SET
+                        worker_id = '{self.worker_id}',
+                        expires_at = NOW() + INTERVAL '{self.lease_duration_sec} seconds',
+                        claimed_at = NOW(),
+                        updated_at = NOW()
+                WHERE
+                        article_source_id_hash IN (
+                            SELECT
+                                    article_source_id_hash
+                            FROM
+                                    {self.lease_table}
+                            WHERE
+                                    worker_id = '{self.worker_id}'
+                                    OR worker_id IS NULL
+                                    OR expires_at < NOW()
+                            ORDER BY
+                                    claimed_at NULLS FIRST,
+                                    article_source_id_hash
+                            LIMIT
+                                    {self.max_partitions}
+                            FOR UPDATE SKIP LOCKED
+                        )
+                RETURNING
+                        article_source_id_hash
+                """
+        cursor.execute(sql)
+        self.claimed_hashes = set(row[0] for row in cursor.fetchall())
+        self.lost_hashes = set()
+        self.cnxn.commit()
+        cursor.close()
+
+        self.last_renewal_time = time.time()
+
+        logging.info(
+            f">> Worker {self.worker_id}: {len(self.claimed_hashes)} partitions claimed"
+        )
+
+        return [
+            id
+            for id in source_ids
+            if self.get_article_source_id_hash(id) in self.claimed_hashes
+        ]
+
+    def register_processed(self, article_source_id_hash: int, date: Date):
+        self.processed_counts[article_source_id_hash] += 1
+        self.last_article_dates[article_source_id_hash] = date
+
+    def should_renew(self) -> bool:
+        return time.time() - self.last_renewal_time >= self.lease_duration_sec / 3
+
+    # Extends all the leases and persists the progress. Returns the partitions
+    # lost (lease expired and claimed by another worker), which are also added
+    # to lost_hashes.
+    # If cursor is given, runs in its transaction (committed by the caller), so
+    # that no other worker can claim the partitions until it is committed.
+    def renew(self, cursor: Any = None) -> Set[int]:
+        if len(self.claimed_hashes) == 0:
+            return set()
+
+        hashes = sorted(self.claimed_hashes)
+        values_str = ", ".join(
+            [
+                f"({h}, {self.processed_counts[h]}, {self.get_last_article_date_str(h)})"
+                for h in hashes
+            ]
+        )
+
+        sql = f"""
+                UPDATE
+                        {self.lease_table} AS lease
+                SET
+                        expires_at = NOW() + INTERVAL '{self.lease_duration_sec} seconds',
+                        processed_count = lease.processed_count + data.processed_count,
+                        last_article_date = COALESCE(data.last_article_date, lease.last_article_date),
+                        updated_at = NOW()
+                FROM
+                        (VALUES {values_str}) AS data(article_source_id_hash, processed_count, last_article_date)
+                WHERE
+                        lease.article_source_id_hash = data.article_source_id_hash
+                        AND lease.worker_id = '{self.worker_id}'
+                RETURNING
+                        lease.article_source_id_hash
+                """
+
+        if cursor is not None:
+            cursor.execute(sql)
+            renewed_hashes = set(row[0] for row in cursor.fetchall())
+        else:
+            own_cursor = self.cnxn.cursor()
+            own_cursor.execute(sql)
+            renewed_hashes = set(row[0] for row in own_cursor.fetchall())
+            self.cnxn.commit()
+            own_cursor.close()
+
+        lost_hashes = self.claimed_hashes - renewed_hashes
+        for h in sorted(lost_hashes):
+            logging.warning(f">> Worker {self.worker_id}: lease lost for partition {h}")
+        self.claimed_hashes = renewed_hashes
+        self.lost_hashes |= lost_hashes
+
+        logging.info(
+            f">> Worker {self.worker_id}: processed articles: {sum(self.processed_counts.values())} ({len(self.claimed_hashes)} partitions)"
+        )
+
+        self.processed_counts = Counter()
+        self.last_article_dates = {}
+        self.last_renewal_time = time.time()
+
+        return lost_hashes
+
+    # Gives the claimed partitions up (once their pending articles are
+    # processed), so that they can be claimed by any worker. has_pending tells
+    # whether they had pending articles: once all the released partitions come
+    # back without pending articles, the worker is idle (see idle).
+    def release(self, has_pending: bool):
+        if has_pending:
+            self.idle_hashes = set()
+            self.idle = False
+        else:
+            self.idle = self.claimed_hashes <= self.idle_hashes
+            self.idle_hashes |= self.claimed_hashes
+
+        if len(self.claimed_hashes) == 0:
+            return
+
+        cursor = self.cnxn.cursor()
+        sql = f"""
+                UPDATE
+                        {self.lease_table}
+                SET
+                        worker_id = NULL,
+                        expires_at = NULL,
+                        updated_at = NOW()
+                WHERE
+                        article_source_id_hash IN ({", ".join(str(h) for h in sorted(self.claimed_hashes))})
+                        AND worker_id = '{self.worker_id}'
+                """
+        cursor.execute(sql)
+        self.cnxn.commit()
+        cursor.close()
+
+        self.claimed_hashes = set()
+
+    def get_last_article_date_str(self, article_source_id_hash: int) -> str:
+        last_article_date = self.last_article_dates.get(article_source_id_hash)
+        if last_article_date is None:
+            return "NULL::date"
+        return f"'{last_article_date}'::date"
+
+    def get_article_source_ids(self, cursor) -> List[str]:
+        sql = f"""
+                SELECT
+                        id
+                FROM
+                        scraper.article_source
+                """
+        cursor.execute(sql)
+        return [str(row[0]) for row in cursor.fetchall()]
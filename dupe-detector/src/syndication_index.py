@@ -0,0 +1,195 @@
+from typing import Dict, Iterable, Iterator, List, Tuple, Union
+
+from datetime import date as Date, timedelta
+
+from .lsh import get_band_keys
+from .sketch_index import SketchIndex, SketchRow
+
+# Clustering results of an article: (article id --> cluster id) of the articles
+# that joined a cluster, and the (old cluster id, new cluster id) merges, in order
+SyndicationChanges = Tuple[Dict[int, int], List[Tuple[int, int]]]
+
+# All the articles share a single partition of the sketch index
+GLOBAL_PARTITION = 0
+
+
+class UnionFind(object):
+    """
+    Disjoint sets of article ids (union by min id, path compression), so that
+    the id of a cluster (its root) is the id of its first article and never
+    changes unless the cluster is merged into an older one.
+    """
+
+    parent: Dict[int, int]
+    size: Dict[int, int]
+
+    def __init__(self):
+        self.parent = {}
+        self.size = {}
+
+    def add(self, id: int):
+        if id not in self.parent:
+            self.parent[id] = id
+            self.size[id] = 1
+
+    def find(self, id: int) -> int:
+        root = id
+        while self.parent[root] != root:
+            root = self.parent[root]
+        # Path compression
+        while self.parent[id] != root:
+            self.parent[id], id = root, self.parent[id]
+        return root
+
+    # Returns the root of the merged set
+    def union(self, id1: int, id2: int) -> int:
+        root1 = self.find(id1)
+        root2 = self.find(id2)
+        if root1 == root2:
+            return root1
+        if root2 < root1:
+            root1, root2 = root2, root1
+        self.parent[root2] = root1
+        self.size[root1] += self.size.pop(root2)
+        return root1
+
+    # Forgets every id that is neither live nor the root of a live id
+    def prune(self, live_ids: Iterable[int]):
+        live_ids = set(live_ids)
+        roots = set(self.find(id) for id in live_ids)
+        for id in list(self.parent.keys()):
+            if id not in live_ids and id not in roots:
+                del self.parent[id]
+                self.size.pop(id, None)
+
+
+class SyndicationIndex(object):
+    """
+    Cross-source near duplicates (e.g. wire service stories republished by many
+    sources). Every original is looked up in an in-memory banded LSH index of
+    the originals of all the sources in the dates window (+/- window_days), and
+    linked to the ones of other sources whose sketches agree on at least
+    similarity_thresh of their min hashes (Jaccard similarity estimate).
+    Linked articles are grouped into clusters with union-find.
+
+    Lookups cost a few dict accesses per band no matter the number of sources,
+    unlike a GROUP BY over the sketches of all of them.
+
+    add() advances the window. The originals are kept until their date falls
+    behind the window of the newest date added, so that when a cycle restarts
+    at an older date, the band index of its window is rebuilt from the kept
+    originals instead of losing the newer ones.
+    The index is not persisted: after a restart (or a reset, once partitions
+    were lost), the articles processed before are not linked to the new ones.
+
+    Attributes:
+        bands (int): LSH bands.
+        rows (int): min hashes per band (sketches are bands * rows long).
+        similarity_thresh (float): min fraction of equal min hashes.
+        window_days (int): days before and after the article date.
+    """
+
+    sketches: Dict[int, Tuple[int, List[int]]]
+    ids_by_date: Dict[Date, List[int]]
+
+    def __init__(
+        self, bands: int, rows: int, similarity_thresh: float, window_days: int = 2
+    ):
+        self.bands = bands
+        self.rows = rows
+        self.similarity_thresh = similarity_thresh
+        self.window_days = window_days
+        # Band keys of the window originals (all sources share one partition),
+        # loaded from the kept originals
+        self.band_index = SketchIndex(self.load_band_keys, window_days)
+        # article id --> (article_source_id_hash, sketch)
+        self.sketches = {}
+        self.ids_by_date = {}
+        self.clusters = UnionFind()
+        self.newest_date: Union[Date, None] = None
+
+    # Forgets every original and cluster (e.g. after partitions were lost, as
+    # the clusters may refer to their dropped articles)
+    def reset(self):
+        self.band_index.reset()
+        self.sketches = {}
+        self.ids_by_date = {}
+        self.clusters = UnionFind()
+        self.newest_date = None
+
+    def load_band_keys(self, dates: List[Date]) -> Iterator[SketchRow]:
+        for d in dates:
+            for id in self.ids_by_date.get(d, []):
+                for key in get_band_keys(self.sketches[id][1], self.bands, self.rows):
+                    yield (id, d, GLOBAL_PARTITION, key)
+
+    def advance(self, date: Date):
+        self.band_index.advance(date)
+
+        # Older date (e.g. a new cycle): the newer originals are kept
+        if self.newest_date is not None and date <= self.newest_date:
+            return
+        self.newest_date = date
+
+        window_start_date = date - timedelta(days=self.window_days)
+        evicted_dates = [d for d in self.ids_by_date if d < window_start_date]
+        if len(evicted_dates) == 0:
+            return
+
+        for d in evicted_dates:
+            for id in self.ids_by_date.pop(d):
+                del self.sketches[id]
+        self.clusters.prune(self.sketches.keys())
+
+    def add(
+        self,
+        article_id: int,
+        date: Date,
+        article_source_id_hash: int,
+        sketch: List[int],
+    ) -> SyndicationChanges:
+
+        clustered: Dict[int, int] = {}
+        merges: List[Tuple[int, int]] = []
+
+        self.advance(date)
+        if len(sketch) == 0:
+            return clustered, merges
+
+        band_keys = get_band_keys(sketch, self.bands, self.rows)
+        self.clusters.add(article_id)
+
+        for id in self.band_index.find_candidates(
+            band_keys, date, GLOBAL_PARTITION, 0
+        ):
+            candidate_source_id_hash, candidate_sketch = self.sketches[id]
+            if candidate_source_id_hash == article_source_id_hash:
+                continue
+            if not self.is_similar(sketch, candidate_sketch):
+                continue
+
+            root1 = self.clusters.find(article_id)
+            root2 = self.clusters.find(id)
+            if root1 == root2:
+                continue
+
+            # Singletons join a cluster (they have no cluster row yet)
+            for root in (root1, root2):
+                if self.clusters.size[root] == 1:
+                    clustered[root] = root
+
+            root = self.clusters.union(root1, root2)
+            # The rows of the other (existing) cluster are moved into this one
+            old_root = root2 if root == root1 else root1
+            if old_root not in clustered:
+                merges.append((old_root, root))
+
+        self.band_index.add(article_id, date, GLOBAL_PARTITION, band_keys)
+        self.sketches[article_id] = (article_source_id_hash, sketch)
+        self.ids_by_date.setdefault(date, []).append(article_id)
+
+        return {id: self.clusters.find(id) for id in clustered}, merges
+
+    def is_similar(self, sketch1: List[int], sketch2: List[int]) -> bool:
+        equal_count = sum(1 for h1, h2 in zip(sketch1, sketch2) if h1 == h2)
+        return equal_count >= self.similarity_thresh * len(sketch1)
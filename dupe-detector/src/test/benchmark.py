@@ -0,0 +1,500 @@
+from typing import Dict, List, Tuple, Union
+
+import json
+import os
+import random
+import time
+import uuid
+from datetime import date as Date, timedelta
+
+from ..utils import *
+from .. import process_articles as pa
+from ..article_write_buffer import ArticleWriteBuffer
+from ..binary_classif import BinaryClassifStats
+from ..doc_analyzer import DocAnalyzer, analyze_docs_with
+from ..doc_comparator import DocComparator
+from ..doc_sketch import DocSketchGenerator
+from ..profiler import Profiler
+from ..shingle_set_cache import ShingleSetCache
+from ..sketch_index import SketchIndex
+from ..syndication_index import SyndicationIndex
+
+# Throughput benchmark of the dupe detector: sketch, candidates lookup, comparison
+# and decision over a synthetic corpus. The corpus only depends on the params
+# below, so the results of different runs (code versions) are comparable.
+#
+# Backends (BENCHMARK_BACKENDS, comma separated):
+#   memory:   in-process pipeline, no db: the in-memory sketch index (whatever
+#             SKETCH_INDEX_MODE) and shingle cache, with the same sketch hashes,
+#             candidates threshold and decision (process_articles.find_original)
+#             as process_article, so LSH_*, SKETCH_DECISION_*, SYNDICATION_* and
+#             SHINGLE_SAMPLING_ENABLED apply. Nothing is persisted.
+#   postgres: process_articles.process_article against the db set by the DB_*
+#             env vars (a local stand-in, never production). The corpus is
+#             inserted under its own article sources, which are cleaned up first.
+
+BENCHMARK_BACKENDS = (os.environ.get("BENCHMARK_BACKENDS") or "memory").split(",")
+BENCHMARK_SEED = int(os.environ.get("BENCHMARK_SEED") or 2021)
+BENCHMARK_SOURCES = int(os.environ.get("BENCHMARK_SOURCES") or 20)
+BENCHMARK_DAYS = int(os.environ.get("BENCHMARK_DAYS") or 10)
+BENCHMARK_ARTICLES_PER_DAY = int(os.environ.get("BENCHMARK_ARTICLES_PER_DAY") or 200)
+BENCHMARK_DUPLICATE_RATE = float(os.environ.get("BENCHMARK_DUPLICATE_RATE") or 0.2)
+BENCHMARK_VOCABULARY_SIZE = 5000
+BENCHMARK_MIN_WORDS = 100
+BENCHMARK_MAX_WORDS = 800
+# Fraction of the words of a duplicate that are edited
+BENCHMARK_EDIT_RATE = 0.03
+BENCHMARK_START_DATE = Date(2021, 1, 1)
+# Same dates window as the candidates lookup
+DUPE_WINDOW_DAYS = 2
+
+# Results of the last run, compared against by the next one (not tracked)
+RESULTS_FILE = "benchmark_results.json"
+
+# Current file path
+dir_path = os.path.dirname(os.path.realpath(__file__))
+output_path = dir_path + "/output"
+
+
+class SyntheticArticle(object):
+    def __init__(
+        self,
+        id: int,
+        date: Date,
+        article_source_id: str,
+        title: str,
+        text: str,
+        original_id: Union[int, None],
+    ):
+        self.id = id
+        self.date = date
+        self.article_source_id = article_source_id
+        self.title = title
+        self.text = text
+        # Id of the article it duplicates (None for originals)
+        self.original_id = original_id
+
+
+def generate_corpus() -> List[SyntheticArticle]:
+    rnd = random.Random(BENCHMARK_SEED)
+
+    letters = "abcdefghijklmnopqrstuvwxyzáéíóúñ"
+    vocabulary = [
+        "".join(rnd.choice(letters) for j in range(length))
+        for length in (rnd.randint(3, 10) for i in range(BENCHMARK_VOCABULARY_SIZE))
+    ]
+    source_ids = [
+        str(uuid.uuid5(uuid.NAMESPACE_URL, f"benchmark-source-{i}"))
+        for i in range(BENCHMARK_SOURCES)
+    ]
+
+    articles: List[SyntheticArticle] = []
+    # Originals of the last days (dupe candidates window), per source
+    recent_originals: Dict[str, List[SyntheticArticle]] = {id: [] for id in source_ids}
+
+    for day in range(BENCHMARK_DAYS):
+        date = BENCHMARK_START_DATE + timedelta(days=day)
+
+        for source_id in source_ids:
+            recent_originals[source_id] = [
+                a
+                for a in recent_originals[source_id]
+                if (date - a.date).days <= DUPE_WINDOW_DAYS
+            ]
+
+        for i in range(BENCHMARK_ARTICLES_PER_DAY):
+            id = len(articles) + 1
+            source_id = rnd.choice(source_ids)
+            originals = recent_originals[source_id]
+
+            if len(originals) > 0 and rnd.random() < BENCHMARK_DUPLICATE_RATE:
+                original = rnd.choice(originals)
+                words = original.text.split(" ")
+                for j in range(int(len(words) * BENCHMARK_EDIT_RATE)):
+                    words[rnd.randrange(len(words))] = rnd.choice(vocabulary)
+                text = " ".join(words)
+                articles.append(
+                    SyntheticArticle(
+                        id, date, source_id, original.title, text, original.id
+                    )
+                )
+            else:
+                num_words = rnd.randint(BENCHMARK_MIN_WORDS, BENCHMARK_MAX_WORDS)
+                article = SyntheticArticle(
+                    id,
+                    date,
+                    source_id,
+                    " ".join(rnd.choice(vocabulary) for j in range(8)),
+                    " ".join(rnd.choice(vocabulary) for j in range(num_words)),
+                    None,
+                )
+                articles.append(article)
+                originals.append(article)
+
+    return articles
+
+
+# Returns the stage (profiler span) stats, the decisions (article id --> original
+# article id) and the total processing time of a backend
+def run_memory_backend(
+    articles: List[SyntheticArticle],
+) -> Tuple[Dict, Dict[int, int], float]:
+    sketchGenerator = DocSketchGenerator(
+        pa.ARTICLE_HASH_BASE,
+        2 ** pa.ARTICLE_HASH_BITS,
+        pa.ANALYSIS_PERMUTATIONS,
+        pa.SHINGLE_LENGTH,
+        pa.MAX_NUM_SHINGLES,
+        pa.SHINGLE_SAMPLING_ENABLED,
+    )
+    docComparator = DocComparator(
+        pa.SHINGLE_LENGTH,
+        pa.MAX_NUM_SHINGLES,
+        pa.DOC_COMPARATOR_OVERLAP_THRESH,
+        pa.SHINGLE_SAMPLING_ENABLED,
+    )
+    sketchIndex = SketchIndex(lambda dates: [], DUPE_WINDOW_DAYS)
+    shingleCache = ShingleSetCache(pa.SHINGLE_CACHE_SIZE)
+    texts_by_id = {a.id: a.title + " " + a.text for a in articles}
+
+    syndicationIndex: Union[SyndicationIndex, None] = None
+    if pa.SYNDICATION_ENABLED:
+        syndicationIndex = SyndicationIndex(
+            pa.SYNDICATION_BANDS, pa.SYNDICATION_ROWS, pa.SYNDICATION_SIMILARITY_THRESH
+        )
+
+    count_thresh = pa.get_candidates_count_thresh()
+    # Same span names as process_articles
+    profiler = Profiler("benchmark_memory")
+    # article id --> original article id
+    decisions: Dict[int, int] = {}
+
+    start_time = time.perf_counter()
+
+    for article in articles:
+        article_source_id_hash = pa.get_article_source_id_hash(
+            article.article_source_id
+        )
+
+        with profiler.span("fetch_and_analyze"):
+            sketch, shingle_hashes = analyze_docs_with(
+                sketchGenerator, [texts_by_id[article.id]]
+            )[0]
+            hashes = pa.get_sketch_hashes(sketch)
+
+        with profiler.span("candidates_lookup"):
+            sketchIndex.advance(article.date)
+            candidate_collisions = sketchIndex.find_candidate_collisions(
+                hashes, article.date, article_source_id_hash, count_thresh
+            )
+
+        with profiler.span("compare"):
+            # The index only holds originals
+            candidates = [
+                pa.ArticleInfo(
+                    id,
+                    None,
+                    None,
+                    True,
+                    sketch_decision=pa.get_candidate_sketch_decision(c),
+                )
+                for id, c in candidate_collisions
+            ]
+            # Only the compared candidates need their shingles (cache or text)
+            for candidate in pa.get_compared_candidates(candidates):
+                candidate.shingle_hashes = shingleCache.get(
+                    candidate.id,
+                    lambda: docComparator.extract_shingle_hashes(
+                        texts_by_id[candidate.id]
+                    ),
+                )
+            original = pa.find_original(
+                pa.ArticleInfo(article.id, None, None, False, shingle_hashes),
+                candidates,
+            )
+            original_id = original.id if original is not None else article.id
+
+        with profiler.span("persist"):
+            decisions[article.id] = original_id
+            if original_id == article.id and len(hashes) > 0:
+                sketchIndex.add(
+                    article.id, article.date, article_source_id_hash, hashes
+                )
+                shingleCache.put(article.id, shingle_hashes)
+
+        if original_id == article.id and syndicationIndex is not None:
+            with profiler.span("syndication"):
+                syndicationIndex.add(
+                    article.id,
+                    article.date,
+                    article_source_id_hash,
+                    pa.get_syndication_sketch(sketch),
+                )
+
+    elapsed_time = time.perf_counter() - start_time
+
+    return profiler.get_stats()["spans"], decisions, elapsed_time
+
+
+def run_postgres_backend(
+    articles: List[SyntheticArticle],
+) -> Tuple[Dict, Dict[int, int], float]:
+    cnxn1 = pa.get_db_connection()
+    cnxn2 = pa.get_db_connection()
+    cursor2 = cnxn2.cursor()
+
+    source_ids = sorted(set(a.article_source_id for a in articles))
+    db_ids = load_corpus(cnxn2, articles, source_ids)
+    synthetic_ids = {db_id: id for id, db_id in db_ids.items()}
+
+    sketchGenerator = DocSketchGenerator(
+        pa.ARTICLE_HASH_BASE,
+        2 ** pa.ARTICLE_HASH_BITS,
+        pa.ANALYSIS_PERMUTATIONS,
+        pa.SHINGLE_LENGTH,
+        pa.MAX_NUM_SHINGLES,
+        pa.SHINGLE_SAMPLING_ENABLED,
+    )
+    docAnalyzer = DocAnalyzer(sketchGenerator, pa.WORKER_PROCESSES)
+    writeBuffer = ArticleWriteBuffer(
+        cnxn2,
+        pa.WRITE_FLUSH_SIZE,
+        pa.WRITE_FLUSH_INTERVAL_SEC,
+        pa.SKETCH_TABLE,
+        pa.SKETCH_HASH_COLUMN,
+        pa.SHINGLE_SIGNATURE_TABLE if pa.SHINGLE_SIGNATURES_ENABLED else None,
+        pa.SKETCH_STORAGE == "compact",
+        pa.SYNDICATION_TABLE,
+    )
+    sketchIndex: Union[SketchIndex, None] = None
+    if pa.SKETCH_INDEX_MODE != "off":
+        sketchIndex = SketchIndex(
+            lambda dates: pa.load_original_sketches(cnxn2, dates), DUPE_WINDOW_DAYS
+        )
+
+    syndicationIndex: Union[SyndicationIndex, None] = None
+    if pa.SYNDICATION_ENABLED:
+        syndicationIndex = SyndicationIndex(
+            pa.SYNDICATION_BANDS, pa.SYNDICATION_ROWS, pa.SYNDICATION_SIMILARITY_THRESH
+        )
+
+    profiler = Profiler("benchmark_postgres")
+    last_article_key = None
+
+    start_time = time.perf_counter()
+
+    # Same loop as process_articles, restricted to the benchmark sources
+    while True:
+        batch_articles_count = 0
+        wait_start_time = time.perf_counter()
+
+        for row, sketch, shingle_hashes in docAnalyzer.analyze_chunks(
+            pa.fetch_pending_articles(cnxn1, last_article_key, source_ids),
+            pa.get_row_doc,
+        ):
+            profiler.observe(
+                "fetch_and_analyze", time.perf_counter() - wait_start_time
+            )
+            last_article_key = (row[1], row[0])
+            batch_articles_count += 1
+
+            if sketchIndex is not None:
+                sketchIndex.advance(row[1])
+
+            pa.process_article(
+                cursor2,
+                writeBuffer,
+                sketchIndex,
+                row,
+                sketch,
+                shingle_hashes,
+                profiler,
+                syndicationIndex,
+            )
+            wait_start_time = time.perf_counter()
+
+        if batch_articles_count < pa.ARTICLES_BATCH_SIZE:
+            break
+
+    writeBuffer.flush()
+    elapsed_time = time.perf_counter() - start_time
+    docAnalyzer.shutdown()
+
+    stage_stats = profiler.get_stats()["spans"]
+
+    cursor2.execute(
+        f"""
+        SELECT
+                id,
+                original_article_id
+        FROM
+                scraper.article
+        WHERE
+                article_source_id IN ({", ".join([f"'{id}'" for id in source_ids])})
+        """
+    )
+    decisions = {
+        synthetic_ids[id]: synthetic_ids.get(original_id, 0)
+        for id, original_id in cursor2.fetchall()
+    }
+
+    cnxn1.close()
+    cnxn2.close()
+
+    return stage_stats, decisions, elapsed_time
+
+
+# Inserts the corpus (after removing the data of previous runs).
+# Returns the db id of every synthetic article id.
+def load_corpus(
+    cnxn, articles: List[SyntheticArticle], source_ids: List[str]
+) -> Dict[int, int]:
+    cursor = cnxn.cursor()
+    sources_str = ", ".join([f"'{id}'" for id in source_ids])
+
+    for table in [
+        "scraper.article_sketch",
+        "scraper.article_sketch_band",
+        "scraper.article_sketch_compact",
+        "scraper.article_syndication",
+        "scraper.article_shingle_signature",
+    ]:
+        cursor.execute(
+            f"""
+            DELETE FROM
+                    {table}
+            WHERE
+                    article_id IN (
+                        SELECT
+                                id
+                        FROM
+                                scraper.article
+                        WHERE
+                                article_source_id IN ({sources_str})
+                    )
+            """
+        )
+    cursor.execute(
+        f"DELETE FROM scraper.article WHERE article_source_id IN ({sources_str})"
+    )
+
+    for i, id in enumerate(source_ids):
+        cursor.execute(
+            f"""
+            INSERT INTO
+                    scraper.article_source(
+                        id, name, country, url, tier, reach, ad_value_500
+                    )
+                    VALUES (
+                        '{id}', 'Benchmark source {i}', 'benchmark', 'benchmark-{i}', 0, 0, 0
+                    )
+            ON CONFLICT DO NOTHING
+            """
+        )
+
+    db_ids: Dict[int, int] = {}
+    for article in articles:
+        cursor.execute(
+            """
+            INSERT INTO
+                    scraper.article(
+                        url, title, text, date, article_source_id, result
+                    )
+                    VALUES (%s, %s, %s, %s, %s, 'success')
+            RETURNING id
+            """,
+            (
+                f"benchmark-{article.id}",
+                article.title,
+                article.text,
+                article.date,
+                article.article_source_id,
+            ),
+        )
+        db_ids[article.id] = cursor.fetchone()[0]
+
+    cnxn.commit()
+    cursor.close()
+
+    return db_ids
+
+
+def print_stage_stats(stage_stats: Dict[str, Dict]):
+    for stage, stats in stage_stats.items():
+        ms = {
+            k: "{:.3f}".format(1000 * stats[k])
+            for k in ["avg", "p50", "p95", "p99", "max"]
+        }
+        print(
+            f">> {stage.rjust(18)}: n={stats['count']}, avg={ms['avg']}ms, p50={ms['p50']}ms, p95={ms['p95']}ms, p99={ms['p99']}ms, max={ms['max']}ms"
+        )
+
+
+def run_benchmark():
+    print_title_1("Dupe detector benchmark")
+
+    articles = generate_corpus()
+    num_duplicates = sum(1 for a in articles if a.original_id is not None)
+    print(
+        f">> Corpus: {len(articles)} articles, {num_duplicates} duplicates, {BENCHMARK_SOURCES} sources, {BENCHMARK_DAYS} days (seed: {BENCHMARK_SEED})"
+    )
+
+    params = {
+        "seed": BENCHMARK_SEED,
+        "sources": BENCHMARK_SOURCES,
+        "days": BENCHMARK_DAYS,
+        "articles_per_day": BENCHMARK_ARTICLES_PER_DAY,
+        "duplicate_rate": BENCHMARK_DUPLICATE_RATE,
+    }
+
+    # Only runs over the same corpus are comparable
+    previous_results = {}
+    if os.path.exists(output_path + "/" + RESULTS_FILE):
+        with open(output_path + "/" + RESULTS_FILE, encoding="utf-8") as input_file:
+            previous_results = json.load(input_file)
+        if previous_results.get("params") != params:
+            previous_results = {}
+
+    results = {}
+
+    for backend in BENCHMARK_BACKENDS:
+        print_subtitle_1(f"Backend: {backend}")
+
+        if backend == "memory":
+            stage_stats, decisions, elapsed_time = run_memory_backend(articles)
+        elif backend == "postgres":
+            stage_stats, decisions, elapsed_time = run_postgres_backend(articles)
+        else:
+            raise Exception(f"Unknown benchmark backend: {backend}")
+
+        articles_per_sec = len(articles) / elapsed_time
+        print(f">> Throughput: {'{:.1f}'.format(articles_per_sec)} [articles/sec]")
+        print_stage_stats(stage_stats)
+
+        duplicateStats = BinaryClassifStats(f"{backend} duplicates")
+        for article in articles:
+            is_duplicate = decisions.get(article.id, article.id) != article.id
+            duplicateStats.add_result(is_duplicate, article.original_id is not None)
+        duplicateStats.print_stats()
+
+        results[backend] = {
+            "articles_per_sec": articles_per_sec,
+            "stages": stage_stats,
+            "duplicate_stats": duplicateStats.get_stats(),
+        }
+
+        # Regressions against the previous run
+        previous = previous_results.get(backend)
+        if previous is not None:
+            change = articles_per_sec / previous["articles_per_sec"] - 1
+            print(
+                f">> Throughput change vs previous run: {'{:+.1f}'.format(100 * change)}%"
+            )
+
+    os.makedirs(output_path, exist_ok=True)
+    with open(output_path + "/" + RESULTS_FILE, "w", encoding="utf-8") as output_file:
+        json.dump({"params": params, **results}, output_file, indent=4)
+
+
+if __name__ == "__main__":
+    run_benchmark()
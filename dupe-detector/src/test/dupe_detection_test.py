@@ -1,14 +1,23 @@
-from typing import List
+from typing import Dict, FrozenSet, List, Tuple
 
+import contextlib
+import csv
+import io
+import itertools
 import json
 import os
 import random
 import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 
 from ..utils import *
-from ..doc_sketch import DocSketchGenerator
-from ..doc_comparator import DocComparator
+from .. import process_articles as pa
+from ..doc_sketch import DocSketchGenerator, get_sketch_decision
+from ..doc_comparator import DocComparator, get_shingle_hashes
 from ..binary_classif import *
+from ..lsh import generate_permutations, get_band_keys
 
 # Configure PrettyPrinter
 import pprint
@@ -18,6 +27,8 @@ pp = pprint.PrettyPrinter(indent=4, sort_dicts=False)
 
 # Current file path
 dir_path = os.path.dirname(os.path.realpath(__file__))
+# Results tables of the sweep (not tracked)
+output_path = dir_path + "/output"
 
 # Load data
 with open(dir_path + "/comparison_docs.json", encoding="utf-8") as input_file:
@@ -33,9 +44,50 @@ shingle_length_list: List[int] = params_data["shingle_length"]
 max_num_shingles_list: List[int] = params_data["max_num_shingles"]
 hash_collision_thresh_list: List[float] = params_data["hash_collision_thresh"]
 overlap_thresh_list: List[float] = params_data["overlap_thresh"]
-
-
-def run_test_for_params(params):
+lsh_configs: List[Dict[str, int]] = params_data.get("lsh_configs", [])
+sketch_decision_bands: List[Dict[str, float]] = params_data.get(
+    "sketch_decision_bands", []
+)
+# The test docs are shorter than max_num_shingles: the sampling is also run with
+# these lower caps, so that it is exercised on capped docs
+sampling_max_num_shingles_list: List[int] = params_data.get(
+    "sampling_max_num_shingles", []
+)
+
+# The params sets are run in parallel
+SWEEP_PROCESSES = int(os.environ.get("SWEEP_PROCESSES") or os.cpu_count() or 1)
+
+docs = [doc for c in docs_data for doc in (c["doc1"], c["doc2"])]
+
+
+# The shingles and fingerprints of the docs only depend on (shingle_length, base,
+# hash_bits), so they are computed once per process and reused by every params set
+# (only the permutations and thresholds are recomputed)
+@lru_cache(maxsize=None)
+def get_docs_shingles(shingle_length: int) -> List[List[str]]:
+    sketchGenerator = DocSketchGenerator(0, 1, [], shingle_length, 0)
+    return [sketchGenerator.extract_shingle_list(doc) for doc in docs]
+
+
+@lru_cache(maxsize=None)
+def get_docs_shingle_hashes(shingle_length: int) -> List[FrozenSet[int]]:
+    return [
+        get_shingle_hashes(shingles) for shingles in get_docs_shingles(shingle_length)
+    ]
+
+
+@lru_cache(maxsize=None)
+def get_docs_fingerprints(
+    shingle_length: int, base: int, hash_bits: int
+) -> List[List[int]]:
+    sketchGenerator = DocSketchGenerator(base, 2 ** hash_bits, [], shingle_length, 0)
+    return [
+        [sketchGenerator.get_fingerprint(sh) for sh in shingles]
+        for shingles in get_docs_shingles(shingle_length)
+    ]
+
+
+def run_test_for_params(params, seed: int):
     num_permutations = params["num_permutations"]
     base = params["base"]
     hash_bits = params["hash_bits"]
@@ -46,7 +98,9 @@ def run_test_for_params(params):
 
     modulo = 2 ** hash_bits
 
-    permutations = [random.randint(0, modulo - 1) for i in range(num_permutations)]
+    # Seeded, so that every params set gets its own (repeatable) permutations
+    rnd = random.Random(seed)
+    permutations = [rnd.randint(0, modulo - 1) for i in range(num_permutations)]
 
     dupeCandidateStats = BinaryClassifStats("Duplicate candidate")
     docComparisonStats = BinaryClassifStats("Doc comparison")
@@ -66,21 +120,29 @@ def run_test_for_params(params):
 
     print_subtitle_1("Comparing documents")
 
+    # Sketch all the documents in a single batch
+    sketches = sketchGenerator.generate_sketches_from_fingerprints(
+        get_docs_fingerprints(shingle_length, base, hash_bits)
+    )
+    shingle_hashes = get_docs_shingle_hashes(shingle_length)
+
     # Iterate through all the comparisons
     for i, comparison in enumerate(docs_data):
         doc1 = comparison["doc1"]
         doc2 = comparison["doc2"]
         are_duplicates = comparison["are_duplicates"]
 
-        sketch1 = sketchGenerator.generate_sketch(doc1)
-        sketch2 = sketchGenerator.generate_sketch(doc2)
+        sketch1 = sketches[2 * i]
+        sketch2 = sketches[2 * i + 1]
         hash_collisions = list(set(sketch1).intersection(sketch2))
         are_dupe_candidates = (
             len(hash_collisions) / num_permutations > hash_collision_thresh
         )
 
         similarity = (
-            docComparator.docs_similarity(doc1, doc2) if are_dupe_candidates else 0
+            docComparator.jaccard_sets(shingle_hashes[2 * i], shingle_hashes[2 * i + 1])
+            if are_dupe_candidates
+            else 0
         )
         comparison_result = similarity > overlap_thresh
 
@@ -129,6 +191,37 @@ def run_test_for_params(params):
     dupe_candidate_stats = dupeCandidateStats.get_stats()
     doc_comparison_stats = docComparisonStats.get_stats()
 
+    # Banded LSH configurations, compared against the collision threshold
+    num_candidates = dupe_candidate_stats["tp"] + dupe_candidate_stats["fp"]
+    lsh_results = [
+        run_lsh_test_for_params(params, lsh_config, docComparator, num_candidates)
+        for lsh_config in lsh_configs
+    ]
+
+    # Early accept/reject of the candidates from their sketch agreement
+    sketch_decision_results = [
+        run_sketch_decision_test_for_params(
+            params, band, sketches, shingle_hashes, docComparator
+        )
+        for band in sketch_decision_bands
+    ]
+
+    # Bottom-k shingle sampling (MAX_NUM_SHINGLES cap) vs full shingle sets
+    sampling_results = [
+        run_sampling_test_for_params(
+            params, permutations, sampling_max_num_shingles, bottom_k_sampling
+        )
+        for sampling_max_num_shingles in [max_num_shingles]
+        + sampling_max_num_shingles_list
+        for bottom_k_sampling in [False, True]
+    ]
+    if len(sampling_max_num_shingles_list) > 0 and not any(
+        results["capped_docs"] > 0
+        for results in sampling_results
+        if results["bottom_k_sampling"]
+    ):
+        raise Exception("Shingle sampling test failed: no doc was capped.")
+
     dupe_candidate_score = dupe_candidate_stats["f1"]
     doc_comparison_score = doc_comparison_stats["f1"]
     overall_score = f1_score(dupe_candidate_score, doc_comparison_score)
@@ -151,9 +244,288 @@ def run_test_for_params(params):
         "dupe_candidate_stats": dupe_candidate_stats,
         "doc_comparison_stats": doc_comparison_stats,
         "max_hash_range_utiliz_coef": max_hash_range_utiliz_coef,
+        "lsh_results": lsh_results,
+        "sketch_decision_results": sketch_decision_results,
+        "sampling_results": sampling_results,
     }
 
 
+def run_sketch_decision_test_for_params(
+    params,
+    band: Dict[str, float],
+    sketches: List[List[int]],
+    shingle_hashes: List[FrozenSet[int]],
+    docComparator: DocComparator,
+):
+    accept_thresh = band["accept"]
+    reject_thresh = band["reject"]
+    num_permutations = params["num_permutations"]
+    band_str = f"accept >= {accept_thresh}, reject < {reject_thresh}"
+
+    docComparisonStats = BinaryClassifStats(f"Sketch decision ({band_str})")
+
+    num_candidates = 0
+    num_accepted = 0
+    num_rejected = 0
+
+    for i, comparison in enumerate(docs_data):
+        hash_collisions = len(set(sketches[2 * i]).intersection(sketches[2 * i + 1]))
+        are_dupe_candidates = (
+            hash_collisions / num_permutations > params["hash_collision_thresh"]
+        )
+
+        comparison_result = False
+        if are_dupe_candidates:
+            num_candidates += 1
+            decision = get_sketch_decision(
+                hash_collisions, num_permutations, accept_thresh, reject_thresh
+            )
+            if decision is True:
+                num_accepted += 1
+                comparison_result = True
+            elif decision is False:
+                num_rejected += 1
+            else:
+                comparison_result = docComparator.compare_shingle_hashes(
+                    shingle_hashes[2 * i], shingle_hashes[2 * i + 1]
+                )
+
+        docComparisonStats.add_result(comparison_result, comparison["are_duplicates"])
+
+    print_subtitle_1(f"Sketch decision: {band_str}")
+
+    docComparisonStats.print_stats()
+    doc_comparison_stats = docComparisonStats.get_stats()
+
+    num_avoided = num_accepted + num_rejected
+    avoided_rate = num_avoided / num_candidates if num_candidates != 0 else 0
+
+    print()
+    print(
+        f">> Exact comparisons avoided: {num_avoided}/{num_candidates} ({'{:.1f}'.format(100 * avoided_rate)}%), accepted: {num_accepted}, rejected: {num_rejected}"
+    )
+    print()
+
+    return {
+        "accept_thresh": accept_thresh,
+        "reject_thresh": reject_thresh,
+        "num_candidates": num_candidates,
+        "num_accepted": num_accepted,
+        "num_rejected": num_rejected,
+        "exact_comparisons_avoided": num_avoided,
+        "doc_comparison_stats": doc_comparison_stats,
+    }
+
+
+def run_sampling_test_for_params(
+    params, permutations, max_num_shingles: int, bottom_k_sampling: bool
+):
+    mode_str = "bottom-k sampling" if bottom_k_sampling else "no sampling"
+
+    sketchGenerator = DocSketchGenerator(
+        params["base"],
+        2 ** params["hash_bits"],
+        permutations,
+        params["shingle_length"],
+        max_num_shingles,
+        bottom_k_sampling,
+    )
+    docComparator = DocComparator(
+        params["shingle_length"],
+        max_num_shingles,
+        params["overlap_thresh"],
+        bottom_k_sampling,
+    )
+
+    docComparisonStats = BinaryClassifStats(f"Doc comparison ({mode_str})")
+
+    capped_docs = 0
+    latencies: List[float] = []
+
+    # Per doc latency: shingles + sketch + shingle hashes (comparison input)
+    analysis = []
+    all_docs_shingles = get_docs_shingles(params["shingle_length"])
+    for doc, all_shingles in zip(docs, all_docs_shingles):
+        start_time = time.perf_counter()
+        shingles = sketchGenerator.extract_shingle_list(doc)
+        sketch = sketchGenerator.generate_sketches_from_shingles([shingles])[0]
+        shingle_hashes = get_shingle_hashes(shingles)
+        latencies.append(time.perf_counter() - start_time)
+
+        analysis.append((sketch, shingle_hashes))
+        if len(all_shingles) > max_num_shingles:
+            capped_docs += 1
+            if bottom_k_sampling and len(shingles) != max_num_shingles:
+                raise Exception(
+                    f"Shingle sampling test failed: {len(shingles)} shingles kept (max: {max_num_shingles})."
+                )
+
+    for i, comparison in enumerate(docs_data):
+        sketch1, shingle_hashes1 = analysis[2 * i]
+        sketch2, shingle_hashes2 = analysis[2 * i + 1]
+
+        hash_collisions = len(set(sketch1).intersection(sketch2))
+        are_dupe_candidates = (
+            hash_collisions / len(permutations) > params["hash_collision_thresh"]
+        )
+        comparison_result = (
+            are_dupe_candidates
+            and docComparator.compare_shingle_hashes(shingle_hashes1, shingle_hashes2)
+        )
+
+        docComparisonStats.add_result(comparison_result, comparison["are_duplicates"])
+
+    print_subtitle_1(f"Shingles: {mode_str} (max: {max_num_shingles})")
+
+    docComparisonStats.print_stats()
+    doc_comparison_stats = docComparisonStats.get_stats()
+
+    latencies.sort()
+    latency_avg = statistics.mean(latencies)
+    latency_p95 = latencies[int(0.95 * (len(latencies) - 1))]
+
+    print()
+    print(f">> Docs over the shingles cap: {capped_docs}/{len(docs)}")
+    print(
+        f">> Latency per doc: avg={'{:.2f}'.format(1000 * latency_avg)}ms, p95={'{:.2f}'.format(1000 * latency_p95)}ms, max={'{:.2f}'.format(1000 * latencies[-1])}ms"
+    )
+    print()
+
+    return {
+        "max_num_shingles": max_num_shingles,
+        "bottom_k_sampling": bottom_k_sampling,
+        "capped_docs": capped_docs,
+        "latency_avg_sec": latency_avg,
+        "latency_p95_sec": latency_p95,
+        "latency_max_sec": latencies[-1],
+        "doc_comparison_stats": doc_comparison_stats,
+    }
+
+
+def run_lsh_test_for_params(
+    params, lsh_config, docComparator: DocComparator, threshold_num_candidates: int
+):
+    bands = lsh_config["bands"]
+    rows = lsh_config["rows"]
+    modulo = 2 ** params["hash_bits"]
+
+    # Same permutations as the detector with these bands and rows
+    permutations = generate_permutations(
+        bands * rows, params["hash_bits"], pa.LSH_PERMUTATIONS_SEED
+    )
+
+    sketchGenerator = DocSketchGenerator(
+        params["base"],
+        modulo,
+        permutations,
+        params["shingle_length"],
+        params["max_num_shingles"],
+    )
+
+    dupeCandidateStats = BinaryClassifStats(f"LSH {bands}x{rows} duplicate candidate")
+    docComparisonStats = BinaryClassifStats(f"LSH {bands}x{rows} doc comparison")
+
+    sketches = sketchGenerator.generate_sketches_from_fingerprints(
+        get_docs_fingerprints(
+            params["shingle_length"], params["base"], params["hash_bits"]
+        )
+    )
+    shingle_hashes = get_docs_shingle_hashes(params["shingle_length"])
+
+    for i, comparison in enumerate(docs_data):
+        are_duplicates = comparison["are_duplicates"]
+
+        band_keys1 = get_band_keys(sketches[2 * i], bands, rows)
+        band_keys2 = get_band_keys(sketches[2 * i + 1], bands, rows)
+        are_dupe_candidates = len(set(band_keys1).intersection(band_keys2)) > 0
+
+        similarity = (
+            docComparator.jaccard_sets(shingle_hashes[2 * i], shingle_hashes[2 * i + 1])
+            if are_dupe_candidates
+            else 0
+        )
+        comparison_result = similarity > params["overlap_thresh"]
+
+        dupeCandidateStats.add_result(are_dupe_candidates, are_duplicates)
+        docComparisonStats.add_result(comparison_result, are_duplicates)
+
+    print_subtitle_1(f"LSH {bands} bands x {rows} rows")
+
+    dupeCandidateStats.print_stats()
+    docComparisonStats.print_stats()
+
+    dupe_candidate_stats = dupeCandidateStats.get_stats()
+    doc_comparison_stats = docComparisonStats.get_stats()
+
+    num_candidates = dupe_candidate_stats["tp"] + dupe_candidate_stats["fp"]
+    candidates_reduction = (
+        1 - num_candidates / threshold_num_candidates
+        if threshold_num_candidates != 0
+        else 0
+    )
+
+    print()
+    print(
+        f">> Candidates: {num_candidates} (collision threshold: {threshold_num_candidates}), reduction: {'{:.1f}'.format(100 * candidates_reduction)}%"
+    )
+    print(f">> Candidates recall: {'{:.1f}'.format(100 * dupe_candidate_stats['recall'])}%")
+    print()
+
+    return {
+        "bands": bands,
+        "rows": rows,
+        "num_candidates": num_candidates,
+        "candidates_reduction": candidates_reduction,
+        "dupe_candidate_stats": dupe_candidate_stats,
+        "doc_comparison_stats": doc_comparison_stats,
+    }
+
+
+# Runs a params set capturing its output, so that the
+# output of the parallel runs is not interleaved
+def run_params_set(params_set: int, params) -> Tuple[str, Dict]:
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        print_title_1(f"PARAMS SET #{params_set}")
+        pp.pprint(params)
+
+        # Run the test
+        test_results = run_test_for_params(params, params_set)
+
+    return output.getvalue(), test_results
+
+
+def write_results_table(all_tests: List[Dict]):
+    os.makedirs(output_path, exist_ok=True)
+
+    with open(
+        output_path + "/dupe_detection_test_results.json", "w", encoding="utf-8"
+    ) as output_file:
+        json.dump(all_tests, output_file, indent=4)
+
+    with open(
+        output_path + "/dupe_detection_test_results.csv",
+        "w",
+        encoding="utf-8",
+        newline="",
+    ) as output_file:
+        writer = csv.writer(output_file)
+        stats_names = ["precision", "recall", "f1"]
+        writer.writerow(
+            list(all_tests[0]["params"].keys())
+            + ["overall_score"]
+            + [f"dupe_candidate_{name}" for name in stats_names]
+            + [f"doc_comparison_{name}" for name in stats_names]
+        )
+        for test_results in all_tests:
+            writer.writerow(
+                list(test_results["params"].values())
+                + [test_results["overall_score"]]
+                + [test_results["dupe_candidate_stats"][name] for name in stats_names]
+                + [test_results["doc_comparison_stats"][name] for name in stats_names]
+            )
+
+
 def run_test():
     for i, comparison in enumerate(docs_data):
         print_title_1(f"Analizing comparison #{i}:")
@@ -169,46 +541,68 @@ def run_test():
     best_params_tests = {"score": 0, "tests": []}
     all_tests = []
 
-    params_set = 0
-    for num_permutations in num_permutations_list:
-        for base in base_list:
-            for hash_bits in hash_bits_list:
-                for shingle_length in shingle_length_list:
-                    for max_num_shingles in max_num_shingles_list:
-                        for hash_collision_thresh in hash_collision_thresh_list:
-                            for overlap_thresh in overlap_thresh_list:
-
-                                params_set += 1
-
-                                params = {
-                                    "num_permutations": num_permutations,
-                                    "base": base,
-                                    "hash_bits": hash_bits,
-                                    "shingle_length": shingle_length,
-                                    "max_num_shingles": max_num_shingles,
-                                    "hash_collision_thresh": hash_collision_thresh,
-                                    "overlap_thresh": overlap_thresh,
-                                }
-                                print_title_1(f"PARAMS SET #{params_set}")
-                                pp.pprint(params)
-
-                                # Run the test
-                                test_results = run_test_for_params(params)
-
-                                test_score = test_results["overall_score"]
-
-                                if test_score > best_params_tests["score"]:
-                                    best_params_tests["tests"] = [test_results]
-                                    best_params_tests["score"] = test_score
-                                elif test_score == best_params_tests["score"]:
-                                    best_params_tests["tests"].append(test_results)
-
-                                all_tests.append(test_results)
+    params_list = [
+        {
+            "num_permutations": num_permutations,
+            "base": base,
+            "hash_bits": hash_bits,
+            "shingle_length": shingle_length,
+            "max_num_shingles": max_num_shingles,
+            "hash_collision_thresh": hash_collision_thresh,
+            "overlap_thresh": overlap_thresh,
+        }
+        for (
+            num_permutations,
+            base,
+            hash_bits,
+            shingle_length,
+            max_num_shingles,
+            hash_collision_thresh,
+            overlap_thresh,
+        ) in itertools.product(
+            num_permutations_list,
+            base_list,
+            hash_bits_list,
+            shingle_length_list,
+            max_num_shingles_list,
+            hash_collision_thresh_list,
+            overlap_thresh_list,
+        )
+    ]
+
+    start_time = time.time()
+
+    with ProcessPoolExecutor(SWEEP_PROCESSES) as executor:
+        # The results are printed in params set order
+        for output, test_results in executor.map(
+            run_params_set, range(1, len(params_list) + 1), params_list
+        ):
+            print(output, end="")
+
+            test_score = test_results["overall_score"]
+
+            if test_score > best_params_tests["score"]:
+                best_params_tests["tests"] = [test_results]
+                best_params_tests["score"] = test_score
+            elif test_score == best_params_tests["score"]:
+                best_params_tests["tests"].append(test_results)
+
+            all_tests.append(test_results)
+
+    elapsed_time = time.time() - start_time
 
     print_title_1("FINAL RESULTS")
     pp.pprint(best_params_tests)
     print_subtitle_1("All tests results")
     pp.pprint(all_tests)
 
+    write_results_table(all_tests)
+
+    print_subtitle_1("Sweep")
+    print(
+        f">> {len(params_list)} params sets in {'{:.1f}'.format(elapsed_time)}s ({SWEEP_PROCESSES} processes)"
+    )
+
 
-run_test()
+if __name__ == "__main__":
+    run_test()
@@ -0,0 +1,58 @@
+from typing import List
+
+import difflib
+import os
+
+from ..utils import *
+
+# The scraper keeps a copy of the profiler (the components are built from
+# separate docker contexts). Its copy may only add lines (scraper only additions,
+# e.g. gauges) to this one: any other difference is a fix that was not ported.
+# The module comments (which tell the copies apart) are not compared.
+
+SRC_DIR = os.path.join(os.path.dirname(__file__), "..")
+PROFILER_PATH = os.path.join(SRC_DIR, "profiler.py")
+SCRAPER_PROFILER_PATH = os.path.join(
+    SRC_DIR,
+    "../../scrapyd/horse_scraper/horse_scraper/services/utils/profiler.py",
+)
+
+
+def read_code_lines(path: str) -> List[str]:
+    with open(path, encoding="utf-8") as f:
+        return [line for line in f.read().splitlines() if not line.startswith("#")]
+
+
+def run_test():
+    print_title_1("Profiler copy test")
+
+    lines = read_code_lines(PROFILER_PATH)
+    scraper_lines = read_code_lines(SCRAPER_PROFILER_PATH)
+
+    matcher = difflib.SequenceMatcher(None, lines, scraper_lines, autojunk=False)
+
+    failures = 0
+    added_count = 0
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            continue
+        if tag == "insert":
+            added_count += j2 - j1
+            continue
+        failures += 1
+        print(f">> Diverged (lines {i1 + 1}-{i2}, scraper copy {j1 + 1}-{j2}):")
+        for line in lines[i1:i2]:
+            print(f"   - {line}")
+        for line in scraper_lines[j1:j2]:
+            print(f"   + {line}")
+
+    print_subtitle_1("Test results")
+    print(f">> Scraper only lines: {added_count}")
+    print(f">> Failures: {failures}")
+
+    if failures > 0:
+        raise Exception("Profiler copy test failed.")
+
+
+if __name__ == "__main__":
+    run_test()
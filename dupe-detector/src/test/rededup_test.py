@@ -0,0 +1,211 @@
+from typing import Dict, FrozenSet, List, Tuple, Union
+
+import random
+from datetime import timedelta
+
+from ..utils import *
+from .. import process_articles as pa
+from ..doc_analyzer import DocAnalyzer
+from ..doc_sketch import DocSketchGenerator
+from ..rededup_articles import OriginalsWindow, find_original, WINDOW_DAYS
+from ..sketch_index import SketchIndex, SketchRow
+
+# Rededup vs online decisions, on a simulated corpus (no db): stories published
+# in several versions (near duplicates) over a few days, by a few sources.
+#
+#   date order: the articles are scraped (and processed online) on their date,
+#               so the online decisions must be the rededup ones.
+#   late:       some articles are scraped up to MAX_DELAY_DAYS after their date
+#               and processed after newer ones, so the online loop may match them
+#               to originals dated after them: the rededup decisions must still
+#               be the date order ones, and the differences are reported.
+#
+# The online loop is simulated with the in-memory sketch index (SKETCH_INDEX_MODE
+# on), warmed up from the originals processed in the previous cycles.
+
+SEED = 2021
+NUM_STORIES = 60
+MAX_VERSIONS = 4
+NUM_DAYS = 10
+NUM_SOURCES = 3
+DOC_WORDS = 150
+CHANGED_WORDS = 3
+LATE_RATE = 0.3
+MAX_DELAY_DAYS = 3
+
+# (id, date, title, text, article_source_id, is_duplicate)
+Row = Tuple
+
+
+def generate_corpus(rnd: random.Random) -> List[Tuple[Row, pa.Date]]:
+    vocabulary = [
+        "".join(rnd.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(6))
+        for _ in range(5000)
+    ]
+    first_date = pa.Date(2021, 1, 1)
+
+    # (date, arrival date, source, text)
+    articles = []
+    for _ in range(NUM_STORIES):
+        words = [rnd.choice(vocabulary) for _ in range(DOC_WORDS)]
+        story_date = first_date + timedelta(days=rnd.randrange(NUM_DAYS))
+        source = f"source-{rnd.randrange(NUM_SOURCES)}"
+
+        for _ in range(rnd.randint(1, MAX_VERSIONS)):
+            version = list(words)
+            for _ in range(CHANGED_WORDS):
+                version[rnd.randrange(DOC_WORDS)] = rnd.choice(vocabulary)
+            date = story_date + timedelta(days=rnd.randint(-WINDOW_DAYS, WINDOW_DAYS))
+            arrival_date = date
+            if rnd.random() < LATE_RATE:
+                arrival_date += timedelta(days=rnd.randint(1, MAX_DELAY_DAYS))
+            articles.append((date, arrival_date, source, " ".join(version)))
+
+    # Ids are assigned as the articles are scraped
+    rnd.shuffle(articles)
+    articles.sort(key=lambda a: a[1])
+
+    return [
+        ((id, date, "", text, source, None), arrival_date)
+        for id, (date, arrival_date, source, text) in enumerate(articles, start=1)
+    ]
+
+
+def analyze(rows: List[Row]) -> Dict[int, Tuple[Row, List[int], FrozenSet[int]]]:
+    sketch_generator = DocSketchGenerator(
+        pa.ARTICLE_HASH_BASE,
+        2 ** pa.ARTICLE_HASH_BITS,
+        pa.SKETCH_PERMUTATIONS,
+        pa.SHINGLE_LENGTH,
+        pa.MAX_NUM_SHINGLES,
+        pa.SHINGLE_SAMPLING_ENABLED,
+    )
+    doc_analyzer = DocAnalyzer(sketch_generator, 0)
+
+    analysis = {}
+    for row, sketch, shingle_hashes in doc_analyzer.analyze_chunks(
+        iter([rows]), pa.get_row_doc
+    ):
+        analysis[row[0]] = (row, pa.get_sketch_hashes(sketch), shingle_hashes)
+    doc_analyzer.shutdown()
+
+    return analysis
+
+
+# Same as rededup_articles: a single pass in (date, id) order.
+# Returns the original of each article (None: original).
+def run_rededup(analysis) -> Dict[int, Union[int, None]]:
+    originals_window = OriginalsWindow(pa.get_candidates_count_thresh())
+
+    decisions = {}
+    for row, hashes, shingle_hashes in sorted(
+        analysis.values(), key=lambda a: (a[0][1], a[0][0])
+    ):
+        article_id, date, title, text, article_source_id, was_duplicate = row
+        decisions[article_id] = originals_window.detect(
+            article_id,
+            date,
+            pa.get_article_source_id_hash(article_source_id),
+            hashes,
+            shingle_hashes,
+        )
+
+    return decisions
+
+
+# Online loop: one cycle per arrival date, processing the pending articles in
+# (date, id) order. Returns the original of each article (None: original).
+def run_online(analysis, arrival_dates) -> Dict[int, Union[int, None]]:
+    # Persisted originals
+    sketch_rows: List[SketchRow] = []
+    shingle_hashes_by_id: Dict[int, FrozenSet[int]] = {}
+
+    sketch_index = SketchIndex(
+        lambda dates: [r for r in sketch_rows if r[1] in dates], WINDOW_DAYS
+    )
+    count_thresh = pa.get_candidates_count_thresh()
+
+    decisions = {}
+    for arrival_date in sorted(set(arrival_dates.values())):
+        sketch_index.reset()
+
+        pending = [analysis[id] for id, d in arrival_dates.items() if d == arrival_date]
+        for row, hashes, shingle_hashes in sorted(
+            pending, key=lambda a: (a[0][1], a[0][0])
+        ):
+            article_id, date, title, text, article_source_id, was_duplicate = row
+            article_source_id_hash = pa.get_article_source_id_hash(article_source_id)
+
+            sketch_index.advance(date)
+            original = find_original(
+                sketch_index,
+                shingle_hashes_by_id,
+                hashes,
+                date,
+                article_source_id_hash,
+                shingle_hashes,
+                count_thresh,
+            )
+            decisions[article_id] = original
+
+            if original is None:
+                sketch_rows.extend(
+                    (article_id, date, article_source_id_hash, h) for h in hashes
+                )
+                shingle_hashes_by_id[article_id] = shingle_hashes
+                sketch_index.add(article_id, date, article_source_id_hash, hashes)
+
+    return decisions
+
+
+def get_differences(decisions1, decisions2) -> List[int]:
+    return [id for id in sorted(decisions1) if decisions1[id] != decisions2[id]]
+
+
+def run_test():
+    print_title_1("Rededup test")
+
+    corpus = generate_corpus(random.Random(SEED))
+    analysis = analyze([row for row, arrival_date in corpus])
+    dates = {row[0]: row[1] for row, arrival_date in corpus}
+    arrival_dates = {row[0]: arrival_date for row, arrival_date in corpus}
+
+    rededup_decisions = run_rededup(analysis)
+    duplicates_count = len([o for o in rededup_decisions.values() if o is not None])
+
+    print_subtitle_1("Corpus")
+    late_count = len([id for id in dates if arrival_dates[id] != dates[id]])
+    print(f">> Articles: {len(corpus)} (scraped late: {late_count})")
+    print(f">> Rededup duplicates: {duplicates_count}")
+
+    failures = 0
+
+    print_subtitle_1("Date order")
+    differences = get_differences(rededup_decisions, run_online(analysis, dates))
+    print(f">> Different decisions: {len(differences)}")
+    if duplicates_count == 0 or len(differences) > 0:
+        failures += 1
+
+    print_subtitle_1("Scraped late")
+    online_decisions = run_online(analysis, arrival_dates)
+    differences = get_differences(rededup_decisions, online_decisions)
+    print(f">> Different decisions: {len(differences)}")
+    for id in differences[:10]:
+        online_original = online_decisions[id]
+        print(
+            f">> Article {id} ({dates[id]}, scraped {arrival_dates[id]}): rededup original={rededup_decisions[id]}, online original={online_original}"
+            + (f" ({dates[online_original]})" if online_original is not None else "")
+        )
+    # The corpus must exercise the out of date order processing
+    if len(differences) == 0:
+        failures += 1
+
+    print_subtitle_1("Test results")
+    print(f">> Failures: {failures}")
+
+    if failures > 0:
+        raise Exception("Rededup test failed.")
+
+
+if __name__ == "__main__":
+    run_test()
@@ -0,0 +1,59 @@
+import json
+import os
+
+from ..utils import *
+from ..doc_sketch import DocSketchGenerator
+
+# Current file path
+dir_path = os.path.dirname(os.path.realpath(__file__))
+
+# Load stored sketches (generated with the original, non rolling, fingerprint)
+with open(dir_path + "/stored_sketches.json", encoding="utf-8") as input_file:
+    stored_data = json.load(input_file)
+
+
+def run_test():
+    sketch_params = stored_data["sketch_params"]
+    sketchGenerator = DocSketchGenerator(
+        sketch_params["base"],
+        2 ** sketch_params["hash_bits"],
+        sketch_params["permutations"],
+        sketch_params["shingle_length"],
+        sketch_params["max_num_shingles"],
+    )
+
+    source_id_hash_params = stored_data["article_source_id_hash_params"]
+    sourceIdHashGenerator = DocSketchGenerator(
+        source_id_hash_params["base"], 2 ** source_id_hash_params["hash_bits"], [], 0, 0
+    )
+
+    failures = 0
+
+    print_subtitle_1("Article sketches")
+    for i, entry in enumerate(stored_data["sketches"]):
+        sketch = sketchGenerator.generate_sketch(entry["doc"])
+        batch_sketch = sketchGenerator.generate_sketches([entry["doc"]])[0]
+        result_ok = sketch == entry["sketch"] and batch_sketch == entry["sketch"]
+        if not result_ok:
+            failures += 1
+            print(f">> expected: {entry['sketch']}")
+            print(f">> got: {sketch}")
+        print(f">> Sketch #{i}: << {'SUCCESS' if result_ok else 'FAIL'} >>")
+
+    print_subtitle_1("Article source id hashes")
+    for entry in stored_data["article_source_id_hashes"]:
+        hash = sourceIdHashGenerator.get_fingerprint(entry["article_source_id"])
+        result_ok = hash == entry["hash"]
+        if not result_ok:
+            failures += 1
+            print(f">> expected: {entry['hash']}, got: {hash}")
+        print(f">> {entry['article_source_id']}: << {'SUCCESS' if result_ok else 'FAIL'} >>")
+
+    print_subtitle_1("Test results")
+    print(f">> Failures: {failures}")
+
+    if failures > 0:
+        raise Exception("Sketch regression test failed.")
+
+
+run_test()
@@ -0,0 +1,137 @@
+from typing import Dict, List, Set
+
+import os
+from datetime import timedelta
+
+from ..utils import *
+from .. import process_articles as pa
+from ..profiler import Profiler
+
+# Compares the two sketch storage formats (see SKETCH_STORAGE) on the db set by
+# the DB_* env vars (a local stand-in or a copy, never production): size of the
+# tables and their indexes, and latency of the candidates query. Both tables must
+# hold the same articles, i.e. run sketch_compact_backfill first.
+#
+# The queries are the sketches of BENCHMARK_QUERIES random articles, looked up
+# with the same dates window and collision threshold as process_articles.
+
+BENCHMARK_QUERIES = int(os.environ.get("BENCHMARK_QUERIES") or 500)
+
+ROWS_SKETCH_TABLE = "scraper.article_sketch"
+COMPACT_SKETCH_TABLE = "scraper.article_sketch_compact"
+
+
+def print_table_sizes(cursor, table: str) -> Dict[str, int]:
+    cursor.execute(
+        """
+        SELECT
+                pg_relation_size(%s::regclass),
+                pg_indexes_size(%s::regclass),
+                pg_total_relation_size(%s::regclass)
+        """,
+        (table, table, table),
+    )
+    table_size, indexes_size, total_size = cursor.fetchone()
+    cursor.execute(f"SELECT COUNT(*) FROM {table}")
+    num_rows = cursor.fetchone()[0]
+
+    print(
+        f">> {table.ljust(32)}: rows={num_rows}, table={'{:.1f}'.format(table_size / 2 ** 20)}MB, indexes={'{:.1f}'.format(indexes_size / 2 ** 20)}MB, total={'{:.1f}'.format(total_size / 2 ** 20)}MB"
+    )
+
+    return {
+        "rows": num_rows,
+        "table_bytes": table_size,
+        "indexes_bytes": indexes_size,
+        "total_bytes": total_size,
+    }
+
+
+def run_benchmark():
+    print_title_1("Sketch storage benchmark")
+
+    cnxn = pa.get_db_connection()
+    cursor = cnxn.cursor()
+
+    print_subtitle_1("Sizes")
+    print_table_sizes(cursor, ROWS_SKETCH_TABLE)
+    print_table_sizes(cursor, COMPACT_SKETCH_TABLE)
+
+    cursor.execute(
+        f"""
+        SELECT
+                article_id,
+                date,
+                article_source_id_hash,
+                hashes
+        FROM
+                {COMPACT_SKETCH_TABLE}
+        ORDER BY
+                random()
+        LIMIT
+                {BENCHMARK_QUERIES}
+        """
+    )
+    queries = cursor.fetchall()
+
+    count_thresh = len(pa.PERMUTATIONS) * pa.HASH_COLLISION_THRESH
+    profiler = Profiler("sketch_storage_benchmark")
+    mismatches = 0
+
+    for article_id, date, article_source_id_hash, hashes in queries:
+        date_from = date - timedelta(days=2)
+        dates_str = ", ".join(
+            [f"'{str(date_from + timedelta(days=i))}'" for i in range(5)]
+        )
+        hashes_str = ", ".join(map(str, hashes))
+
+        candidate_ids: Dict[str, Set[int]] = {}
+
+        with profiler.span("rows"):
+            cursor.execute(
+                pa.get_rows_candidates_sql(
+                    ROWS_SKETCH_TABLE,
+                    "hash",
+                    dates_str,
+                    hashes_str,
+                    article_source_id_hash,
+                    count_thresh,
+                )
+            )
+            candidate_ids["rows"] = set(row[0] for row in cursor.fetchall())
+
+        with profiler.span("compact"):
+            cursor.execute(
+                pa.get_compact_candidates_sql(
+                    COMPACT_SKETCH_TABLE,
+                    dates_str,
+                    hashes_str,
+                    article_source_id_hash,
+                    count_thresh,
+                )
+            )
+            candidate_ids["compact"] = set(row[0] for row in cursor.fetchall())
+
+        if candidate_ids["rows"] != candidate_ids["compact"]:
+            mismatches += 1
+            print(
+                f">> Mismatch for article ({article_id}): rows={sorted(candidate_ids['rows'])}, compact={sorted(candidate_ids['compact'])}"
+            )
+
+    cursor.close()
+    cnxn.close()
+
+    print_subtitle_1(f"Candidates query ({len(queries)} queries)")
+    for storage, s in profiler.get_stats()["spans"].items():
+        ms = {
+            k: "{:.3f}".format(1000 * s[k]) for k in ["avg", "p50", "p95", "p99", "max"]
+        }
+        print(
+            f">> {storage.rjust(8)}: avg={ms['avg']}ms, p50={ms['p50']}ms, p95={ms['p95']}ms, p99={ms['p99']}ms, max={ms['max']}ms"
+        )
+    print()
+    print(f">> Results mismatches: {mismatches}")
+
+
+if __name__ == "__main__":
+    run_benchmark()
@@ -0,0 +1,251 @@
+from typing import Dict, List, Set
+
+import time
+
+from ..utils import *
+from .. import process_articles as pa
+from ..article_write_buffer import ArticleWriteBuffer
+from ..source_lease_manager import SourceLeaseManager
+from ..syndication_index import SyndicationIndex
+
+# Work claim test on the db set by the DB_* env vars (a local stand-in, never
+# production). The leases live in a scratch table (LEASE_TABLE), created and
+# dropped by the test, and the article sources are simulated.
+#
+#   rotation: NUM_PARTITIONS partitions (more than NUM_WORKERS x MAX_PARTITIONS),
+#             every one with pending articles: every partition must be processed
+#             and, once none has pending articles, the workers must be idle.
+#   fencing:  a worker whose lease expired and was claimed by another one must
+#             drop the buffered results of the lost partitions on flush.
+#   syndication: the syndication rows and merges buffered along with the lost
+#             partitions must not refer to their dropped articles (no db).
+
+LEASE_TABLE = "scraper.dupe_detector_lease_test"
+SKETCH_TABLE = "scraper.article_sketch_lease_test"
+
+NUM_PARTITIONS = 201
+NUM_WORKERS = 2
+MAX_PARTITIONS = 50
+MAX_CYCLES = 20
+
+
+class SimulatedLeaseManager(SourceLeaseManager):
+    # One source per partition (the id is its hash)
+    def get_article_source_ids(self, cursor) -> List[str]:
+        return [str(h) for h in range(NUM_PARTITIONS)]
+
+
+def create_lease_manager(
+    cnxn, worker_id: str, lease_duration_sec: int, max_partitions: int
+):
+    return SimulatedLeaseManager(
+        cnxn, worker_id, lease_duration_sec, max_partitions, int, LEASE_TABLE
+    )
+
+
+def create_tables(cnxn):
+    cursor = cnxn.cursor()
+    cursor.execute(f"DROP TABLE IF EXISTS {LEASE_TABLE}")
+    cursor.execute(f"""
+        CREATE TABLE {LEASE_TABLE} (
+            article_source_id_hash SMALLINT PRIMARY KEY,
+            worker_id VARCHAR(128),
+            expires_at TIMESTAMPTZ,
+            claimed_at TIMESTAMPTZ,
+            processed_count BIGINT NOT NULL,
+            last_article_date DATE,
+            updated_at TIMESTAMPTZ
+        )
+        """)
+    cursor.execute(f"DROP TABLE IF EXISTS {SKETCH_TABLE}")
+    cursor.execute(f"""
+        CREATE TABLE {SKETCH_TABLE} (
+            article_id BIGINT NOT NULL,
+            hash INTEGER NOT NULL,
+            date DATE NOT NULL,
+            article_source_id_hash SMALLINT NOT NULL
+        )
+        """)
+    cnxn.commit()
+    cursor.close()
+
+
+def drop_tables(cnxn):
+    cursor = cnxn.cursor()
+    cursor.execute(f"DROP TABLE IF EXISTS {LEASE_TABLE}")
+    cursor.execute(f"DROP TABLE IF EXISTS {SKETCH_TABLE}")
+    cnxn.commit()
+    cursor.close()
+
+
+# Returns the number of failures
+def run_rotation_test(cnxns) -> int:
+    print_subtitle_1(
+        f"Rotation: {NUM_PARTITIONS} partitions, {NUM_WORKERS} workers x {MAX_PARTITIONS} partitions"
+    )
+
+    workers = [
+        create_lease_manager(cnxn, f"worker-{i}", 300, MAX_PARTITIONS)
+        for i, cnxn in enumerate(cnxns)
+    ]
+    pending: Set[int] = set(range(NUM_PARTITIONS))
+    processed_by: Dict[int, Set[str]] = {}
+
+    for cycle in range(MAX_CYCLES):
+        # All the workers claim, then process and release (as concurrent cycles)
+        claims = [(worker, worker.claim()) for worker in workers]
+        for worker, source_ids in claims:
+            claimed = set(int(id) for id in source_ids)
+            for h in claimed & pending:
+                worker.register_processed(h, pa.Date.today())
+                processed_by.setdefault(h, set()).add(worker.worker_id)
+            has_pending = len(claimed & pending) > 0
+            pending -= claimed
+            worker.renew()
+            worker.release(has_pending)
+
+        if all(worker.idle for worker in workers):
+            break
+
+    failures = 0
+    print(f">> Cycles: {cycle + 1}")
+    print(f">> Processed partitions: {len(processed_by)} of {NUM_PARTITIONS}")
+    if len(pending) > 0:
+        print(f">> Never processed: {sorted(pending)[:20]}")
+        failures += 1
+    if not all(worker.idle for worker in workers):
+        print(f">> Workers not idle after {MAX_CYCLES} cycles")
+        failures += 1
+    return failures
+
+
+# Returns the number of failures
+def run_fencing_test(cnxns) -> int:
+    print_subtitle_1("Fencing: flush after the lease was lost")
+
+    worker1 = create_lease_manager(cnxns[0], "worker-1", 1, MAX_PARTITIONS)
+    # Claims every free or expired partition
+    worker2 = create_lease_manager(cnxns[1], "worker-2", 300, NUM_PARTITIONS)
+
+    # Free every partition
+    cursor = cnxns[0].cursor()
+    cursor.execute(f"UPDATE {LEASE_TABLE} SET worker_id = NULL, expires_at = NULL")
+    cnxns[0].commit()
+    cursor.close()
+
+    claimed = set(int(id) for id in worker1.claim())
+    write_buffer = ArticleWriteBuffer(
+        cnxns[0],
+        1000,
+        float("inf"),
+        SKETCH_TABLE,
+        "hash",
+        fence=worker1.renew,
+    )
+    for h in sorted(claimed):
+        write_buffer.sketch_rows.append((h, 1, pa.Date.today(), h))
+
+    # The lease of worker1 expires and worker2 takes its partitions over
+    time.sleep(1.5)
+    taken_over = set(int(id) for id in worker2.claim()) & claimed
+
+    write_buffer.flush()
+
+    cursor = cnxns[0].cursor()
+    cursor.execute(f"SELECT DISTINCT article_source_id_hash FROM {SKETCH_TABLE}")
+    persisted = set(row[0] for row in cursor.fetchall())
+    cnxns[0].commit()
+    cursor.close()
+
+    failures = 0
+    print(f">> Taken over partitions: {len(taken_over)} of {len(claimed)}")
+    print(f">> Lost partitions: {len(worker1.lost_hashes)}")
+    print(f">> Persisted partitions: {len(persisted)}")
+    if len(taken_over) == 0:
+        print(">> No partition was taken over")
+        failures += 1
+    if worker1.lost_hashes != taken_over:
+        print(">> Lost partitions do not match the taken over ones")
+        failures += 1
+    if len(persisted & taken_over) > 0:
+        print(">> Results of lost partitions were persisted")
+        failures += 1
+    if persisted != claimed - taken_over:
+        print(">> Results of owned partitions were not persisted")
+        failures += 1
+    return failures
+
+
+# Returns the number of failures
+def run_syndication_drop_test() -> int:
+    print_subtitle_1("Fencing: syndication clusters of the lost partitions")
+
+    lost_hash = 1
+    syndication_index = SyndicationIndex(4, 2, 0.9)
+    write_buffer = ArticleWriteBuffer(None, 1000, float("inf"))
+    sketch = list(range(8))
+    date = pa.Date.today()
+
+    # (article id, article_source_id_hash), in processing order: 2 and 3 form a
+    # cluster, merged into the one of 1 (lost), that 4 then joins
+    for article_id, article_source_id_hash in [(2, 2), (3, 3), (1, lost_hash), (4, 3)]:
+        write_buffer.add_syndication(
+            *syndication_index.add(article_id, date, article_source_id_hash, sketch)
+        )
+        write_buffer.add_article(
+            article_id, date, article_source_id_hash, sketch, False, article_id
+        )
+
+    # Lost mid-buffer
+    write_buffer.drop_partitions({lost_hash})
+    syndication_index.reset()
+
+    failures = 0
+    print(f">> Syndication rows: {write_buffer.syndication_rows}")
+    print(f">> Cluster merges: {write_buffer.cluster_merges}")
+    if write_buffer.syndication_rows != {2: 2, 3: 2}:
+        print(">> Syndication rows refer to the dropped article")
+        failures += 1
+    if len(write_buffer.cluster_merges) > 0:
+        print(">> Cluster merges refer to the dropped article")
+        failures += 1
+    if (
+        len(syndication_index.sketches) > 0
+        or len(syndication_index.clusters.parent) > 0
+    ):
+        print(">> Syndication index still holds the dropped article")
+        failures += 1
+    # The index is rebuilt from the next articles
+    rows, merges = syndication_index.add(5, date, 2, sketch)
+    if (rows, merges) != ({}, []):
+        print(f">> Article linked to a forgotten one: {rows}, {merges}")
+        failures += 1
+    return failures
+
+
+def run_test():
+    print_title_1("Source lease test")
+
+    cnxns = [pa.get_db_connection() for _ in range(NUM_WORKERS)]
+    create_tables(cnxns[0])
+
+    try:
+        failures = run_rotation_test(cnxns)
+        failures += run_fencing_test(cnxns)
+        failures += run_syndication_drop_test()
+    finally:
+        for cnxn in cnxns:
+            cnxn.rollback()
+        drop_tables(cnxns[0])
+        for cnxn in cnxns:
+            cnxn.close()
+
+    print_subtitle_1("Test results")
+    print(f">> Failures: {failures}")
+
+    if failures > 0:
+        raise Exception("Source lease test failed.")
+
+
+if __name__ == "__main__":
+    run_test()
@@ -0,0 +1,88 @@
+import json
+import os
+import random
+import time
+
+import gensim  # type: ignore
+
+from ..utils import *
+from ..tokenizer import simple_preprocess
+
+# Current file path
+dir_path = os.path.dirname(os.path.realpath(__file__))
+
+RANDOM_DOCS_COUNT = 5000
+RANDOM_DOCS_SEED = 2021
+# Letters (with and without accents), digits, underscores, punctuation,
+# whitespace, combining marks and non latin scripts
+RANDOM_DOCS_ALPHABET = (
+    "abcxyzABCXYZñÑáéíóúÁÉÍÓÚüÜçàèß0123456789٣_-.,;:¡!¿?'\"()/ \n\t"
+    + "\u0301\u0308"
+    + "αβγΔΩжЖя中文日本語"
+    + "ﬁ²½Ⅻ"
+)
+
+# Load the docs corpus
+with open(dir_path + "/comparison_docs.json", encoding="utf-8") as input_file:
+    comparison_docs = json.load(input_file)
+
+with open(dir_path + "/stored_sketches.json", encoding="utf-8") as input_file:
+    stored_data = json.load(input_file)
+
+
+def get_random_docs():
+    rnd = random.Random(RANDOM_DOCS_SEED)
+    docs = []
+    for i in range(RANDOM_DOCS_COUNT):
+        length = rnd.randint(0, 200)
+        docs.append("".join(rnd.choice(RANDOM_DOCS_ALPHABET) for j in range(length)))
+        # Long words (max_len)
+        docs.append(" ".join("a" * rnd.randint(1, 20) for j in range(10)))
+    return docs
+
+
+def run_test():
+    corpus_docs = [entry["doc"] for entry in stored_data["sketches"]]
+    for comparison in comparison_docs:
+        corpus_docs.append(comparison["doc1"])
+        corpus_docs.append(comparison["doc2"])
+
+    failures = 0
+
+    for name, docs in [("Corpus", corpus_docs), ("Random docs", get_random_docs())]:
+        print_subtitle_1(f"Output compatibility: {name} ({len(docs)} docs)")
+        for deacc in [False, True]:
+            doc_failures = 0
+            for doc in docs:
+                expected = gensim.utils.simple_preprocess(doc, deacc=deacc)
+                result = simple_preprocess(doc, deacc=deacc)
+                if result != expected:
+                    doc_failures += 1
+                    if doc_failures <= 5:
+                        print(f">> doc: {repr(doc[:100])}")
+                        print(f">> expected: {expected[:20]}")
+                        print(f">> got: {result[:20]}")
+            failures += doc_failures
+            print(
+                f">> deacc={deacc}: << {'SUCCESS' if doc_failures == 0 else 'FAIL'} >> ({doc_failures} failures)"
+            )
+
+    print_subtitle_1("Performance (corpus)")
+    for name, fn in [
+        ("gensim", gensim.utils.simple_preprocess),
+        ("tokenizer", simple_preprocess),
+    ]:
+        start_time = time.perf_counter()
+        for doc in corpus_docs:
+            fn(doc)
+        elapsed = time.perf_counter() - start_time
+        print(f">> {name.rjust(10)}: {1e6 * elapsed / len(corpus_docs):.1f} us/doc")
+
+    print_subtitle_1("Test results")
+    print(f">> Failures: {failures}")
+
+    if failures > 0:
+        raise Exception("Tokenizer test failed.")
+
+
+run_test()
@@ -0,0 +1,37 @@
+from typing import List
+
+import re
+import unicodedata
+
+# Same tokens as gensim.utils.PAT_ALPHABETIC (r"(((?![\d])\w)+)"): runs of word
+# characters that are not digits. The character class avoids the per character
+# lookahead, and findall avoids building a match object per token.
+PAT_ALPHABETIC = re.compile(r"[^\W\d]+", re.UNICODE)
+
+
+def deaccent(text: str) -> str:
+    """
+    Removes the accent marks, same as gensim.utils.deaccent.
+    """
+    norm = unicodedata.normalize("NFD", text)
+    result = "".join(ch for ch in norm if unicodedata.category(ch) != "Mn")
+    return unicodedata.normalize("NFC", result)
+
+
+def simple_preprocess(
+    doc: str, deacc: bool = False, min_len: int = 2, max_len: int = 15
+) -> List[str]:
+    """
+    Drop-in replacement of gensim.utils.simple_preprocess (same output), so that
+    the detector does not need to import gensim: lowercase tokens of min_len to
+    max_len characters, tokens starting with '_' are ignored.
+    """
+    text = doc.lower()
+    if deacc:
+        text = deaccent(text)
+
+    return [
+        token
+        for token in PAT_ALPHABETIC.findall(text)
+        if min_len <= len(token) <= max_len and not token.startswith("_")
+    ]
@@ -0,0 +1,2 @@
+pip install -r requirements-test.txt
+python -u -m src.test.tokenizer_test
\ No newline at end of file
@@ -1,7 +1,17 @@
-from typing import Tuple, List, Iterator, Union, Callable, Any, cast
-
-import os
-from datetime import datetime
+from typing import (
+    Tuple,
+    List,
+    Dict,
+    Iterator,
+    Union,
+    Callable,
+    Set,
+    Any,
+    ContextManager,
+    cast,
+)
+
+from datetime import datetime, date
 from urllib.parse import urlparse, ParseResult
 
 import psycopg2  # type: ignore
@@ -9,22 +19,17 @@ import psycopg2.extras  # type: ignore
 
 import logging
 
+from horse_scraper.database.db_connection_pool import get_db_pool
 from horse_scraper.items import Article
 from horse_scraper.settings import SCRAPYD_NODE_ID
 from horse_scraper.spiders.article.model import ArticleSourceInfo
 
 
 class ArticleDbHandler(object):
-    def get_db_connection(self) -> Any:
-        server = os.environ.get("DB_SERVER")
-        port = os.environ.get("DB_PORT")
-        db_name = os.environ.get("DB_NAME")
-        user = os.environ.get("DB_USER")
-        password = os.environ.get("DB_PASSWORD")
-
-        return psycopg2.connect(
-            user=user, password=password, host=server, port=port, database=db_name,
-        )
+    # Checks out a connection of the process pool (committed on success, rolled
+    # back on error and returned to the pool on exit)
+    def db_connection(self) -> ContextManager[Any]:
+        return get_db_pool().connection()
 
     def persist(self, item: Article, keep_query_string: bool) -> Union[Article, None]:
 
@@ -35,9 +40,6 @@ class ArticleDbHandler(object):
             logging.info("")
             return item
 
-        cnxn = self.get_db_connection()
-        cursor = cnxn.cursor()
-
         article_source_id = f"'{item['source_id']}'"
 
         url = f"'{self.sanitize_url(item['url'], keep_query_string)}'"
@@ -92,17 +94,15 @@ class ArticleDbHandler(object):
         result = f"'{self.sanitize_value(item['result'])}'"
 
         # Delete if exists (this occurs if prior result was error)
-        sql = f"""
+        delete_sql = f"""
                 DELETE FROM
 		                scraper.article AS article
                 WHERE
                         article.id IN (	SELECT id FROM scraper.article	WHERE url = {url} )
                 """
 
-        cursor.execute(sql)
-
         # Insert new data
-        sql = f"""
+        insert_sql = f"""
                 INSERT INTO 
                         scraper.article(
                             url, 
@@ -139,26 +139,132 @@ class ArticleDbHandler(object):
                         RETURNING id
                 """
 
-        cursor.execute(sql)
+        with self.db_connection() as cnxn:
+            cursor = cnxn.cursor()
+            cursor.execute(delete_sql)
+            cursor.execute(insert_sql)
+            article_id = cursor.fetchone()[0]
 
-        article_id = cursor.fetchone()[0]
+        self.add_to_last_scraped_articles(item, article_id, scraped_at)
 
-        cnxn.commit()
+        return None
 
-        # Close de connection
-        cnxn.close()
+    # Same as persist, for a batch of items, in a single transaction: one
+    # existence check, one delete, one multi-row insert and one article_summary
+    # update. Returns the ids of the inserted articles.
+    def persist_many(self, items: List[Article], keep_query_string: bool) -> List[int]:
 
-        self.add_to_last_scraped_articles(item, article_id, scraped_at)
+        # Same outcome as persisting the items in order: a url scraped twice is
+        # skipped if the first result was a success, replaced otherwise
+        items_by_key: Dict[Tuple[str, str], Article] = {}
+        for item in items:
+            url = self.sanitize_url(item["url"], keep_query_string)
+            key = (item["source_id"], url)
+            prior_item = items_by_key.get(key)
+            if prior_item is not None and prior_item["result"] == "success":
+                continue
+            items_by_key[key] = item
 
-        return None
+        if len(items_by_key) == 0:
+            return []
+
+        scraped_at = datetime.utcnow().strftime("%Y/%m/%d %H:%M:%S")
+
+        with self.db_connection() as cnxn:
+            cursor = cnxn.cursor()
+
+            # Skip the urls already persisted successfully
+            cursor.execute(
+                """
+                SELECT
+                        article.article_source_id::text,
+                        article.url
+                FROM
+                        scraper.article AS article
+                        INNER JOIN UNNEST(%s::uuid[], %s::text[]) AS t(article_source_id, url)
+                            ON article.article_source_id = t.article_source_id
+                            AND article.url = t.url
+                WHERE
+                        article.result = 'success'
+                """,
+                (
+                    [key[0] for key in items_by_key],
+                    [key[1] for key in items_by_key],
+                ),
+            )
+            for key in cursor.fetchall():
+                logging.info(f"Article already persisted --> skipping: {key[1]}")
+                items_by_key.pop(key, None)
+
+            if len(items_by_key) == 0:
+                return []
+
+            # Delete if exists (this occurs if prior result was error)
+            cursor.execute(
+                """
+                DELETE FROM
+                        scraper.article AS article
+                WHERE
+                        article.url = ANY(%s)
+                """,
+                ([key[1] for key in items_by_key],),
+            )
+
+            # Insert new data
+            rows = psycopg2.extras.execute_values(
+                cursor,
+                """
+                INSERT INTO
+                        scraper.article(
+                            url,
+                            title,
+                            text,
+                            last_updated,
+                            date,
+                            article_source_id,
+                            scraped_at,
+                            parse_function,
+                            result,
+                            article_spider_id
+                        )
+                        VALUES %s
+                        RETURNING id, article_source_id::text, url
+                """,
+                [
+                    (
+                        url,
+                        self.sanitize_nullable_value(item["title"]),
+                        self.sanitize_nullable_value(item["text"]),
+                        self.format_date(item["last_updated"], "%Y/%m/%d %H:%M:%S"),
+                        self.format_date(item["last_updated"], "%Y/%m/%d"),
+                        source_id,
+                        scraped_at,
+                        self.sanitize_nullable_value(item["parse_function"]),
+                        self.sanitize_value(item["result"]),
+                        self.sanitize_nullable_value(item["spider_name"]),
+                    )
+                    for (source_id, url), item in items_by_key.items()
+                ],
+                template="""(
+                    %s, %s, %s, %s, %s, %s, %s, %s, %s,
+                    (SELECT id FROM scraper.article_spider WHERE name = %s LIMIT 1)
+                )""",
+                fetch=True,
+            )
+
+            article_ids = {(row[1], row[2]): row[0] for row in rows}
+            persisted_items = [
+                (article_ids[key], item) for key, item in items_by_key.items()
+            ]
+
+            self.add_many_to_last_scraped_articles(cursor, persisted_items, scraped_at)
+
+        return [article_id for article_id, item in persisted_items]
 
     def is_article_already_persisted(
         self, url: str, article_source_id: str, keep_query_string: bool
     ) -> bool:
 
-        cnxn = self.get_db_connection()
-        cursor = cnxn.cursor()
-
         url = self.sanitize_url(url, keep_query_string)
 
         sql = f"""
@@ -172,82 +278,73 @@ class ArticleDbHandler(object):
                         AND result = 'success'
 
                 """
-        cursor.execute(sql)
-        rows = cursor.fetchall()
-
-        # Close de connection
-        cnxn.close()
+        with self.db_connection() as cnxn:
+            cursor = cnxn.cursor()
+            cursor.execute(sql)
+            rows = cursor.fetchall()
 
         return len(rows) > 0
 
+    # Returns the urls already persisted successfully, in a single query (backed
+    # by the index of database/scripts/scraper-article-source-url-index.sql)
     def get_already_persisted_articles(
         self, urls: List[str], article_source_id: str, keep_query_string: bool,
-    ) -> List[str]:
+    ) -> Set[str]:
+
+        if len(urls) == 0:
+            return set()
 
-        cnxn = self.get_db_connection()
-        cursor = cnxn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        sanitized_urls = [self.sanitize_url(url, keep_query_string) for url in urls]
 
-        # Create temp table
         sql = f"""
-                CREATE TEMP TABLE temp_articles_to_check(
-                    id INT,
-                    url TEXT                    
-                )
+                SELECT DISTINCT
+                        article.url
+                FROM
+                        scraper.article AS article
+                WHERE
+                        article.article_source_id = %s
+                        AND article.url = ANY(%s::text[])
+                        AND article.result = 'success'
                 """
-        cursor.execute(sql)
 
-        # Map urls to values str
-        values: List[str] = []
+        with self.db_connection() as cnxn:
+            cursor = cnxn.cursor()
+            cursor.execute(sql, (article_source_id, list(set(sanitized_urls))))
+            persisted_urls = set(row[0] for row in cursor.fetchall())
 
-        for id in range(len(urls)):
-            url = self.sanitize_url(urls[id], keep_query_string)
-            values.append(f"('{id}', '{url}')")
+        return set(
+            url
+            for url, sanitized_url in zip(urls, sanitized_urls)
+            if sanitized_url in persisted_urls
+        )
 
-        # Populate temp table
-        for values_str in values:
-            sql = f"""
-                    INSERT INTO temp_articles_to_check(
-                        id,
-                        url
-                    )
-                    VALUES {values_str}
-                    """
-            cursor.execute(sql)
+    # Urls (as persisted) of the successful articles of the source, dated or
+    # scraped from from_date on
+    def get_persisted_urls(self, article_source_id: str, from_date: date) -> List[str]:
 
-        # Join with persisted articles table and get existing urls
         sql = f"""
-                SELECT 
-                        t.id as id
-                FROM 
-                        temp_articles_to_check AS t
-                        INNER JOIN scraper.article AS article
-                            ON t.url = article.url                            
+                SELECT
+                        article.url
+                FROM
+                        scraper.article AS article
                 WHERE
                         article.article_source_id = '{article_source_id}'
                         AND article.result = 'success'
+                        AND (
+                            article.date >= '{from_date}'
+                            OR article.scraped_at >= '{from_date}'
+                        )
                 """
-        cursor.execute(sql)
-        cnxn.commit()
 
-        rows = cursor.fetchall()
-
-        # Close de connection
-        cnxn.close()
-
-        fetched_ids = list(map(lambda i: i["id"], rows))
-
-        result: List[str] = []
-
-        for id in fetched_ids:
-            result.append(urls[id])
+        with self.db_connection() as cnxn:
+            cursor = cnxn.cursor()
+            cursor.execute(sql)
+            rows = cursor.fetchall()
 
-        return result
+        return [row[0] for row in rows]
 
     def get_spider_article_source_info(self, spider_name: str) -> ArticleSourceInfo:
 
-        cnxn = self.get_db_connection()
-        cursor = cnxn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-
         sql = f"""
                 SELECT
                         source.id, 
@@ -269,11 +366,10 @@ class ArticleDbHandler(object):
                         spider.name = '{spider_name}'
                 """
 
-        cursor.execute(sql)
-        data = cursor.fetchone()
-
-        # Close de connection
-        cnxn.close()
+        with self.db_connection() as cnxn:
+            cursor = cnxn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+            cursor.execute(sql)
+            data = cursor.fetchone()
 
         info = ArticleSourceInfo()
 
@@ -295,9 +391,6 @@ class ArticleDbHandler(object):
         self, article: Article, article_id: int, scraped_at_str: str
     ) -> None:
 
-        cnxn = self.get_db_connection()
-        cursor = cnxn.cursor()
-
         if article["last_updated"] is not None:
             last_updated_str = (
                 "'"
@@ -309,7 +402,7 @@ class ArticleDbHandler(object):
         else:
             last_updated_str = "NULL"
 
-        sql = f"""
+        insert_sql = f"""
                 INSERT INTO 
                         scraper.article_summary(
                             id,
@@ -347,9 +440,7 @@ class ArticleDbHandler(object):
                         );
                 """
 
-        cursor.execute(sql)
-
-        sql = f"""
+        delete_sql = f"""
                 DELETE FROM scraper.article_summary WHERE id NOT IN (
                     SELECT
                             id 
@@ -361,12 +452,81 @@ class ArticleDbHandler(object):
                 )
                 """
 
-        cursor.execute(sql)
+        with self.db_connection() as cnxn:
+            cursor = cnxn.cursor()
+            cursor.execute(insert_sql)
+            cursor.execute(delete_sql)
+
+    # Batch version of add_to_last_scraped_articles, on the cursor of the batch
+    def add_many_to_last_scraped_articles(
+        self, cursor: Any, persisted_items: List[Tuple[int, Article]], scraped_at: str
+    ) -> None:
+
+        # Only the last 10 are kept anyway
+        psycopg2.extras.execute_values(
+            cursor,
+            """
+            INSERT INTO
+                    scraper.article_summary(
+                        id,
+                        url,
+                        title,
+                        text,
+                        last_updated,
+                        scraped_at,
+                        parse_function,
+                        result,
+                        spider_name,
+                        scrapyd_node_id,
+                        source_name
+                    )
+                    VALUES %s
+            """,
+            [
+                (
+                    article_id,
+                    self.sanitize_value(article["url"]),
+                    self.sanitize_value(article["title"])[:27] + "...",
+                    self.sanitize_value(article["text"])[:27] + "...",
+                    self.format_date(article["last_updated"], "%Y/%m/%d %H:%M:%S"),
+                    scraped_at,
+                    self.sanitize_value(article["parse_function"]),
+                    self.sanitize_value(article["result"]),
+                    self.sanitize_value(article["spider_name"]),
+                    SCRAPYD_NODE_ID,
+                    article["source_id"],
+                )
+                for article_id, article in persisted_items[-10:]
+            ],
+            template="""(
+                %s, %s, %s, %s, %s, %s, %s, %s, %s, %s,
+                (SELECT name FROM scraper.article_source WHERE id = %s LIMIT 1)
+            )""",
+        )
+
+        cursor.execute("""
+            DELETE FROM scraper.article_summary WHERE id NOT IN (
+                SELECT
+                        id
+                FROM
+                        scraper.article_summary
+                ORDER BY
+                        scraped_at DESC
+                LIMIT 10
+            )
+            """)
 
-        cnxn.commit()
+    def sanitize_nullable_value(self, value: Union[str, None]) -> Union[str, None]:
+        if value is None:
+            return None
+        return self.sanitize_value(value)
 
-        # Close de connection
-        cnxn.close()
+    def format_date(
+        self, value: Union[datetime, None], format: str
+    ) -> Union[str, None]:
+        if value is None:
+            return None
+        return self.sanitize_value(value.strftime(format))
 
     def sanitize_value(self, value: Union[str, None]) -> str:
         if value is None:
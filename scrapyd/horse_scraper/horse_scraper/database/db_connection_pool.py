@@ -0,0 +1,194 @@
+from typing import Any, Dict, Iterator, Union
+
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+import psycopg2  # type: ignore
+import psycopg2.pool  # type: ignore
+
+from horse_scraper.services.utils.profiler import Histogram
+from horse_scraper.settings import (
+    DB_POOL_MIN_SIZE,
+    DB_POOL_MAX_SIZE,
+    DB_POOL_HEALTH_CHECK_SEC,
+)
+
+
+class DbConnectionPool(object):
+    """
+    Database connections shared by the pipeline and the spiders of the process,
+    so that each job keeps at most max_size connections open instead of opening
+    one per query.
+
+    connection() checks out a connection (blocking while max_size are in use),
+    commits on success or rolls back on error, and returns it to the pool.
+    Connections idle for more than health_check_sec are pinged before being
+    handed out, and the broken ones (e.g. after a database restart) are
+    discarded and replaced by new ones.
+
+    Attributes:
+        min_size (int): connections opened upfront and kept open.
+        max_size (int): max open connections.
+        health_check_sec (float): idle time after which connections are pinged.
+    """
+
+    last_used: Dict[Any, float]
+
+    def __init__(self, min_size: int, max_size: int, health_check_sec: float):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.health_check_sec = health_check_sec
+
+        self.pool = psycopg2.pool.ThreadedConnectionPool(
+            min_size, max_size, **get_connection_params()
+        )
+        # ThreadedConnectionPool raises when exhausted: wait for a free slot instead
+        self.slots = threading.BoundedSemaphore(max_size)
+        self.lock = threading.Lock()
+
+        # idle connection --> time it was returned to the pool
+        self.last_used = {}
+        # Connections checked out / kept open in the pool (min_size opened upfront)
+        self.in_use_count = 0
+        self.idle_count = min_size
+        self.wait_histogram = Histogram()
+        self.checkouts = 0
+        self.reconnects = 0
+
+    @contextmanager
+    def connection(self) -> Iterator[Any]:
+        wait_start_time = time.perf_counter()
+        self.slots.acquire()
+        try:
+            cnxn = self.checkout()
+            with self.lock:
+                self.wait_histogram.add(time.perf_counter() - wait_start_time)
+
+            try:
+                yield cnxn
+                cnxn.commit()
+            except BaseException:
+                if not cnxn.closed:
+                    cnxn.rollback()
+                raise
+            finally:
+                self.checkin(cnxn)
+        finally:
+            self.slots.release()
+
+    def checkout(self) -> Any:
+        cnxn = self.getconn()
+        with self.lock:
+            self.checkouts += 1
+            last_used = self.last_used.pop(cnxn, None)
+
+        if last_used is None or time.time() - last_used < self.health_check_sec:
+            if not cnxn.closed:
+                return cnxn
+        elif self.is_healthy(cnxn):
+            return cnxn
+
+        # Broken connection --> replace it
+        logging.warning(">> Database connection lost --> reconnecting")
+        self.discard(cnxn)
+        with self.lock:
+            self.reconnects += 1
+        return self.getconn()
+
+    # Takes an idle connection, or opens a new one if there is none
+    def getconn(self) -> Any:
+        cnxn = self.pool.getconn()
+        with self.lock:
+            self.in_use_count += 1
+            self.idle_count = max(self.idle_count - 1, 0)
+        return cnxn
+
+    # Keeps up to min_size idle connections open, closes the others
+    def checkin(self, cnxn: Any):
+        if cnxn.closed:
+            self.discard(cnxn)
+            return
+        with self.lock:
+            self.in_use_count -= 1
+            keep_open = self.idle_count < self.min_size
+            if keep_open:
+                self.idle_count += 1
+                self.last_used[cnxn] = time.time()
+        self.pool.putconn(cnxn, close=not keep_open)
+
+    def discard(self, cnxn: Any):
+        with self.lock:
+            self.in_use_count -= 1
+        self.pool.putconn(cnxn, close=True)
+
+    def is_healthy(self, cnxn: Any) -> bool:
+        return is_connection_healthy(cnxn)
+
+    def close(self):
+        self.pool.closeall()
+        with self.lock:
+            self.last_used = {}
+            self.in_use_count = 0
+            self.idle_count = 0
+
+    def get_stats(self) -> Dict[str, float]:
+        with self.lock:
+            wait_stats = self.wait_histogram.get_stats()
+            return {
+                "open_connections": self.in_use_count + self.idle_count,
+                "in_use_connections": self.in_use_count,
+                "checkouts": self.checkouts,
+                "reconnects": self.reconnects,
+                "wait_seconds_avg": wait_stats["avg"],
+                "wait_seconds_p95": wait_stats["p95"],
+                "wait_seconds_max": wait_stats["max"],
+            }
+
+
+def get_connection_params() -> Dict[str, Any]:
+    return {
+        "user": os.environ.get("DB_USER"),
+        "password": os.environ.get("DB_PASSWORD"),
+        "host": os.environ.get("DB_SERVER"),
+        "port": os.environ.get("DB_PORT"),
+        "database": os.environ.get("DB_NAME"),
+    }
+
+
+def is_connection_healthy(cnxn: Any) -> bool:
+    if cnxn.closed:
+        return False
+    try:
+        cursor = cnxn.cursor()
+        cursor.execute("SELECT 1")
+        cursor.close()
+        cnxn.rollback()
+        return True
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        return False
+
+
+_db_pool: Union[DbConnectionPool, None] = None
+_db_pool_lock = threading.Lock()
+
+
+# Returns the pool of the process, created on first use
+def get_db_pool() -> DbConnectionPool:
+    global _db_pool
+    with _db_pool_lock:
+        if _db_pool is None:
+            _db_pool = DbConnectionPool(
+                DB_POOL_MIN_SIZE, DB_POOL_MAX_SIZE, DB_POOL_HEALTH_CHECK_SEC
+            )
+        return _db_pool
+
+
+def close_db_pool():
+    global _db_pool
+    with _db_pool_lock:
+        if _db_pool is not None:
+            _db_pool.close()
+            _db_pool = None
@@ -0,0 +1,30 @@
+from typing import Any, Callable, Union
+
+from twisted.internet import reactor, threads  # type: ignore
+from twisted.internet.defer import Deferred  # type: ignore
+from twisted.python.threadpool import ThreadPool  # type: ignore
+
+from horse_scraper.settings import DB_THREAD_POOL_SIZE
+
+# Blocking psycopg2 calls run on a bounded thread pool, so that the reactor keeps
+# scheduling downloads and parsing responses while a query waits on Postgres.
+# The pool is only accessed from the reactor thread.
+
+_db_thread_pool: Union[ThreadPool, None] = None
+
+
+def get_db_thread_pool() -> ThreadPool:
+    global _db_thread_pool
+    if _db_thread_pool is None:
+        _db_thread_pool = ThreadPool(
+            minthreads=1, maxthreads=DB_THREAD_POOL_SIZE, name="db"
+        )
+        _db_thread_pool.start()
+        reactor.addSystemEventTrigger("during", "shutdown", _db_thread_pool.stop)
+    return _db_thread_pool
+
+
+# Runs fn on the db thread pool: the Deferred fires (in the reactor thread) with
+# its result, or fails with its exception
+def defer_to_db_thread(fn: Callable, *args: Any, **kwargs: Any) -> Deferred:
+    return threads.deferToThreadPool(reactor, get_db_thread_pool(), fn, *args, **kwargs)
@@ -0,0 +1,60 @@
+from typing import Set
+
+import logging
+from datetime import date
+
+from horse_scraper.database.article_db_handler import ArticleDbHandler
+
+
+class PersistedUrlIndex(object):
+    """
+    Urls of the successful articles of a source, loaded once when the spider
+    starts and updated as new articles are persisted, so that the pipeline and
+    the sitemap / crawl spiders tell in memory whether an article is already
+    persisted.
+
+    Urls are normalized as they are persisted (see ArticleDbHandler.sanitize_url).
+    The index covers the articles dated or scraped from from_date on: older
+    articles may be missing from it, so a missing url must still be checked in
+    the db.
+
+    Attributes:
+        article_source_id (str): source of the articles.
+        from_date (date): first date of the search period.
+        keep_query_string (bool): spider param used to normalize the urls.
+    """
+
+    urls: Set[str]
+
+    def __init__(
+        self,
+        handler: ArticleDbHandler,
+        article_source_id: str,
+        from_date: date,
+        keep_query_string: bool,
+    ):
+        self.handler = handler
+        self.article_source_id = article_source_id
+        self.from_date = from_date
+        self.keep_query_string = keep_query_string
+        self.urls = set()
+
+    def load(self):
+        self.urls = set(
+            self.handler.get_persisted_urls(self.article_source_id, self.from_date)
+        )
+        logging.info(
+            f"Persisted url index loaded: {len(self.urls)} urls since {self.from_date}"
+        )
+
+    def contains(self, url: str) -> bool:
+        return self.normalize(url) in self.urls
+
+    def add(self, url: str):
+        self.urls.add(self.normalize(url))
+
+    def remove(self, url: str):
+        self.urls.discard(self.normalize(url))
+
+    def normalize(self, url: str) -> str:
+        return self.handler.sanitize_url(url, self.keep_query_string)
@@ -5,10 +5,177 @@
 # Don't forget to add your pipeline to the ITEM_PIPELINES setting
 # See: https://docs.scrapy.org/en/latest/topics/item-pipeline.html
 
+import os
+import time
+import logging
+
+from twisted.internet import defer, task
+from twisted.internet.defer import DeferredLock
+
 from .database.article_db_handler import ArticleDbHandler
+from .database.db_connection_pool import get_db_pool, close_db_pool
+from .database.db_thread_pool import defer_to_db_thread
+from .services.utils.profiler import Profiler
+from horse_scraper.settings import (
+    PROFILER_EXPORT_DIR,
+    PROFILER_EXPORT_INTERVAL_SEC,
+    PIPELINE_BUFFER_ENABLED,
+    PIPELINE_BUFFER_SIZE,
+    PIPELINE_BUFFER_FLUSH_INTERVAL_SEC,
+)
 
 
 class HorseScraperPipeline(object):
+    def open_spider(self, spider):
+        export_path = None
+        if PROFILER_EXPORT_DIR is not None:
+            export_path = os.path.join(PROFILER_EXPORT_DIR, f"{spider.name}.prom")
+
+        self.profiler = Profiler(
+            "horse_scraper", export_path, PROFILER_EXPORT_INTERVAL_SEC
+        )
+        self.handler = ArticleDbHandler()
+
+        # Buffered mode: items are persisted by flush(), when the buffer is full,
+        # every PIPELINE_BUFFER_FLUSH_INTERVAL_SEC and when the spider is closed
+        self.buffer = []
+        self.last_flush_time = time.time()
+        # Batches are persisted one at a time, in order
+        self.flush_lock = DeferredLock()
+        self.flush_loop = None
+        if PIPELINE_BUFFER_ENABLED:
+            self.flush_loop = task.LoopingCall(self.flush_if_expired, spider)
+            self.flush_loop.start(PIPELINE_BUFFER_FLUSH_INTERVAL_SEC, now=False)
+
+    # The queries run on the db thread pool: the returned Deferred holds the item
+    # (and so the parsing, through CONCURRENT_ITEMS) until it is persisted
     def process_item(self, item, spider):
-        handler = ArticleDbHandler()
-        handler.persist(item, spider.params.keep_url_query_string)
+        persisted_urls = spider.persisted_urls
+
+        if persisted_urls is not None:
+            if persisted_urls.contains(item["url"]):
+                logging.info("Article already persisted --> skipping.")
+                logging.info("")
+                self.profiler.count("skipped_items")
+                return None
+            # Not in the index: still checked in the db by persist (the article may
+            # be older than the index). Added upfront, so that the url is not
+            # persisted twice meanwhile
+            if item["result"] == "success":
+                persisted_urls.add(item["url"])
+
+        if PIPELINE_BUFFER_ENABLED:
+            self.buffer.append(item)
+            if len(self.buffer) >= PIPELINE_BUFFER_SIZE:
+                return self.flush(spider)
+            return None
+
+        start_time = time.perf_counter()
+        d = defer_to_db_thread(
+            self.handler.persist, item, spider.params.keep_url_query_string
+        )
+        d.addCallback(self.on_item_persisted, start_time)
+        d.addErrback(self.on_item_failed, item, spider)
+        return d
+
+    def on_item_persisted(self, result, start_time):
+        self.profiler.observe("persist", time.perf_counter() - start_time)
+        self.profiler.count("items")
+        self.update_db_pool_stats()
+        self.profiler.maybe_export()
+
+    def on_item_failed(self, failure, item, spider):
+        if spider.persisted_urls is not None:
+            spider.persisted_urls.remove(item["url"])
+        return failure
+
+    def flush_if_expired(self, spider):
+        if time.time() - self.last_flush_time >= PIPELINE_BUFFER_FLUSH_INTERVAL_SEC:
+            return self.flush(spider)
+        return None
+
+    def flush(self, spider):
+        self.last_flush_time = time.time()
+        items = self.buffer
+        self.buffer = []
+        return self.flush_lock.run(self.persist_batch, items, spider)
+
+    def persist_batch(self, items, spider):
+        if len(items) == 0:
+            return None
+
+        start_time = time.perf_counter()
+        d = defer_to_db_thread(
+            self.handler.persist_many, items, spider.params.keep_url_query_string
+        )
+        d.addCallbacks(
+            self.on_batch_persisted,
+            self.on_batch_failed,
+            callbackArgs=(items, start_time),
+            errbackArgs=(items, spider),
+        )
+        return d
+
+    def on_batch_persisted(self, result, items, start_time):
+        self.profiler.observe("persist_batch", time.perf_counter() - start_time)
+        self.profiler.count("items", len(items))
+        self.profiler.count("batches")
+        self.update_db_pool_stats()
+        self.profiler.maybe_export()
+
+    def on_batch_failed(self, failure, items, spider):
+        # The items are persisted one by one, in order: only the ones that fail
+        # again are lost
+        logging.warning(
+            f">> Batch persist failed: {len(items)} items, persisting them one by one",
+            exc_info=(failure.type, failure.value, failure.getTracebackObject()),
+        )
+        self.profiler.count("failed_batches")
+
+        d = defer.succeed(None)
+        for item in items:
+            d.addCallback(self.persist_batch_item, item, spider)
+        return d
+
+    def persist_batch_item(self, result, item, spider):
+        start_time = time.perf_counter()
+        d = defer_to_db_thread(
+            self.handler.persist, item, spider.params.keep_url_query_string
+        )
+        d.addCallbacks(
+            self.on_item_persisted,
+            self.on_batch_item_failed,
+            callbackArgs=(start_time,),
+            errbackArgs=(item, spider),
+        )
+        return d
+
+    def on_batch_item_failed(self, failure, item, spider):
+        # The item is lost (it is scraped again on the next run)
+        logging.error(
+            f">> Item persist failed: {item['url']}",
+            exc_info=(failure.type, failure.value, failure.getTracebackObject()),
+        )
+        self.profiler.count("failed_items")
+        if spider.persisted_urls is not None:
+            spider.persisted_urls.remove(item["url"])
+
+    def close_spider(self, spider):
+        if self.flush_loop is not None and self.flush_loop.running:
+            self.flush_loop.stop()
+
+        d = self.flush(spider)
+        d.addBoth(self.on_closed)
+        return d
+
+    def on_closed(self, result):
+        self.update_db_pool_stats()
+        self.profiler.log_stats()
+        if self.profiler.export_path is not None:
+            self.profiler.export()
+        close_db_pool()
+
+    # Pool stats of the process (shared with the spider queries)
+    def update_db_pool_stats(self):
+        for name, value in get_db_pool().get_stats().items():
+            self.profiler.set_gauge(f"db_pool_{name}", value)
@@ -149,3 +149,36 @@ SITEMAP_PERIOD_DAYS_BACK = int(os.environ.get("PERIOD_DAYS_BACK") or 15)
 CRAWL_MAX_RUN_TIME_HOURS = int(os.environ.get("MAX_RUN_TIME_HOURS") or 6)
 SITEMAP_MAX_RUN_TIME_HOURS = int(os.environ.get("MAX_RUN_TIME_HOURS") or 6)
 
+# Pipeline stats (see services/utils/profiler.py) are exported every
+# PROFILER_EXPORT_INTERVAL_SEC to PROFILER_EXPORT_DIR/<spider name>.prom (if set)
+PROFILER_EXPORT_DIR = os.environ.get("PROFILER_EXPORT_DIR") or None
+PROFILER_EXPORT_INTERVAL_SEC = int(os.environ.get("PROFILER_EXPORT_INTERVAL_SEC") or 60)
+
+
+# Database connections pool (see database/db_connection_pool.py), per scrapyd job
+DB_POOL_MIN_SIZE = int(os.environ.get("DB_POOL_MIN_SIZE") or 1)
+DB_POOL_MAX_SIZE = int(os.environ.get("DB_POOL_MAX_SIZE") or 4)
+DB_POOL_HEALTH_CHECK_SEC = int(os.environ.get("DB_POOL_HEALTH_CHECK_SEC") or 30)
+
+# Threads running the pipeline queries off the reactor thread (see
+# database/db_thread_pool.py). Items waiting to be persisted are bounded by
+# CONCURRENT_ITEMS (per response), which throttles the parsing (backpressure).
+DB_THREAD_POOL_SIZE = int(os.environ.get("DB_THREAD_POOL_SIZE") or DB_POOL_MAX_SIZE)
+CONCURRENT_ITEMS = int(os.environ.get("CONCURRENT_ITEMS") or 100)
+
+# Buffered pipeline: items are persisted in batches (one transaction per batch)
+# of PIPELINE_BUFFER_SIZE items, or every PIPELINE_BUFFER_FLUSH_INTERVAL_SEC
+PIPELINE_BUFFER_ENABLED = os.environ.get("PIPELINE_BUFFER_ENABLED") == "True" or False
+PIPELINE_BUFFER_SIZE = int(os.environ.get("PIPELINE_BUFFER_SIZE") or 100)
+PIPELINE_BUFFER_FLUSH_INTERVAL_SEC = int(
+    os.environ.get("PIPELINE_BUFFER_FLUSH_INTERVAL_SEC") or 10
+)
+
+# Persisted url index (see database/persisted_url_index.py): the urls of the
+# source's articles of the search period are loaded when the spider starts, and
+# the pipeline and the spiders check them in memory: only the urls missing from
+# the index are checked in the db. Crawl spiders then skip the links to persisted
+# articles too.
+PERSISTED_URL_INDEX_ENABLED = (
+    os.environ.get("PERSISTED_URL_INDEX_ENABLED") == "True" or False
+)
@@ -109,7 +109,13 @@ class BaseArticleCrawlSpider(BaseArticleSpider, CrawlSpider):
         links_to_follow = []
 
         for link in links:
-            if self.params.should_follow_article_url(link.url):
-                links_to_follow.append(link)
+            if not self.params.should_follow_article_url(link.url):
+                continue
+            # already persisted article --> skip
+            if self.persisted_urls is not None and self.persisted_urls.contains(
+                self.params.pre_process_url(link.url)
+            ):
+                continue
+            links_to_follow.append(link)
 
         return links_to_follow
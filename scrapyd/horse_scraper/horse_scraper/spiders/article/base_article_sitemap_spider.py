@@ -6,7 +6,18 @@ import json
 import dateparser  # type: ignore
 from dateutil.parser import parse as dateutil_parse  # type: ignore
 
-from typing import Tuple, List, Dict, Any, Iterator, Generator, Union, Callable, cast
+from typing import (
+    Tuple,
+    List,
+    Dict,
+    Any,
+    Iterator,
+    Generator,
+    AsyncGenerator,
+    Union,
+    Callable,
+    cast,
+)
 from abc import abstractmethod
 
 import scrapy  # type: ignore
@@ -17,6 +28,7 @@ from scrapy.spiders.sitemap import iterloc  # type: ignore
 from scrapy.utils.log import configure_logging  # type: ignore
 from scrapy.utils.sitemap import sitemap_urls_from_robots  # type: ignore
 from scrapy.utils.gz import gunzip, gzip_magic_number  # type: ignore
+from scrapy.utils.defer import maybe_deferred_to_future  # type: ignore
 from scrapy.exceptions import CloseSpider  # type: ignore
 
 from datetime import datetime, date, timedelta
@@ -37,6 +49,7 @@ from horse_scraper.settings import (
     SITEMAP_MAX_RUN_TIME_HOURS,
 )
 from horse_scraper.database.article_db_handler import ArticleDbHandler
+from horse_scraper.database.db_thread_pool import defer_to_db_thread
 from horse_scraper.services.utils.sitemap import Sitemap
 
 from .base_article_spider import BaseArticleSpider
@@ -71,7 +84,10 @@ class BaseArticleSitemapSpider(BaseArticleSpider, SitemapSpider):
         for url in self.rss_urls:
             yield Request(url, self._parse_rss)
 
-    def sitemap_filter(self, entries: Any) -> Generator[Any, None, None]:
+    # The existence checks of the article entries run on the db thread pool
+    # (see get_not_already_persisted_entries): the filters are async generators,
+    # and so are the parse callbacks that use them
+    async def sitemap_filter(self, entries: Any) -> AsyncGenerator[Any, None]:
         # Check if max run time has been exceeded
         self.check_max_run_time()
 
@@ -146,7 +162,7 @@ class BaseArticleSitemapSpider(BaseArticleSpider, SitemapSpider):
 
         # Process article entries
         if len(article_entries) > 0:
-            for entry in self.get_not_already_persisted_entries(article_entries):
+            for entry in await self.get_not_already_persisted_entries(article_entries):
                 entry_date = entry["entry_date"]
                 logging.info(
                     f"--> Valid url (entry_date={entry_date}) >>> (parsing article): "
@@ -178,7 +194,7 @@ class BaseArticleSitemapSpider(BaseArticleSpider, SitemapSpider):
         # No entry_date field
         return None
 
-    def _parse_sitemap(self, response):
+    async def _parse_sitemap(self, response):
         # Check if max run time has been exceeded
         self.check_max_run_time()
 
@@ -202,7 +218,7 @@ class BaseArticleSitemapSpider(BaseArticleSpider, SitemapSpider):
                 urls,
             )
 
-            it = self.sitemap_filter(entries)
+            it = [entry async for entry in self.sitemap_filter(entries)]
 
             for loc in iterloc(it, self.sitemap_alternate_links):
                 for r, c in self._cbs:
@@ -222,7 +238,7 @@ class BaseArticleSitemapSpider(BaseArticleSpider, SitemapSpider):
                 return
 
             s = Sitemap(body)
-            it = self.sitemap_filter(s)
+            it = [entry async for entry in self.sitemap_filter(s)]
 
             if s.type == "sitemapindex":
                 for loc in iterloc(it, self.sitemap_alternate_links):
@@ -264,7 +280,7 @@ class BaseArticleSitemapSpider(BaseArticleSpider, SitemapSpider):
         elif response.url.endswith(".xml") or response.url.endswith(".xml.gz"):
             return response.body
 
-    def rss_filter(self, entries: Any) -> Generator[Any, None, None]:
+    async def rss_filter(self, entries: Any) -> AsyncGenerator[Any, None]:
         # Check if max run time has been exceeded
         self.check_max_run_time()
 
@@ -300,7 +316,7 @@ class BaseArticleSitemapSpider(BaseArticleSpider, SitemapSpider):
 
         # Process article entries
         if len(article_entries) > 0:
-            for entry in self.get_not_already_persisted_entries(article_entries):
+            for entry in await self.get_not_already_persisted_entries(article_entries):
                 entry_date = entry["entry_date"]
                 logging.info(
                     f"--> Valid url (entry_date={entry_date}) >>> (parsing article): "
@@ -308,7 +324,7 @@ class BaseArticleSitemapSpider(BaseArticleSpider, SitemapSpider):
                 )
                 yield entry
 
-    def _parse_rss(self, response):
+    async def _parse_rss(self, response):
         # Check if max run time has been exceeded
         self.check_max_run_time()
 
@@ -325,7 +341,7 @@ class BaseArticleSitemapSpider(BaseArticleSpider, SitemapSpider):
 
         it = self.rss_filter(response.xpath("//channel/item"))
 
-        for item in it:
+        async for item in it:
 
             url = item["loc"]
 
@@ -360,17 +376,29 @@ class BaseArticleSitemapSpider(BaseArticleSpider, SitemapSpider):
 
         return True
 
-    def get_not_already_persisted_entries(self, entries: List[Any]) -> List[Any]:
-        persisted_urls = self.db_handler.get_already_persisted_articles(
-            urls=list(map(lambda e: str(e["loc"]), entries)),
-            article_source_id=self.source_info.id,
-            keep_query_string=self.params.keep_url_query_string,
+    async def get_not_already_persisted_entries(self, entries: List[Any]) -> List[Any]:
+        if self.persisted_urls is not None:
+            # Only the urls missing from the index (possibly older) are checked in
+            # the db
+            entries = [e for e in entries if not self.persisted_urls.contains(e["loc"])]
+            if len(entries) == 0:
+                return entries
+
+        # Set of urls: O(1) membership checks. The query runs on the db thread
+        # pool, so that the reactor keeps downloading and parsing meanwhile
+        persisted_urls = await maybe_deferred_to_future(
+            defer_to_db_thread(
+                self.db_handler.get_already_persisted_articles,
+                urls=list(map(lambda e: str(e["loc"]), entries)),
+                article_source_id=self.source_info.id,
+                keep_query_string=self.params.keep_url_query_string,
+            )
         )
 
         result: List[Any] = []
 
         for entry in entries:
-            if entry["loc"] in persisted_urls:
+            if str(entry["loc"]) in persisted_urls:
                 continue
 
             result.append(entry)
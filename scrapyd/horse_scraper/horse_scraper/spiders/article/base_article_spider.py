@@ -35,8 +35,10 @@ from horse_scraper.settings import (
     PROXY_SCRAPOXY_PASSWORD,
     SCRAPOXY_IP_ADDRESS,
     SCRAPYD_NODE_ID,
+    PERSISTED_URL_INDEX_ENABLED,
 )
 from horse_scraper.database.article_db_handler import ArticleDbHandler
+from horse_scraper.database.persisted_url_index import PersistedUrlIndex
 from .base_article_spider_params import BaseArticleSpiderParams
 from .default_article_parser import DefaultArticleParser
 
@@ -58,12 +60,16 @@ class BaseArticleSpider:
 
     start_time: datetime
 
+    # Urls of the already persisted articles (None if disabled)
+    persisted_urls: Union[PersistedUrlIndex, None] = None
+
     def __init__(self, name: str, *args, **kwargs):
         self.setup_logger()
         self.log_info()
         self.init_date_span()
         self.init_source_info()
         self.init_params()
+        self.init_persisted_urls()
 
         self.start_time = datetime.now()
 
@@ -104,6 +110,17 @@ class BaseArticleSpider:
         handler = ArticleDbHandler()
         self.source_info = handler.get_spider_article_source_info(self.name)
 
+    def init_persisted_urls(self):
+        if not PERSISTED_URL_INDEX_ENABLED:
+            return
+        self.persisted_urls = PersistedUrlIndex(
+            ArticleDbHandler(),
+            self.source_info.id,
+            self.date_span.from_date_incl,
+            self.params.keep_url_query_string,
+        )
+        self.persisted_urls.load()
+
     def create_request(
         self,
         url,